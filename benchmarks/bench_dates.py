@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_dates.py
+
+Micro-benchmark of the date parsing: parse_date_exif against parse_date_fast on the date tags
+of synthetic ExifTool records (-time:all output of bursts of photos), checking that both give
+the same dates.
+
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'src'))
+import sortphotos
+
+TAGS = ['File:FileModifyDate', 'File:FileAccessDate', 'File:FileInodeChangeDate', 'EXIF:ModifyDate',
+        'EXIF:DateTimeOriginal', 'EXIF:CreateDate', 'MakerNotes:DateTimeOriginal', 'XMP:CreateDate',
+        'XMP:ModifyDate', 'XMP:MetadataDate', 'XMP:DateCreated', 'IPTC:DateCreated', 'Composite:SubSecCreateDate',
+        'Composite:SubSecDateTimeOriginal', 'Composite:SubSecModifyDate', 'Composite:GPSDateTime']
+
+
+def make_records(count, burst=20, seed=0):
+    """ExifTool-like records: files in bursts of photos taken the same second"""
+
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        if i % burst == 0:
+            taken = rng.randint(1262304000, 1577836799)
+            modified = taken + rng.randint(0, 86400 * 365)
+        date = time.strftime('%Y:%m:%d %H:%M:%S', time.gmtime(taken))
+        file_date = time.strftime('%Y:%m:%d %H:%M:%S', time.gmtime(modified)) + '+00:00'
+        record = {'SourceFile': 'dir/IMG_%07d.JPG' % i}
+        for tag in TAGS:
+            if tag.startswith('File:'):
+                record[tag] = file_date
+            elif tag.startswith('Composite:SubSec'):
+                record[tag] = date + '.%02d' % (i % burst)
+            elif tag.startswith('IPTC:'):
+                record[tag] = date[:10]
+            elif tag.startswith('XMP:'):
+                record[tag] = date + '+02:00'
+            else:
+                record[tag] = date
+        records.append(record)
+    return records
+
+
+def best_of(repeat, function):
+    """smallest wall time of repeat calls of function"""
+
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the date parsing of sortphotos')
+    parser.add_argument('--records', type=int, default=20000, help='number of records (default 20000)')
+    parser.add_argument('--burst', type=int, default=20, help='files taken the same second (default 20)')
+    parser.add_argument('--repeat', type=int, default=5, help='best of this many runs (default 5)')
+    args = parser.parse_args()
+
+    records = make_records(args.records, args.burst)
+    values = [value for record in records for key, value in record.items() if key != 'SourceFile']
+
+    def fast():
+        sortphotos.date_memo.clear()
+        return [sortphotos.parse_date_fast(value) for value in values]
+
+    assert fast() == [sortphotos.parse_date_exif(value) for value in values]
+
+    exif_seconds = best_of(args.repeat, lambda: [sortphotos.parse_date_exif(value) for value in values])
+    fast_seconds = best_of(args.repeat, fast)
+
+    def oldest():
+        sortphotos.date_memo.clear()
+        for record in records:
+            sortphotos.get_oldest_timestamp(record, ['File'], [])
+
+    oldest_seconds = best_of(args.repeat, oldest)
+
+    print(json.dumps({'records': len(records), 'values': len(values), 'burst': args.burst,
+                      'parse_date_exif_seconds': round(exif_seconds, 6),
+                      'parse_date_fast_seconds': round(fast_seconds, 6),
+                      'speedup': round(exif_seconds / fast_seconds, 2),
+                      'get_oldest_timestamp_records_per_sec': round(len(records) / oldest_seconds, 1)},
+                     sort_keys=True))
+
+if __name__ == '__main__':
+    main()
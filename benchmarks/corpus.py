@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+corpus.py
+
+Synthetic photo/video corpora for the benchmarks: JPEGs with EXIF dates, MP4s with
+QuickTime dates, JPEGs without any date and files whose names and dates collide.
+Everything is generated offline and is reproducible for a given seed.
+
+"""
+
+from __future__ import print_function
+import os
+import struct
+import random
+import time
+import argparse
+
+QUICKTIME_EPOCH = 2082844800  # seconds from 1904-01-01 to 1970-01-01
+FILES_PER_DIR = 1000
+
+# share of each kind of file in a corpus
+MIX = [('jpeg', 0.60), ('mp4', 0.15), ('nodate', 0.10), ('collision', 0.15)]
+# every date tag the files of a corpus have, besides the file system dates (see --priority-tags)
+DATE_TAGS = {
+    'JPG': ['EXIF:DateTimeOriginal'],
+    'MP4': ['QuickTime:CreateDate', 'QuickTime:ModifyDate', 'QuickTime:TrackCreateDate',
+            'QuickTime:TrackModifyDate', 'QuickTime:MediaCreateDate', 'QuickTime:MediaModifyDate'],
+}
+
+
+def jpeg(date=None, padding=b''):
+    """
+    a minimal JPEG with DateTimeOriginal (YYYY:MM:DD HH:MM:SS) in its EXIF, or without EXIF if date is None.
+    padding goes in a comment
+    """
+
+    comment = b'\xff\xfe' + struct.pack('>H', len(padding) + 2) + padding
+    if date is None:
+        return b'\xff\xd8' + comment + b'\xff\xd9'
+
+    value = date.encode('ascii') + b'\0'
+    # TIFF header, IFD0 holding the ExifIFD pointer, ExifIFD holding DateTimeOriginal, then the value
+    exif_offset = 8 + 2 + 12 + 4
+    value_offset = exif_offset + 2 + 12 + 4
+    tiff = b'II*\0' + struct.pack('<I', 8)
+    tiff += struct.pack('<HHHII', 1, 0x8769, 4, 1, exif_offset) + struct.pack('<I', 0)
+    tiff += struct.pack('<HHHII', 1, 0x9003, 2, len(value), value_offset) + struct.pack('<I', 0)
+    app1 = b'Exif\0\0' + tiff + value
+    return b'\xff\xd8\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + comment + b'\xff\xd9'
+
+
+def _atom(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def mp4(timestamp, padding=b''):
+    """a minimal MP4 whose movie, track and media headers are all dated timestamp (seconds since 1970, UTC)"""
+
+    t = timestamp + QUICKTIME_EPOCH
+    mvhd = _atom(b'mvhd', b'\0\0\0\0' + struct.pack('>IIII', t, t, 1000, 0) + b'\0' * 80)
+    tkhd = _atom(b'tkhd', b'\0\0\0\x07' + struct.pack('>IIII', t, t, 1, 0) + b'\0' * 64)
+    mdhd = _atom(b'mdhd', b'\0\0\0\0' + struct.pack('>IIII', t, t, 1000, 0) + b'\0' * 4)
+    trak = _atom(b'trak', tkhd + _atom(b'mdia', mdhd))
+    ftyp = _atom(b'ftyp', b'isom\0\0\2\0isomiso2mp41')
+    return ftyp + _atom(b'moov', mvhd + trak) + _atom(b'mdat', padding)
+
+
+def make_corpus(root, size, seed=0):
+    """
+    write size files below root (FILES_PER_DIR per directory, colliding files each in their own
+    subdirectory), returns the number of files of each kind
+    """
+
+    rng = random.Random(seed)
+    counts = dict((kind, 0) for kind, share in MIX)
+    kinds = []
+    for kind, share in MIX:
+        kinds += [kind] * int(round(share * size))
+    kinds = (kinds + ['jpeg'] * size)[:size]
+    rng.shuffle(kinds)
+
+    for i, kind in enumerate(kinds):
+        dirpath = os.path.join(root, 'dir%04d' % (i // FILES_PER_DIR))
+        if i % FILES_PER_DIR == 0 and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+
+        # random content so that no two files are duplicates
+        padding = struct.pack('<Q', rng.getrandbits(64))
+        timestamp = rng.randint(1262304000, 1577836799)  # 2010 to 2019
+        date = '%04d:%02d:%02d %02d:%02d:%02d' % time.gmtime(timestamp)[:6]
+
+        if kind == 'jpeg':
+            name, data = 'IMG_%07d.JPG' % i, jpeg(date, padding)
+        elif kind == 'mp4':
+            name, data = 'MOV_%07d.MP4' % i, mp4(timestamp, padding)
+        elif kind == 'nodate':
+            name, data = 'SCAN_%07d.JPG' % i, jpeg(None, padding)
+        else:
+            # same name and same date everywhere: they all end up in the same destination directory
+            dirpath = os.path.join(dirpath, 'burst%07d' % i)
+            os.mkdir(dirpath)
+            name, data = 'IMG_0001.JPG', jpeg('2015:06:01 12:00:00', padding)
+        counts[kind] += 1
+
+        with open(os.path.join(dirpath, name), 'wb') as f:
+            f.write(data)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic corpus for the sortphotos benchmarks')
+    parser.add_argument('root', type=str, help='directory to write the corpus to')
+    parser.add_argument('size', type=int, help='number of files')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default 0)')
+    args = parser.parse_args()
+
+    counts = make_corpus(args.root, args.size, args.seed)
+    print(', '.join('%d %s' % (counts[kind], kind) for kind, share in MIX))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+run_benchmarks.py
+
+Time each phase of sortphotos (discovery, extraction, date resolution, planning, transfer)
+on synthetic corpora and write the results as JSON lines, one per corpus size and phase,
+so that runs of different versions can be compared.
+
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'src'))
+import sortphotos
+from corpus import make_corpus, DATE_TAGS
+
+PHASES = ['discovery', 'extraction', 'date resolution', 'planning', 'transfer']
+
+
+def peak_rss():
+    """
+    peak resident set size in KiB of this process and of its (waited for) children, e.g. ExifTool.
+    It is the peak since the process started, so each corpus size is measured in its own process
+    """
+
+    scale = 1024 if sys.platform == 'darwin' else 1  # bytes on OS X, KiB elsewhere
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+
+def revision():
+    """git revision of the tree being benchmarked, if any"""
+
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.realpath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(src_dir, dest_dir, jobs=1, transfer_jobs=1, fast_dates=False, tiered=False):
+    """run the phases one after the other on src_dir, returns {phase: (seconds, number of files)}"""
+
+    args = ['-j', '-a', '-G', '-time:all']
+    timings = {}
+
+    with sortphotos.ExifToolPool(jobs, verbose=False) as e:
+        start = time.time()
+        files = sortphotos.list_files(src_dir, e.get_supported_extensions(), True)
+        timings['discovery'] = (time.time() - start, len(files))
+
+        reader = e
+        if tiered:
+            reader = sortphotos.TieredReader(reader, DATE_TAGS, ['File'])
+        if fast_dates:
+            reader = sortphotos.FastDateReader(reader)
+        start = time.time()
+        metadata = list(reader.iter_metadata(files, args))
+        timings['extraction'] = (time.time() - start, len(metadata))
+
+    start = time.time()
+    dates = [sortphotos.get_oldest_timestamp(data, ['File'], []) for data in metadata]
+    timings['date resolution'] = (time.time() - start, len(dates))
+
+    transfers = sortphotos.TransferExecutor(transfer_jobs).__enter__()
+    planner = sortphotos.MovePlanner(dest_dir, '%Y/%m-%b', None, copy_files=True, verbose=False,
+                                     transfers=transfers)
+    start = time.time()
+    operations = [planner.plan(src_file, date, keys) for src_file, date, keys in dates if date]
+    timings['planning'] = (time.time() - start, len(operations))
+
+    start = time.time()
+    for operation in operations:
+        transfers.submit(operation)
+    transfers.__exit__(None, None, None)
+    timings['transfer'] = (time.time() - start, len(operations))
+
+    return timings
+
+
+def measure(*args):
+    """benchmark(*args) and the peak RSS it took, to run in a new process"""
+
+    timings = benchmark(*args)
+    return timings, peak_rss()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the phases of sortphotos on synthetic corpora')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='corpus sizes in number of files (default 1000 10000, up to 1000000)')
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help='where corpora are generated and kept between runs (default: a temporary directory)')
+    parser.add_argument('--jobs', type=int, default=1, help='number of ExifTool processes (default 1)')
+    parser.add_argument('--transfer-jobs', type=int, default=1, help='number of copies at the same time (default 1)')
+    parser.add_argument('--fast-dates', action='store_true', help='read JPEG/MP4 dates without ExifTool')
+    parser.add_argument('--tiered', action='store_true', help='read the date tags of the corpus files first (see --priority-tags)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the corpora (default 0)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='append the results (JSON lines) to this file instead of printing them')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='sortphotos-bench-')
+    output = open(args.output, 'a') if args.output else sys.stdout
+    common = {'revision': revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'jobs': args.jobs, 'transfer_jobs': args.transfer_jobs, 'fast_dates': args.fast_dates,
+              'tiered': args.tiered, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    try:
+        for size in args.sizes:
+            src_dir = os.path.join(work_dir, 'corpus-%d-%d' % (size, args.seed))
+            if not os.path.isdir(src_dir):
+                print('Generating %d files in %s' % (size, src_dir), file=sys.stderr)
+                make_corpus(src_dir, size, args.seed)
+
+            dest_dir = os.path.join(work_dir, 'sorted-%d' % size)
+            shutil.rmtree(dest_dir, ignore_errors=True)
+            with ProcessPoolExecutor(max_workers=1) as process:  # a new one for each size
+                timings, (rss, children_rss) = process.submit(measure, src_dir, dest_dir, args.jobs,
+                                                              args.transfer_jobs, args.fast_dates,
+                                                              args.tiered).result()
+            shutil.rmtree(dest_dir, ignore_errors=True)
+
+            for phase in PHASES:
+                seconds, files = timings[phase]
+                result = dict(common, size=size, phase=phase, seconds=round(seconds, 6), files=files,
+                              files_per_sec=round(files / seconds, 1) if seconds > 0 else None,
+                              peak_rss_kb=rss, peak_children_rss_kb=children_rss)
+                output.write(json.dumps(result, sort_keys=True) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ Copyright (c) L. Dufréchou. All rights reserved.
 
 """
 import os
+import sys
 
 WATCH_DIR     = "~/Documents/incoming_photos"
 SORTED_DIR    = "~/Documents/sorted_photos"
@@ -22,5 +23,9 @@ FSWATCH       = 'fswatch'
 
 sortphotos_cmd  = ' '.join(['python', SORTPHOTOS, MANDATORY_OPT, USER_OPTIONS, WATCH_DIR, SORTED_DIR])
 
-fswatch_cmd     = FSWATCH+' '+WATCH_DIR+' | ' + sortphotos_cmd
-os.system(fswatch_cmd)
+if sys.platform.startswith('linux'):
+    # sortphotos watches the directory itself with inotify, no need for fswatch
+    os.system(sortphotos_cmd + ' --inotify')
+else:
+    fswatch_cmd     = FSWATCH+' '+WATCH_DIR+' | ' + sortphotos_cmd
+    os.system(fswatch_cmd)
@@ -16,16 +16,61 @@ import sys
 import shutil
 import fnmatch #used for filtering files
 import select #used by stdin watcher
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir  # python 2 needs the "scandir" package
 try:
     import json
 except:
     import simplejson as json
 import filecmp
 from datetime import datetime, timedelta
+from calendar import timegm as calendar_timegm
 import re
 import locale
+import sqlite3  # used by the metadata cache
+import codecs
+import io
+import hashlib
+import mmap
+import struct
+import stat
+import time
+import threading
+import contextlib
+import errno
+import ctypes  # used by the inotify watcher
+import socket  # used by the ExifTool daemon
+import signal
+import tempfile
+import ctypes.util
+try:
+    import fcntl  # used to lock the destination
+except ImportError:
+    fcntl = None  # windows
+try:
+    from contextlib import ExitStack
+except ImportError:
+    from contextlib2 import ExitStack  # python 2 needs the "contextlib2" package
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED  # python 2 needs the "futures" backport
+from concurrent.futures import TimeoutError as FutureTimeout
+try:
+    from os import fsencode, fsdecode
+except ImportError:
+    fsencode = fsdecode = lambda path: path  # python 2 paths are bytes already
 
 exiftool_location = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Image-ExifTool', 'exiftool')
+# unix socket of the ExifTool daemon (sortphotos.py --daemon), used instead of starting perl when it is running
+# (in the private runtime directory of the user if there is one)
+daemon_socket = os.environ.get('SORTPHOTOS_SOCKET') or os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+    'sortphotos-%d.sock' % (os.getuid() if hasattr(os, 'getuid') else 0))
 TERMINAL_APP  = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'tools', 'terminal-notifier.app/Contents/MacOS/terminal-notifier')
 
 # -------- convenience methods -------------
@@ -109,6 +154,53 @@ def parse_date_exif(date_string):
     return date
 
 
+# YYYY:MM:DD, optionally followed by HH:MM[:SS[.ss]] and a Z or +HH:MM/-HH:MM time zone
+date_pattern = re.compile(r'(\d{4}):(\d\d):(\d\d)'
+                          r'(?: (\d\d):(\d\d)(?::(\d\d)(?:\.\d*)?)?(?:Z|([+-])(\d\d):(\d\d))?)?$')
+date_memo = {}  # date string -> parsed date, for the strings seen recently
+DATE_MEMO_SIZE = 4096
+
+
+def parse_date_fast(date_string):
+    """
+    same as parse_date_exif, but remembers the strings seen recently (dates repeat a lot between the
+    tags of a file and between the files of a burst) and parses the usual formats with a precompiled
+    pattern, anything else is handed to parse_date_exif
+    """
+
+    try:
+        return date_memo[date_string]
+    except KeyError:
+        pass
+    except TypeError:
+        return parse_date_exif(date_string)
+
+    match = date_pattern.match(date_string) if isinstance(date_string, str) else None
+    year = int(match.group(1)) if match else 0
+    if 1900 <= year < 9999:  # other years may not format or may overflow with the time zone
+        hour, minute, second = 12, 0, 0  # defaulting to noon if no time data provided
+        if match.group(4):
+            hour = int(match.group(4))
+            minute = int(match.group(5))
+            if match.group(6):
+                second = int(match.group(6))
+        try:
+            date = datetime(year, int(match.group(2)), int(match.group(3)), hour, minute, second)
+        except ValueError:
+            date = None  # errors in time format
+        if date is not None and match.group(7):
+            time_zone_hour = int(match.group(8))
+            if match.group(7) == '-':
+                time_zone_hour *= -1
+            date += timedelta(hours=time_zone_hour, minutes=int(match.group(9)))
+    else:
+        date = parse_date_exif(date_string)
+
+    if len(date_memo) >= DATE_MEMO_SIZE:
+        date_memo.clear()
+    date_memo[date_string] = date
+    return date
+
 
 def get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_ignore, print_all_tags=False):
     """data as dictionary from json.  Should contain only time stamps except SourceFile"""
@@ -122,8 +214,8 @@ def get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_i
     src_file = data['SourceFile']
 
     # ssetup tags to ignore
-    ignore_groups = ['ICC_Profile'] + additional_groups_to_ignore
-    ignore_tags = ['SourceFile', 'XMP:HistoryWhen'] + additional_tags_to_ignore
+    ignore_groups = set(['ICC_Profile'] + additional_groups_to_ignore)
+    ignore_tags = set(['SourceFile', 'XMP:HistoryWhen'] + additional_tags_to_ignore)
 
 
     if print_all_tags:
@@ -133,7 +225,7 @@ def get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_i
     for key in data.keys():
 
         # check if this key needs to be ignored, or is in the set of tags that must be used
-        if (key not in ignore_tags) and (key.split(':')[0] not in ignore_groups) and 'GPS' not in key:
+        if (key not in ignore_tags) and (key.partition(':')[0] not in ignore_groups) and 'GPS' not in key:
 
             date = data[key]
 
@@ -144,7 +236,7 @@ def get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_i
             if isinstance(date, list):
                 date = date[0]
 
-            exifdate = parse_date_exif(date)
+            exifdate = parse_date_fast(date)
             if exifdate and exifdate < oldest_date:
                 date_available = True
                 oldest_date = exifdate
@@ -162,373 +254,3200 @@ def get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_i
     return src_file, oldest_date, oldest_keys
 
 
+def priority_tags_for(src_file, priority_tags):
+    """
+    all the date tags of a file, from its extension (see parse_priority_tags), or [] if they are not
+    known for its type
+    """
+
+    extension = os.path.splitext(src_file)[1][1:].upper()
+    return priority_tags.get(extension, priority_tags.get('*', []))
+
 
-def check_for_early_morning_photos(date, day_begins):
+def check_for_early_morning_photos(date, day_begins, verbose=True):
     """check for early hour photos to be grouped with previous day"""
 
     if date.hour < day_begins:
-        print('moving this photo to the previous day for classification purposes (day_begins=' + str(day_begins) + ')')
+        if verbose:
+            print('moving this photo to the previous day for classification purposes (day_begins=' + str(day_begins) + ')')
         date = date - timedelta(hours=date.hour+1)  # push it to the day before for classificiation purposes
 
     return date
 
 
+class RunStats(object):
+    """
+    timers (seconds) and counters of a run, e.g. stats.add('collisions') or
+    with stats.timer('planning'): ...  They can be updated from several threads (timers of
+    steps running in parallel add up).
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def timed(self, iterable, name):
+        """iterate over iterable, adding the time spent waiting for each item to timer name"""
+
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(name, time.time() - start)
+            yield item
+
+    def merge(self, other):
+        """add the timers and counters of other (e.g. totals over the batches of watch mode)"""
+
+        for name, value in other.counters.items():
+            self.add(name, value)
+        for name, seconds in other.timers.items():
+            self.add_time(name, seconds)
+
+    def as_dict(self):
+        with self.lock:
+            return {'counters': dict(self.counters), 'seconds': dict(self.timers)}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    def write_prometheus(self, path, prefix='sortphotos'):
+        """
+        write the stats in the Prometheus text format, for the textfile collector of the node exporter
+        (written to a temporary file first so that a partial file is never read)
+        """
+
+        stats = self.as_dict()
+        lines = []
+        for name, value in sorted(stats['counters'].items()):
+            metric = '%s_%s_total' % (prefix, name)
+            lines += ['# TYPE %s counter' % metric, '%s %d' % (metric, value)]
+        for name, seconds in sorted(stats['seconds'].items()):
+            metric = '%s_%s_seconds_total' % (prefix, name)
+            lines += ['# TYPE %s counter' % metric, '%s %f' % (metric, seconds)]
+        metric = '%s_last_run_timestamp_seconds' % prefix
+        lines += ['# TYPE %s gauge' % metric, '%s %d' % (metric, time.time())]
+
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(path + '.tmp', path)
+
+
+def compile_ignore_list(ignore_list):
+    """
+    a single regex matching the file names that match any of the glob patterns in ignore_list
+    (None if there are none).  The name of the group that matched is f<index of the pattern>
+    """
+
+    if not ignore_list:
+        return None
+    return re.compile('|'.join('(?P<f%d>%s)' % (i, fnmatch.translate(pattern))
+                               for i, pattern in enumerate(ignore_list)))
+
+
+def _keep_file(path, name, extensions, ignore, ignored):
+    """
+    whether a file should be read: not hidden and with one of the extensions.  Files matching ignore
+    are appended to ignored as (path, index of the pattern) instead
+    """
+
+    if ignore is not None:
+        match = ignore.match(name)
+        if match:
+            if ignored is not None:
+                ignored.append((path, int(match.lastgroup[1:])))
+            return False
+    if name.startswith('.'):
+        return False
+    if extensions is not None:
+        ext = os.path.splitext(name)[1][1:].upper()
+        if not ext or ext not in extensions:
+            return False
+    return True
+
+
+def list_files(src_dir, extensions=None, recursive=False, ignore=None, ignored=None):
+    """
+    list the files in src_dir in the same order ExifTool scans them
+    (directory entries in readdir order, descending into subdirectories as they are found,
+    skipping directories that start with '.').  Symbolic links to directories are followed, as by
+    exiftool -r, except to a directory already scanned (a loop, or a second link to it).  Hidden files
+    are left out, and if extensions is given only files with one of those (upper case) extensions are
+    kept, as ExifTool does for directories.
+    Files whose name matches the compiled ignore regex are left out and appended to ignored.
+    """
+
+    st = os.stat(src_dir)
+    files = []
+    _scan_dir(src_dir, extensions, recursive, ignore, ignored, set([(st.st_dev, st.st_ino)]), files)
+    return files
+
+
+def _scan_dir(src_dir, extensions, recursive, ignore, ignored, scanned, files):
+    """append the files of src_dir to files (see list_files), scanned is the set of (st_dev, st_ino) of the directories"""
+
+    for entry in list(scandir(src_dir)):
+        if entry.is_dir():
+            if recursive and not entry.name.startswith('.'):
+                st = entry.stat()
+                if (st.st_dev, st.st_ino) not in scanned:
+                    scanned.add((st.st_dev, st.st_ino))
+                    _scan_dir(entry.path, extensions, recursive, ignore, ignored, scanned, files)
+        elif _keep_file(entry.path, entry.name, extensions, ignore, ignored):
+            files.append(entry.path)
+
+
+def select_files(paths, src_dir, extensions=None, recursive=False, ignore=None, ignored=None):
+    """
+    the paths (e.g. reported by a file watcher) that list_files(src_dir, extensions, recursive, ...)
+    would list: existing files inside src_dir (directly inside unless recursive, never inside a directory
+    starting with '.') with one of the extensions.  Duplicates are dropped and the order is kept.
+    """
+
+    src_dir = os.path.abspath(src_dir)
+    files = []
+    seen = set()
+    for path in paths:
+        if path in seen:
+            continue
+        seen.add(path)
+        if not os.path.isfile(path):
+            continue
+
+        parts = os.path.relpath(os.path.abspath(path), src_dir).split(os.sep)
+        if parts[0] == os.pardir:
+            continue
+        if len(parts) > 1 and (not recursive or any(part.startswith('.') for part in parts[:-1])):
+            continue
+
+        if _keep_file(path, parts[-1], extensions, ignore, ignored):
+            files.append(path)
+
+    return files
+
+
+def utf8_path(path):
+    """
+    whether path is valid UTF-8: ExifTool answers for other file names with their invalid bytes
+    replaced, so their records can't be told apart
+    """
+
+    try:
+        if isinstance(path, bytes):
+            path.decode('utf-8')
+        else:
+            path.encode('utf-8')
+    except UnicodeError:
+        return False
+    return True
+
+
 #  this class is based on code from Sven Marnach (http://stackoverflow.com/questions/10075115/call-exiftool-from-a-python-script)
 class ExifTool(object):
-    """used to run ExifTool from Python and keep it open"""
+    """
+    used to run ExifTool from Python and keep it open.
+    Requests are numbered (-execute<N> answered by {ready<N>}) so several can be in flight at once:
+    submit() returns a Future, and a reader thread resolves the futures as the answers come back.
+    The futures of a process that exits fail with RuntimeError.  Its stderr is kept in errors
+    (the last lines), and printed in verbose mode.
+    """
 
-    sentinel = "{ready}"
+    sentinel = "{ready%d}"
 
     def __init__(self, executable=exiftool_location, verbose=False):
         self.executable = executable
         self.verbose = verbose
 
     def __enter__(self):
-        self.process = subprocess.Popen(
-            ['perl', self.executable, "-stay_open", "True",  "-@", "-"],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.process = None
+        if self.executable == exiftool_location:
+            self.process = DaemonConnection.connect(daemon_socket)
+        if self.process is None:
+            self.process = subprocess.Popen(
+                ['perl', self.executable, "-stay_open", "True",  "-@", "-"],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.lock = threading.Lock()
+        self.pending = deque()  # (number, future) of the requests in flight, oldest first
+        self.number = 0
+        self.exited = False
+        self.errors = deque(maxlen=20)  # last lines written to stderr
+        self.reader = threading.Thread(target=self._read_output)
+        self.reader.daemon = True
+        self.reader.start()
+        self.error_reader = threading.Thread(target=self._read_errors)
+        self.error_reader.daemon = True
+        self.error_reader.start()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.process.stdin.write(b"-stay_open\nFalse\n")
-        self.process.stdin.flush()
+        try:
+            self.process.stdin.write(b"-stay_open\nFalse\n")
+            self.process.stdin.flush()
+        except (IOError, OSError):
+            pass  # already exited, e.g. interrupted with ctrl-c along with us
+        deadline = time.time() + 10  # python 2 has no Popen.wait(timeout)
+        while self.process.poll() is None:
+            if time.time() > deadline:
+                self.kill()
+                break
+            time.sleep(0.05)
+
+    def kill(self):
+        """stop the process right away (e.g. when it hangs), its pending requests fail"""
+
+        try:
+            self.process.kill()
+        except OSError:
+            pass  # already exited
+        self.process.wait()
+
+    def submit(self, *args):
+        """send a request to exiftool, returns a Future of its (text) output"""
+
+        future = Future()
+        future.exiftool = self
+        with self.lock:
+            if self.exited:
+                future.set_exception(RuntimeError('ExifTool exited'))
+                return future
+            args = args + ("-execute%d\n" % (self.number + 1),)
+            request = str.join("\n", args)
+            if not isinstance(request, bytes):
+                try:
+                    request = request.encode('utf-8', 'surrogateescape')  # file names as their bytes
+                except UnicodeEncodeError as e:
+                    future.set_exception(ValueError('Cannot pass to ExifTool: %s' % e))
+                    return future
+            self.number += 1
+            entry = (self.number, future)
+            self.pending.append(entry)  # before the answer can come back
+            try:
+                self.process.stdin.write(request)
+                self.process.stdin.flush()
+            except (IOError, OSError):
+                self.pending.remove(entry)  # exited, not sent so not waited for
+                future.set_exception(RuntimeError('ExifTool exited'))
+        return future
 
     def execute(self, *args):
-        args = args + ("-execute\n",)
-        self.process.stdin.write(str.join("\n", args).encode('utf-8'))
-        self.process.stdin.flush()
-        output = ""
+        return self.submit(*args).result()
+
+    def _read_output(self):
+        """
+        reader thread: decodes the output incrementally (a utf-8 character can be split between
+        two reads) and only searches the newly read text (plus a short tail) for the next sentinel
+        """
+
+        decoder = codecs.getincrementaldecoder('utf-8')()
         fd = self.process.stdout.fileno()
-        while not output.rstrip(' \t\n\r').endswith(self.sentinel):
-            increment = os.read(fd, 4096).decode('utf-8')
+        pieces = []  # output of the oldest pending request so far
+        tail = ''  # end of that output, in case a sentinel is split between two reads
+        while True:
+            increment = os.read(fd, 65536)
+            if not increment:
+                break
+            text = decoder.decode(increment)
+            if self.verbose:
+                sys.stdout.write(text)
+
+            while text and self.pending:
+                number, future = self.pending[0]
+                sentinel = self.sentinel % number
+                window = tail + text
+                pos = window.find(sentinel)
+                if pos < 0:
+                    pieces.append(text)
+                    tail = window[-len(sentinel):]
+                    break
+
+                cut = pos - len(tail)  # sentinel position in text (negative if it starts in the tail)
+                output = ''.join(pieces)
+                if cut < 0:
+                    output = output[:cut]
+                else:
+                    output += text[:cut]
+                text = text[cut + len(sentinel):]
+                pieces = []
+                tail = ''
+                with self.lock:
+                    self.pending.popleft()
+                future.set_result(output.strip(' \t\n\r'))
+
+        # exiftool exited, nothing else will be answered
+        with self.lock:
+            self.exited = True
+            while self.pending:
+                self.pending.popleft()[1].set_exception(RuntimeError('ExifTool exited'))
+
+    def _read_errors(self):
+        for line in iter(self.process.stderr.readline, b''):
+            line = line.decode('utf-8', 'replace').rstrip()
+            self.errors.append(line)
             if self.verbose:
-                sys.stdout.write(increment)
-            output += increment
-        return output.rstrip(' \t\n\r')[:-len(self.sentinel)]
+                sys.stderr.write(line + '\n')
 
-    def get_metadata(self, *args):
+    @staticmethod
+    def parse_metadata(output, verbose=True):
+        """metadata from the JSON output of exiftool"""
 
         try:
-            return json.loads(self.execute(*args))
+            return json.loads(output)
         except ValueError:
-            sys.stdout.write('No files to parse or invalid data\n')
+            if verbose:
+                sys.stdout.write('No files to parse or invalid data\n')
             return {}
 
+    def get_metadata(self, *args):
 
-# ---------------------------------------
+        return self.parse_metadata(self.execute(*args))
 
+    def get_supported_extensions(self):
+        """set of (upper case) file extensions ExifTool can read"""
 
+        output = self.execute('-listf')
+        return set(output.split(':', 1)[-1].split())
 
-def sortPhotos(src_dir, dest_dir, sort_format, rename_format, recursive=False,
-        copy_files=False, test=False, remove_duplicates=True, day_begins=0,
-        additional_groups_to_ignore=['File'], additional_tags_to_ignore=[],
-        use_only_groups=None, use_only_tags=None, verbose=True,
-        ignore_list=[], remove_ignored_files=False, remove_empty_dirs=False):
+
+class DaemonConnection(object):
+    """
+    connection to an ExifToolDaemon, with the parts of subprocess.Popen used by ExifTool
+    (stdin, stdout, stderr, poll, wait and kill), so that ExifTool uses it like its own perl process.
+    It counts as exited once the daemon has closed the connection (or it was killed).
     """
-    This function is a convenience wrapper around ExifTool based on common usage scenarios for sortphotos.py
 
-    Parameters
-    ---------------
-    src_dir : str
-        directory containing files you want to process
-    dest_dir : str
-        directory where you want to move/copy the files to
-    sort_format : str
-        date format code for how you want your photos sorted
-        (https://docs.python.org/2/library/datetime.html#strftime-and-strptime-behavior)
-    rename_format : str
-        date format code for how you want your files renamed
-        (https://docs.python.org/2/library/datetime.html#strftime-and-strptime-behavior)
-        None to not rename file
-    recursive : bool
-        True if you want src_dir to be searched recursively for files (False to search only in top-level of src_dir)
-    copy_files : bool
-        True if you want files to be copied over from src_dir to dest_dir rather than moved
-    test : bool
-        True if you just want to simulate how the files will be moved without actually doing any moving/copying
-    remove_duplicates : bool
-        True to remove files that are exactly the same in name and a file hash
-    day_begins : int
-        what hour of the day you want the day to begin (only for classification purposes).  Defaults at 0 as midnight.
-        Can be used to group early morning photos with the previous day.  must be a number between 0-23
-    additional_groups_to_ignore : list(str)
-        tag groups that will be ignored when searching for file data.  By default File is ignored
-    additional_tags_to_ignore : list(str)
-        specific tags that will be ignored when searching for file data.
-    use_only_groups : list(str)
-        a list of groups that will be exclusived searched across for date info
-    use_only_tags : list(str)
-        a list of tags that will be exclusived searched across for date info
-    verbose : bool
-        True if you want to see details of file processing
-    ignore : list(str)
-        a list of files to be ignored separated by ',' , example: --ignore '.*,*.db' (be aware to put the filter between bracket to avoid side effect with command line)
-    remove_ignored_files : bool
-        True to remove files that are ignored with ignore_list parameter
-    remove_empty_dirs : bool
-        True to empty dirs once processing is done
+    def __init__(self, sock):
+        self.socket = sock
+        self.stdin = sock.makefile('wb')
+        self.stdout = sock  # only its fileno() is used
+        self.stderr = io.BytesIO()  # errors stay with the daemon
+        self.returncode = None
+
+    @staticmethod
+    def owned(socket_path):
+        """
+        whether socket_path is a socket of the current user: a daemon of another user would be sent
+        every file path and could answer with other files to move
+        """
+
+        try:
+            st = os.lstat(socket_path)
+        except OSError:
+            return False
+        return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+    @staticmethod
+    def peer_owned(sock):
+        """whether the process listening at the other end of sock runs as the current user (linux only)"""
+
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return True  # the owner of the socket file was checked
+        pid, uid, gid = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                            struct.calcsize('3i')))
+        return uid == os.getuid()
+
+    @classmethod
+    def connect(cls, socket_path):
+        """connection to the daemon of the current user listening on socket_path, None if it is not running"""
+
+        if not hasattr(socket, 'AF_UNIX') or not cls.owned(socket_path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except socket.error:
+            sock.close()
+            return None
+        if not cls.peer_owned(sock):
+            sock.close()
+            return None
+        return cls(sock)
+
+    def poll(self):
+        """None while the daemon keeps the connection open, without reading what the reader thread is due"""
+
+        if self.returncode is None:
+            try:
+                closed = self.socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+            except (IOError, OSError) as e:
+                closed = e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK)
+            if closed:
+                self.kill()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self.kill()
+        return self.returncode
+
+    def kill(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)  # ends the reader thread, later writes fail
+        except (IOError, OSError):
+            pass  # already closed
+        self.socket.close()
+        self.returncode = 0
+
+
+class ExifToolDaemon(object):
+    """
+    keeps warm ExifTool processes (perl and its tag tables already loaded) behind a unix socket.
+    Each client connection gets an idle process to itself and talks to it as if it had started it;
+    when the client leaves, the process is drained of unread answers and kept for the next client.
+    More clients than jobs at once get processes started for them, which are stopped when they leave
+    (at most jobs processes are kept).
     """
 
-    # some error checking
-    if not os.path.exists(src_dir):
-        raise Exception('Source directory does not exist')
+    drain = b"-ver\n-execute999999999\n"
+    drained = b"{ready999999999}"
 
-    # setup arguments to exiftool
-    args = ['-j', '-a', '-G']
+    def __init__(self, socket_path=None, jobs=1, executable=exiftool_location, verbose=False, timeout=30):
+        self.socket_path = socket_path or daemon_socket
+        self.jobs = max(1, jobs)
+        self.executable = executable
+        self.verbose = verbose
+        self.timeout = timeout  # to drain a process before giving up on it
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _start(self):
+        return subprocess.Popen(['perl', self.executable, "-stay_open", "True",  "-@", "-"],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=None if self.verbose else open(os.devnull, 'wb'))
+
+    def _acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self._start()
+
+    def _stop_process(self, process):
+        process.kill()
+        process.wait()
+
+    def _release(self, process):
+        """keep process for the next client if there is room and its output can be drained, otherwise stop it"""
+
+        with self.lock:
+            keep = len(self.idle) < self.jobs
+        if not keep:
+            self._stop_process(process)
+            return
+
+        fd = process.stdout.fileno()
+        output = b''
+        deadline = time.time() + self.timeout
+        try:
+            process.stdin.write(self.drain)
+            process.stdin.flush()
+            while self.drained not in output[-65536 - len(self.drained):]:
+                ready, _, _ = select.select([fd], [], [], max(0, deadline - time.time()))
+                increment = os.read(fd, 65536) if ready else b''
+                if not increment:
+                    raise IOError('ExifTool does not answer')
+                output = output[-len(self.drained):] + increment
+        except (IOError, OSError):
+            self._stop_process(process)
+            process = self._start()
+        with self.lock:
+            if len(self.idle) >= self.jobs:
+                self._stop_process(process)  # others were released meanwhile
+            else:
+                self.idle.append(process)
 
-    # setup tags to ignore
-    if use_only_tags is not None:
-        additional_groups_to_ignore = []
-        additional_tags_to_ignore = []
-        for t in use_only_tags:
-            args += ['-' + t]
+    def _serve(self, conn):
+        """relay between a client and an ExifTool process, until the client asks it to exit or leaves"""
 
-    elif use_only_groups is not None:
-        additional_groups_to_ignore = []
-        for g in use_only_groups:
-            args += ['-' + g + ':Time:All']
+        process = self._acquire()
+        fd = process.stdout.fileno()
+        held = b''  # incomplete line, or '-stay_open' waiting to see if 'False' follows
+        try:
+            while True:
+                ready, _, _ = select.select([conn, fd], [], [])
+                if fd in ready:
+                    output = os.read(fd, 65536)
+                    if not output:
+                        process.wait()
+                        process = self._start()  # exited, the client sees the connection close
+                        break
+                    conn.sendall(output)
+                if conn in ready:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    lines = (held + data).split(b'\n')
+                    held = lines.pop()
+                    if lines and lines[-1] == b'-stay_open':
+                        held = lines.pop() + b'\n' + held
+                    if b'-stay_open\nFalse' in b'\n'.join(lines) or held.startswith(b'-stay_open\nFalse'):
+                        break  # the client is done, the process is not
+                    if lines:
+                        process.stdin.write(b'\n'.join(lines) + b'\n')
+                        process.stdin.flush()
+        except (IOError, OSError):
+            pass  # the client went away
+        finally:
+            conn.close()
+            self._release(process)
+
+    @staticmethod
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
+
+    def serve_forever(self):
+        if DaemonConnection.connect(self.socket_path) is not None:
+            raise Exception('An ExifTool daemon is already listening on ' + self.socket_path)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # left by a daemon that did not stop cleanly
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)  # the files are read with our permissions: only we may connect
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+        signal.signal(signal.SIGTERM, self._stop)
+        self.idle = [self._start() for i in range(self.jobs)]
+        if self.verbose:
+            print('ExifTool daemon listening on %s with %d processes' % (self.socket_path, self.jobs))
+        try:
+            while True:
+                conn, _ = server.accept()
+                thread = threading.Thread(target=self._serve, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+            for process in self.idle:
+                self._stop_process(process)
 
-    else:
-        args += ['-time:all']
 
+class ExifToolPool(object):
+    """
+    a pool of ExifTool processes used to extract metadata from batches of files concurrently.
+    The processes are supervised: a batch that takes longer than timeout seconds, or whose process
+    dies, is read again file by file on a restarted process, and the files that still fail are
+    put in quarantine (skipped from then on) so that the rest of the batch goes through.
+    Batches are read at the pace set by throttle (a Throttle), if given.
+    """
 
-    if recursive:
-        args += ['-r']
+    def __init__(self, jobs=1, executable=exiftool_location, verbose=False, timeout=120, throttle=None):
+        self.jobs = max(1, jobs)
+        self.executable = executable
+        self.verbose = verbose
+        self.timeout = timeout
+        self.throttle = throttle
+        self.depth = 0  # the pool can be entered again (e.g. by sortPhotos in watch mode) and stays open
+        self.quarantine = []  # files exiftool hangs or crashes on
+        self.restarts = 0
 
-    args += [src_dir]
+    def __enter__(self):
+        if self.depth == 0:
+            self.tools = [ExifTool(self.executable, self.verbose).__enter__() for i in range(self.jobs)]
+        self.depth += 1
+        return self
 
-    if ignore_list is not None:
-        ignore_list = ignore_list.split(',')
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            for tool in self.tools:
+                tool.__exit__(exc_type, exc_value, traceback)
 
-    print("Scanning for files matching:%s"%(ignore_list))
-    # in recursive mode, if the user ask to remove ignored files we scan and remove them before running exiftool
-    if recursive and remove_ignored_files and len(ignore_list) > 0:
-        for root, dirs, files in os.walk(src_dir):
-            for current_file in files:
-                for _filter in ignore_list:
-                    if fnmatch.fnmatch(os.path.split(current_file)[-1], _filter):
-                        file_to_delete = os.path.join(root,current_file)
-                        print("File [%s] match ignored file filter [%s]: deleting."%(file_to_delete,_filter))
-                        if not test:
-                            os.remove(file_to_delete)
-                        #once a filter has matched we break to next file to avoid removing several times
-                        break
+    def get_supported_extensions(self):
+        return self.tools[0].get_supported_extensions()
 
-    # get all metadata
-    with ExifTool(verbose=verbose) as e:
-        print('Preprocessing with ExifTool.  May take a while for a large number of files.')
-        sys.stdout.flush()
-        metadata = e.get_metadata(*args)
+    def submit(self, *args):
+        """send a request to the least busy exiftool process, returns a Future of its output"""
 
-    # setup output to screen
-    num_files = len(metadata)
-    print()
+        tool = min(self.tools, key=lambda tool: len(tool.pending))
+        return tool.submit(*args)
 
-    if test:
-        test_file_dict = {}
+    def _restart(self, tool):
+        """replace tool (hung or dead) by a new exiftool process, unless that was already done"""
 
-    # parse output extracting oldest relevant date
-    for idx, data in enumerate(metadata):
+        if tool in self.tools:
+            tool.kill()
+            self.tools[self.tools.index(tool)] = ExifTool(self.executable, self.verbose).__enter__()
+            self.restarts += 1
 
-        # extract timestamp date for photo
-        src_file, date, keys = get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_ignore)
+    def _result(self, future, args, batch):
+        """
+        outputs of a batch: that of future, or if exiftool hangs or dies, the outputs of the batch
+        sent again (once, if the process died, as it may have been taken down by another batch) then
+        of each file on its own
+        """
 
-        if verbose:
-        # write out which photo we are at
-            ending = ']'
-            if test:
-                ending = '] (TEST - no files are being moved/copied)'
-            print('[' + str(idx+1) + '/' + str(num_files) + ending)
-            print('Source: ' + src_file)
+        try:
+            return [future.result(self.timeout)]
+        except FutureTimeout:
+            self._restart(future.exiftool)
+        except RuntimeError:
+            self._restart(future.exiftool)
+            future = self.submit(*(args + batch))
+            try:
+                return [future.result(self.timeout)]
+            except (FutureTimeout, RuntimeError):
+                self._restart(future.exiftool)
+
+        outputs = []
+        for src_file in batch:
+            future = self.submit(*(args + [src_file]))
+            try:
+                outputs.append(future.result(self.timeout))
+            except (FutureTimeout, RuntimeError):
+                self._restart(future.exiftool)
+                self.quarantine.append(src_file)
+                error = future.exiftool.errors[-1] if future.exiftool.errors else 'no answer'
+                print('ExifTool failed on %s (%s), file skipped' % (src_file, error))
+        return outputs
+
+    def iter_metadata(self, files, args, batch_size=100, in_flight=2):
+        """
+        generator over the metadata of every file in files, using args as the ExifTool arguments.
+        The files are split into batches that are handed out to the workers, at most in_flight
+        batches per worker are queued (so perl keeps working while the previous batch is used),
+        and records are yielded in the same order as files (whatever the number of workers) as
+        soon as their batch is done.
+        """
+
+        if self.quarantine:
+            quarantine = set(self.quarantine)
+            files = [src_file for src_file in files if src_file not in quarantine]
+        if not all(utf8_path(src_file) for src_file in files):
+            for src_file in files:
+                if not utf8_path(src_file):
+                    print('%s is not a UTF-8 file name, file skipped' % fsencode(src_file))
+            files = [src_file for src_file in files if utf8_path(src_file)]
+
+        # small jobs are still spread over every worker
+        batch_size = max(1, min(batch_size, -(-len(files) // self.jobs)))
+
+        pending = deque()
+        for i in range(0, len(files), batch_size):
+            batch = files[i:i+batch_size]
+            pending.append((self.submit(*(args + batch)), batch, time.time()))
+            if len(pending) < in_flight*self.jobs:
+                continue
+            for data in self._batch_metadata(args, *pending.popleft()):
+                yield data
+        while pending:
+            for data in self._batch_metadata(args, *pending.popleft()):
+                yield data
+
+    def _batch_metadata(self, args, future, batch, submitted):
+        """records of a batch submitted at time submitted, then wait for the throttle if any"""
+
+        records = []
+        requested = set(batch)
+        for output in self._result(future, args, batch):
+            # only the files asked for (e.g. not others a daemon would answer with)
+            records.extend(data for data in ExifTool.parse_metadata(output) if data.get('SourceFile') in requested)
+        if self.throttle is not None:
+            self.throttle.pace('files', len(batch), time.time() - submitted)
+        return records
+
+    def get_metadata(self, files, args, batch_size=100):
+        """list of the metadata of every file in files (see iter_metadata)"""
+
+        return list(self.iter_metadata(files, args, batch_size))
+
+
+class FastDateReader(object):
+    """
+    reads the date tags of common file types (JPEG, TIFF, MP4/MOV) directly from their headers, in
+    pure python, and returns the same {group:tag: value} records as ExifTool does for -time:all
+    (EXIF IFD0/ExifIFD dates and sub-seconds, QuickTime movie/track/media dates, and file system dates).
+    Files that can't be read this way (other types, XMP/IPTC/Photoshop blocks, unknown segments or
+    atoms, conflicting duplicate tags) are read by ExifTool.  Maker notes and JPEG trailers are not read.
+    """
+
+    jpeg_extensions = set(['JPG', 'JPEG', 'JPE'])
+    tiff_extensions = set(['TIF', 'TIFF'])
+    quicktime_extensions = set(['MP4', 'MOV', 'M4V'])
+
+    exif_tags = {0x132: 'ModifyDate', 0x9003: 'DateTimeOriginal', 0x9004: 'CreateDate',
+                 0x9290: 'SubSecTime', 0x9291: 'SubSecTimeOriginal', 0x9292: 'SubSecTimeDigitized'}
+    subsec_tags = [('SubSecCreateDate', 'CreateDate', 'SubSecTimeDigitized'),
+                   ('SubSecDateTimeOriginal', 'DateTimeOriginal', 'SubSecTimeOriginal'),
+                   ('SubSecModifyDate', 'ModifyDate', 'SubSecTime')]
+    unsupported_tiff_tags = set([0x2bc, 0x83bb, 0x8649, 0x14a, 0xc71b])  # XMP, IPTC, Photoshop, SubIFDs, PreviewDateTime
+    json_number = re.compile(r'^-?(\d|[1-9]\d{1,14})(\.\d{1,16})?(e[-+]?\d{1,3})?$')
+
+    def __init__(self, exiftool):
+        self.exiftool = exiftool
+        self.hits = 0
+
+    def get_supported_extensions(self):
+        return self.exiftool.get_supported_extensions()
+
+    @staticmethod
+    def _add(tags, key, value):
+        """add a tag, returns False if the same tag was already found with another value"""
+
+        if tags.get(key, value) != value:
+            return False
+        tags[key] = value
+        return True
+
+    @classmethod
+    def _json_value(cls, value):
+        """value as it appears in exiftool JSON output (numbers are not quoted)"""
+
+        if cls.json_number.match(value):
+            return float(value) if ('.' in value or 'e' in value) else int(value)
+        return value
+
+    @classmethod
+    def _read_exif(cls, buf, start, end, tags):
+        """tags of the TIFF structure at buf[start:end], False if it can't be read here"""
+
+        order = {b'II': '<', b'MM': '>'}.get(buf[start:start+2])
+        if order is None or struct.unpack_from(order + 'H', buf, start+2)[0] != 42:
+            return False
+
+        exif = {}
+        ifds = [(struct.unpack_from(order + 'I', buf, start+4)[0], True)]
+        while ifds:
+            offset, is_ifd0 = ifds.pop(0)
+            if offset == 0:
+                continue
+            if start + offset + 2 > end:
+                return False
+            count = struct.unpack_from(order + 'H', buf, start+offset)[0]
+            if start + offset + 2 + 12*count + 4 > end:
+                return False
+            for i in range(count):
+                tag, fmt, n, value = struct.unpack_from(order + 'HHII', buf, start + offset + 2 + 12*i)
+                if tag in cls.unsupported_tiff_tags:
+                    return False
+                if tag == 0x8769 and is_ifd0:
+                    ifds.append((value, False))
+                elif tag in cls.exif_tags and fmt == 2:
+                    pos = start + offset + 2 + 12*i + 8 if n <= 4 else start + value
+                    if pos + n > end:
+                        return False
+                    text = buf[pos:pos+n].split(b'\0')[0].decode('utf-8', 'replace')
+                    if not cls._add(exif, cls.exif_tags[tag], text):
+                        return False
+            if is_ifd0:
+                # IFD1 (thumbnail) follows IFD0
+                ifds.append((struct.unpack_from(order + 'I', buf, start + offset + 2 + 12*count)[0], False))
+
+        for name in sorted(exif, key=lambda name: name.startswith('SubSec')):
+            tags['EXIF:' + name] = cls._json_value(exif[name])
+        for composite, date_tag, subsec_tag in cls.subsec_tags:
+            if date_tag in exif and re.search(r'\d', exif.get(subsec_tag, '')):
+                tags['Composite:' + composite] = re.sub(r'( \d{2}:\d{2}:\d{2})', r'\1.' + exif[subsec_tag],
+                                                        exif[date_tag], count=1)
+        return True
+
+    @classmethod
+    def _read_jpeg(cls, buf, tags):
+        if buf[:2] != b'\xff\xd8':
+            return False
+
+        pos = 2
+        found_exif = False
+        while pos + 2 <= len(buf):
+            if buf[pos:pos+1] != b'\xff':
+                return False
+            marker = struct.unpack_from('B', buf, pos+1)[0]
+            if marker == 0xff:
+                pos += 1
+                continue
+            if marker in (0xda, 0xd9):  # start of scan / end of image: no more metadata
+                return True
+            length = struct.unpack_from('>H', buf, pos+2)[0]
+            if marker == 0xe1:
+                if buf[pos+4:pos+10] != b'Exif\0\0' or found_exif:
+                    return False  # XMP or a second EXIF block
+                found_exif = True
+                if not cls._read_exif(buf, pos+10, pos+2+length, tags):
+                    return False
+            elif 0xe0 <= marker <= 0xef and marker not in (0xe0, 0xe2, 0xee):
+                return False  # APP segment that may contain dates (IPTC, Photoshop, ...)
+            pos += 2 + length
+
+        return False
+
+    @staticmethod
+    def _quicktime_date(value):
+        offset = (66*365 + 17)*24*3600
+        if value >= offset:
+            value -= offset
+        if value == 0:
+            return '0000:00:00 00:00:00'
+        return time.strftime('%Y:%m:%d %H:%M:%S', time.gmtime(value))
+
+    @classmethod
+    def _read_quicktime_atoms(cls, buf, start, end, allowed, tags):
+        """walk the atoms in buf[start:end], reading the header atoms that hold dates"""
+
+        header_tags = {b'mvhd': ('CreateDate', 'ModifyDate'),
+                       b'tkhd': ('TrackCreateDate', 'TrackModifyDate'),
+                       b'mdhd': ('MediaCreateDate', 'MediaModifyDate')}
+        containers = {b'moov': set([b'mvhd', b'trak', b'iods']),
+                      b'trak': set([b'tkhd', b'mdia', b'edts', b'tref', b'tapt']),
+                      b'mdia': set([b'mdhd', b'hdlr', b'minf'])}
+
+        pos = start
+        while pos + 8 <= end:
+            size, kind = struct.unpack_from('>I4s', buf, pos)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', buf, pos+8)[0]
+                header = 16
+            elif size == 0:
+                size = end - pos
+            if size < header or pos + size > end or kind not in allowed:
+                return False
+
+            if kind in header_tags:
+                version = struct.unpack_from('B', buf, pos+header)[0]
+                fmt = '>QQ' if version == 1 else '>II'
+                for name, value in zip(header_tags[kind], struct.unpack_from(fmt, buf, pos+header+4)):
+                    if not cls._add(tags, 'QuickTime:' + name, cls._quicktime_date(value)):
+                        return False
+            elif kind in containers:
+                if not cls._read_quicktime_atoms(buf, pos+header, pos+size, containers[kind], tags):
+                    return False
+            pos += size
+
+        return pos == end
+
+    @classmethod
+    def _read_quicktime(cls, buf, tags):
+        if buf[4:8] not in (b'ftyp', b'moov', b'mdat', b'free', b'wide'):
+            return False
+        return cls._read_quicktime_atoms(buf, 0, len(buf), set([b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide']), tags)
+
+    @staticmethod
+    def _file_date(timestamp):
+        """file system date as exiftool prints it (local time with time zone)"""
+
+        tm = time.localtime(int(timestamp))
+        offset = (calendar_timegm(tm) - int(timestamp)) // 60
+        sign = '-' if offset < 0 else '+'
+        return time.strftime('%Y:%m:%d %H:%M:%S', tm) + '%s%02d:%02d' % (sign, abs(offset) // 60, abs(offset) % 60)
+
+    def read_dates(self, src_file):
+        """record of src_file in the same format as ExifTool.get_metadata, or None if it can't be read here"""
+
+        name = os.path.basename(src_file)
+        ext = name.rsplit('.', 1)[-1].upper() if '.' in name else ''
+        if ext in self.jpeg_extensions:
+            reader = self._read_jpeg
+        elif ext in self.tiff_extensions:
+            reader = lambda buf, tags: self._read_exif(buf, 0, len(buf), tags)
+        elif ext in self.quicktime_extensions:
+            reader = self._read_quicktime
         else:
-            # progress bar
-            numdots = int(20.0*(idx+1)/num_files)
-            sys.stdout.write('\r')
-            sys.stdout.write('[%-20s] %d of %d ' % ('='*numdots, idx+1, num_files))
-            sys.stdout.flush()
+            return None
+
+        st = os.stat(src_file)
+        if st.st_size < 16:
+            return None
+        tags = {'SourceFile': src_file,
+                'File:FileModifyDate': self._file_date(st.st_mtime),
+                'File:FileAccessDate': self._file_date(st.st_atime),
+                'File:FileInodeChangeDate': self._file_date(st.st_ctime)}
+
+        # pages are only read from disk as the headers are walked
+        with open(src_file, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                ok = reader(buf, tags)
+            except (struct.error, ValueError):
+                ok = False
+            finally:
+                buf.close()
+
+        if not ok:
+            return None
+        self.hits += 1
+        return tags
+
+    def iter_metadata(self, files, args, window=1000):
+        """same as ExifToolPool.iter_metadata, but files read here are not sent to exiftool"""
+
+        # other tag selections are left to exiftool
+        if '-time:all' not in args:
+            for data in self.exiftool.iter_metadata(files, args):
+                yield data
+            return
+
+        for i in range(0, len(files), window):
+            batch = files[i:i+window]
+            found = {}
+            for src_file in batch:
+                data = self.read_dates(src_file)
+                if data is not None:
+                    found[src_file] = data
+
+            missing = [src_file for src_file in batch if src_file not in found]
+            for data in self.exiftool.iter_metadata(missing, args):
+                found[data['SourceFile']] = data
+
+            for src_file in batch:
+                if src_file in found:
+                    yield found[src_file]
+
+
+class TieredReader(object):
+    """
+    reads the files of the types whose date tags are all known (priority_tags, by upper case extension) in
+    a first pass that only asks for those tags and the file system dates, with ExifTool's -fast2 (no maker
+    notes, no trailers).  The other files, and those where none of these tags has a date, are read with
+    all their date tags (-time:all).  A first pass record then holds every date tag of its file, so
+    get_oldest_timestamp gives it the same date and tags as a full one.
+    """
 
-        # check if no valid date found
-        if not date:
-            if verbose:
-                print('No valid dates were found using the specified tags.  File will remain where it is.')
-                print()
-                # sys.stdout.flush()
-            continue
+    def __init__(self, exiftool, priority_tags, additional_groups_to_ignore=[], additional_tags_to_ignore=[]):
+        self.exiftool = exiftool
+        self.priority_tags = priority_tags
+        self.ignore_groups = additional_groups_to_ignore
+        self.ignore_tags = additional_tags_to_ignore
+        self.hits = 0
+        self.misses = 0
+
+    def get_supported_extensions(self):
+        return self.exiftool.get_supported_extensions()
+
+    def first_passes(self, files, args):
+        """
+        (files, arguments) of the first passes over files (one per list of date tags), and the files
+        left for the full pass (all of them if args is not a -time:all request)
+        """
+
+        # other tag selections are left to exiftool
+        if '-time:all' not in args:
+            return [], list(files)
+
+        first_args = [arg for arg in args if arg != '-time:all'] + ['-fast2', '-File:time:all']
+        groups = {}
+        missing = []
+        for src_file in files:
+            tags = priority_tags_for(src_file, self.priority_tags)
+            if tags:
+                groups.setdefault(tuple(tags), []).append(src_file)
+            else:
+                missing.append(src_file)
+        return [(group, first_args + ['-' + tag for tag in tags]) for tags, group in groups.items()], missing
 
-        # filter ignored files and remove them if requested
-        if ignore_list is not None:
-            for _filter in ignore_list:
-                if fnmatch.fnmatch(os.path.split(src_file)[-1], _filter):
-                    if remove_ignored_files:
-                        print("file [%s] match filter [%s]: deleting." % (src_file, _filter))
-                        if not test:
-                            os.remove(src_file)
-                    else:
-                        print("file [%s] match filter [%s]: ignoring." % (src_file, _filter))
-                    continue
+    def accept(self, data):
+        """whether the first pass record data has a date, and is therefore final"""
 
-        # ignore hidden files
-        if os.path.basename(src_file).startswith('.'):
-            print('hidden file.  will be skipped')
-            print()
-            continue
+        return get_oldest_timestamp(data, self.ignore_groups, self.ignore_tags)[1] is not None
 
-        if verbose:
-            print('Date/Time: ' + str(date))
-            print('Corresponding Tags: ' + ', '.join(keys))
+    def iter_metadata(self, files, args, window=1000):
+        """same as ExifToolPool.iter_metadata, files with a date in the first pass are only read there"""
 
-        # early morning photos can be grouped with previous day (depending on user setting)
-        date = check_for_early_morning_photos(date, day_begins)
+        for i in range(0, len(files), window):
+            batch = files[i:i+window]
 
+            found = {}
+            passes, missing = self.first_passes(batch, args)
+            for group, first_args in passes:
+                for data in self.exiftool.iter_metadata(group, first_args):
+                    if self.accept(data):
+                        found[data['SourceFile']] = data
+                missing += [src_file for src_file in group if src_file not in found]
 
-        # create folder structure
-        dir_structure = date.strftime(sort_format)
-        dirs = dir_structure.split('/')
-        dest_file = dest_dir
-        for thedir in dirs:
-            dest_file = os.path.join(dest_file, thedir)
-            if not os.path.exists(dest_file):
-                os.makedirs(dest_file)
+            self.hits += len(found)
+            self.misses += len(missing)
+            for data in self.exiftool.iter_metadata(missing, args):
+                found[data['SourceFile']] = data
 
-        # rename file if necessary
-        filename = os.path.basename(src_file)
+            for src_file in batch:
+                if src_file in found:
+                    yield found[src_file]
 
-        # patch to support foreign characters under python 2.x
-        if sys.version_info.major < 3:
-            dest_file = dest_file.decode('utf-8')
 
-        if rename_format is not None:
-            _, ext = os.path.splitext(filename)
-            filename = date.strftime(rename_format) + ext
+class MetadataCache(object):
+    """
+    on-disk (sqlite) cache of ExifTool records.  A record is reused as long as the file
+    still has the same path, size, modification time and inode, and was read with the same
+    ExifTool arguments.
+    """
 
-        # setup destination file
-        dest_file = os.path.join(dest_file, filename)
-        root, ext = os.path.splitext(dest_file)
+    def __init__(self, cache_file):
+        self.connection = sqlite3.connect(cache_file)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS metadata (path TEXT, args TEXT, '
+                                'size INTEGER, mtime_ns INTEGER, inode INTEGER, data TEXT, '
+                                'PRIMARY KEY (path, args))')
+        self.hits = 0
+        self.misses = 0
 
-        if verbose:
-            name = 'Destination '
-            if copy_files:
-                name += '(copy): '
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    @staticmethod
+    def _file_key(path):
+        """(path, size, mtime_ns, inode) of the file, None if it is gone (e.g. removed since it was found)"""
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        mtime_ns = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+        return os.path.abspath(path), st.st_size, mtime_ns, st.st_ino
+
+    def iter_metadata(self, files, args, exiftool, window=1000, args_key=None):
+        """
+        same as ExifToolPool.iter_metadata, but only files not found in the cache are read by exiftool.
+        args_key replaces args in the cache when exiftool returns other records than args would
+        """
+
+        args_key = args_key or '\n'.join(args)
+        for i in range(0, len(files), window):
+            batch = files[i:i+window]
+            keys = {}
+            cached = {}
+            for src_file in batch:
+                keys[src_file] = self._file_key(src_file)
+                if keys[src_file] is None:
+                    continue  # a miss, reported by exiftool as the other missing files
+                path, size, mtime_ns, inode = keys[src_file]
+                row = self.connection.execute('SELECT data FROM metadata WHERE path=? AND args=? AND size=? '
+                                              'AND mtime_ns=? AND inode=?',
+                                              (path, args_key, size, mtime_ns, inode)).fetchone()
+                if row is not None:
+                    data = json.loads(row[0])
+                    data['SourceFile'] = src_file
+                    cached[src_file] = data
+
+            self.hits += len(cached)
+            missing = [src_file for src_file in batch if src_file not in cached]
+            self.misses += len(missing)
+
+            for data in exiftool.iter_metadata(missing, args):
+                src_file = data['SourceFile']
+                cached[src_file] = data
+                if keys.get(src_file) is not None:
+                    self.connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)',
+                                            keys[src_file][:1] + (args_key,) + keys[src_file][1:] + (json.dumps(data),))
+            self.connection.commit()
+
+            for src_file in batch:
+                if src_file in cached:
+                    yield cached[src_file]
+
+    def evict_missing(self, files=None):
+        """
+        remove entries of files that no longer exist (only among files if given),
+        returns the number of entries removed
+        """
+
+        if files is None:
+            paths = [row[0] for row in self.connection.execute('SELECT DISTINCT path FROM metadata')]
+        else:
+            paths = [os.path.abspath(src_file) for src_file in files]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        self.connection.executemany('DELETE FROM metadata WHERE path=?', missing)
+        self.connection.commit()
+        return len(missing)
+
+
+class DuplicateIndex(object):
+    """
+    persistent (sqlite) index of the files in the destination library, used to find duplicates
+    anywhere in the library.  Files are looked up by size and a hash of their first and last blocks
+    (partial, stored when a file is added), and only then compared by a hash of their whole content,
+    computed lazily.  Files scanned from the library get their partial hash the first time a file of the
+    same size is looked up.  Paths are stored relative to the library root, so the index works whatever
+    the current directory.
+    """
+
+    filename = '.sortphotos_index.db'
+    block_size = 65536
+
+    def __init__(self, dest_dir):
+        if not os.path.exists(dest_dir):
+            os.makedirs(dest_dir)
+        self.dest_dir = dest_dir
+        self.connection = sqlite3.connect(os.path.join(dest_dir, self.filename))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, '
+                                'mtime_ns INTEGER, partial TEXT, full TEXT)')
+        self.connection.execute('DROP INDEX IF EXISTS files_size')  # covered by files_size_partial
+        self.connection.execute('CREATE INDEX IF NOT EXISTS files_size_partial ON files (size, partial)')
+        self.hashes = {}  # hashes already computed for incoming files
+        self.planned = {}  # size -> [(dest_file, src_file)] of files planned but not added yet
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.dest_dir).replace(os.sep, '/')
+
+    def _path(self, relative):
+        return os.path.join(self.dest_dir, *relative.split('/'))
+
+    @staticmethod
+    def _stat(path):
+        st = os.stat(path)
+        return st.st_size, getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+
+    @classmethod
+    def _hash(cls, path, size, partial):
+        """sha1 of the first and last blocks of the file (partial) or of all of it"""
+
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            if partial and size > 2*cls.block_size:
+                h.update(f.read(cls.block_size))
+                f.seek(-cls.block_size, os.SEEK_END)
+                h.update(f.read(cls.block_size))
             else:
-                name += '(move): '
-            print(name + dest_file)
+                for block in iter(lambda: f.read(1024*1024), b''):
+                    h.update(block)
+        return h.hexdigest()
+
+    def _entry_hash(self, path, size, mtime_ns, column):
+        """
+        hash of a library file (path as stored), computed and stored if needed.  A file that changed
+        since it was indexed is indexed again (its hash is None if its size changed), and a file that is
+        gone is removed from the index (its hash is None)
+        """
+
+        full_path = self._path(path)
+        try:
+            stat = self._stat(full_path)
+            if stat != (size, mtime_ns):
+                partial = self._hash(full_path, stat[0], True)
+                self.connection.execute('UPDATE files SET size=?, mtime_ns=?, partial=?, full=NULL WHERE path=?',
+                                        stat + (partial, path))
+                if stat[0] != size:
+                    return None
+                if column == 'partial':
+                    return partial
+            value = self._hash(full_path, size, column == 'partial')
+        except (IOError, OSError):
+            self.connection.execute('DELETE FROM files WHERE path=?', (path,))
+            return None
+
+        self.connection.execute('UPDATE files SET %s=? WHERE path=?' % column, (value, path))
+        return value
+
+    def _src_hash(self, src_file, size, column):
+        hashes = self.hashes.setdefault(src_file, {})
+        if column not in hashes:
+            hashes[column] = self._hash(src_file, size, column == 'partial')
+        return hashes[column]
+
+    def find_duplicate(self, src_file):
+        """path of a library file with the same content as src_file, or None"""
+
+        size = os.path.getsize(src_file)
+        for path, mtime_ns in self.connection.execute('SELECT path, mtime_ns FROM files WHERE size=? AND '
+                                                      'partial IS NULL', (size,)).fetchall():
+            self._entry_hash(path, size, mtime_ns, 'partial')  # scanned from the library, not hashed yet
+
+        rows = []
+        if self.connection.execute('SELECT 1 FROM files WHERE size=? LIMIT 1', (size,)).fetchone():
+            rows = self.connection.execute('SELECT path, mtime_ns, full FROM files WHERE size=? AND partial=?',
+                                           (size, self._src_hash(src_file, size, 'partial'))).fetchall()
+        for path, mtime_ns, full in rows:
+            if os.path.abspath(self._path(path)) == os.path.abspath(src_file):
+                continue
+            if full is None:
+                full = self._entry_hash(path, size, mtime_ns, 'full')
+            if full is not None and full == self._src_hash(src_file, size, 'full'):
+                return self._path(path)
+
+        for dest_file, planned_file in self.planned.get(size, []):
+            try:
+                same = self._same_hashes(planned_file, src_file, size)
+            except (IOError, OSError):
+                same = self._same_hashes(dest_file, src_file, size)  # the planned file was moved meanwhile
+            if same:
+                return dest_file
 
+        return None
 
-        # check for collisions
-        append = 1
-        fileIsIdentical = False
+    def _same_hashes(self, path, src_file, size):
+        return self._src_hash(path, size, 'partial') == self._src_hash(src_file, size, 'partial') and \
+            self._src_hash(path, size, 'full') == self._src_hash(src_file, size, 'full')
 
-        while True:
+    def plan(self, dest_file, src_file):
+        """remember that src_file will be placed at dest_file, so later files are compared to it too"""
 
-            if (not test and os.path.isfile(dest_file)) or (test and dest_file in test_file_dict.keys()):  # check for existing name
-                if test:
-                    dest_compare = test_file_dict[dest_file]
-                else:
-                    dest_compare = dest_file
-                if remove_duplicates and filecmp.cmp(src_file, dest_compare):  # check for identical files
-                    fileIsIdentical = True
-                    if verbose:
-                        if copy_files:
-                            print('Identical file already exists.  Duplicate will be ignored.\n')
-                            # sys.stdout.flush()
-                        else:
-                            print('Identical file already exists.  Duplicate will be overwritten.')
-                    break
+        self.planned.setdefault(os.path.getsize(src_file), []).append((dest_file, src_file))
 
-                else:  # name is same, but file is different
-                    dest_file = root + '_' + str(append) + ext
-                    append += 1
-                    if verbose:
-                        print('Same name already exists...renaming to: ' + dest_file)
+    def add(self, dest_file, src_file=None):
+        """add (or update) a library file, reusing the hashes computed for src_file if it was moved/copied there"""
 
-            else:
-                break
+        size, mtime_ns = self._stat(dest_file)
+        planned = self.planned.get(size, [])
+        if (dest_file, src_file) in planned:
+            planned.remove((dest_file, src_file))
+        hashes = self.hashes.pop(src_file, {})
+        partial = hashes.get('partial') or self._hash(dest_file, size, True)
+        self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                (self._relative(dest_file), size, mtime_ns, partial, hashes.get('full')))
 
+    def rename(self, path, new_path):
+        """a library file was moved to new_path"""
 
-        # finally move or copy the file
-        if test:
-            test_file_dict[dest_file] = src_file
+        self.connection.execute('UPDATE files SET path=? WHERE path=?',
+                                (self._relative(new_path), self._relative(path)))
 
-        else:
+    def scan(self):
+        """add the files already in the library (skipping hidden ones), and forget the ones that are gone"""
 
-            if copy_files:
-                if fileIsIdentical:
-                    continue  # if file is same, we just ignore it (for copy option)
-                else:
-                    shutil.copy2(src_file, dest_file)
-            else:
-                shutil.move(src_file, dest_file)
+        known = dict((row[0], row[1:]) for row in self.connection.execute('SELECT path, size, mtime_ns FROM files'))
+        for root, dirs, files in os.walk(self.dest_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                stat = self._stat(path)
+                path = self._relative(path)
+                if known.pop(path, None) != stat:
+                    self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL, NULL)',
+                                            (path,) + stat)
+        self.connection.executemany('DELETE FROM files WHERE path=?', [(path,) for path in known])
+        self.connection.commit()
+
+    def duplicates(self):
+        """list of groups of library files that have the same content"""
+
+        # partial hashes of the files scanned from the library, when another file has the same size
+        rows = self.connection.execute('SELECT path, size, mtime_ns FROM files WHERE partial IS NULL AND size IN '
+                                       '(SELECT size FROM files GROUP BY size HAVING COUNT(*) > 1)').fetchall()
+        for path, size, mtime_ns in rows:
+            self._entry_hash(path, size, mtime_ns, 'partial')
+
+        groups = []
+        keys = self.connection.execute('SELECT size, partial FROM files WHERE partial IS NOT NULL '
+                                       'GROUP BY size, partial HAVING COUNT(*) > 1').fetchall()
+        for size, partial in keys:
+            by_full = {}
+            for path, mtime_ns, full in self.connection.execute('SELECT path, mtime_ns, full FROM files WHERE '
+                                                                'size=? AND partial=?', (size, partial)).fetchall():
+                if full is None:
+                    full = self._entry_hash(path, size, mtime_ns, 'full')
+                if full is not None:
+                    by_full.setdefault(full, []).append(self._path(path))
+            groups += [sorted(paths) for paths in by_full.values() if len(paths) > 1]
+
+        self.connection.commit()
+        return groups
+
+
+class Catalog(object):
+    """
+    persistent (sqlite) record of the files placed in the library, with the date and tags they were
+    sorted by and their original name, so that the library can be laid out again (see relayout)
+    without reading any metadata.  Paths are stored relative to the library root.
+    """
 
+    filename = '.sortphotos_catalog.db'
 
+    def __init__(self, dest_dir):
+        if not os.path.exists(dest_dir):
+            os.makedirs(dest_dir)
+        self.dest_dir = dest_dir
+        self.connection = sqlite3.connect(os.path.join(dest_dir, self.filename))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, seq INTEGER, name TEXT, '
+                                'date TEXT, tags TEXT)')
+        self.seq = None  # read once the destination lock is held, see planned
+        self.planned_seq = {}  # destination -> position of the files planned but not placed yet
 
-        if verbose:
-            print()
-            # sys.stdout.flush()
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
 
+    def _relative(self, path):
+        return os.path.relpath(path, self.dest_dir).replace(os.sep, '/')
 
-    if not verbose:
-        print()
+    def planned(self, operation):
+        """remember the order files are planned in (they may be placed in another order)"""
 
-    if remove_empty_dirs:
-        # use topdown false to scan from bottom to top to avoid trying to delete top directory while child haven't
-        # been processed
-        for dirpath, dirnames, files in os.walk(src_dir, topdown=False):
-            if not files and dirpath != src_dir:
-                print("[Cleaning] Removing empty directory: %s" % dirpath)
-                if not test:
-                    os.rmdir(dirpath)
+        if self.seq is None:
+            # only now: files are planned under the destination lock, so another run is not adding to it
+            self.seq = self.connection.execute('SELECT MAX(seq) FROM files').fetchone()[0] or 0
+        self.seq += 1
+        self.planned_seq[operation['dest']] = self.seq
 
-    return num_files
+    def add(self, operation):
+        """record the file placed in the library by operation (planned by MovePlanner)"""
 
-def run_stdin_watcher(args):
-    verbose = not args.silent
-    file_present = []
-    while True:
+        seq = self.planned_seq.pop(operation['dest'], None)
+        if seq is None:
+            self.planned(operation)
+            seq = self.planned_seq.pop(operation['dest'])
+        self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                (self._relative(operation['dest']), seq, os.path.basename(operation['src']),
+                                 operation['date'], json.dumps(operation['tags'])))
+
+    def move(self, path, new_path):
+        self.connection.execute('UPDATE files SET path=? WHERE path=?', (self._relative(new_path), self._relative(path)))
+
+    def remove(self, path):
+        self.connection.execute('DELETE FROM files WHERE path=?', (self._relative(path),))
+
+    def entries(self):
+        """list of (path, name, date, tags) of the files in the catalog, in the order they were placed"""
+
+        rows = self.connection.execute('SELECT path, name, date, tags FROM files ORDER BY seq').fetchall()
+        return [(os.path.join(self.dest_dir, *path.split('/')), name, date, json.loads(tags))
+                for path, name, date, tags in rows]
+
+
+class DestinationLock(object):
+    """
+    exclusive lock on a destination directory, shared by every sortphotos process (a lock file in it),
+    so that runs into the same destination do not plan the same names.  Not available on windows,
+    and does nothing without a dest_dir
+    """
+
+    filename = '.sortphotos.lock'
+
+    def __init__(self, dest_dir):
+        self.path = os.path.join(dest_dir, self.filename) if dest_dir is not None else None
+        self.f = None
+
+    def acquire(self, blocking=True):
+        """True once the lock is held, False if another process holds it and blocking is False"""
+
+        if self.f is not None or self.path is None or fcntl is None:
+            return True
+        dest_dir = os.path.dirname(self.path)
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        f = open(self.path, 'a')
         try:
-            i, o, e = select.select( [sys.stdin], [], [],  5)
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except (IOError, OSError) as e:
+            f.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self.f = f
+        return True
+
+    def release(self):
+        if self.f is not None:
+            self.f.close()  # releases the lock
+            self.f = None
 
-            if(i):
-                for new_file in sys.stdin.readline()[:-1].split('\n'):
-                    if os.path.exists(new_file):
-                        if verbose:
-                            print("New file present:", new_file)
-                        file_present.append(new_file)
-            else:
+    def __enter__(self):
+        if not self.acquire(blocking=False):
+            print('Waiting for another sortphotos run into ' + os.path.dirname(self.path))
+            self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class DestinationCache(object):
+    """
+    names in the destination directories, read with one scandir per directory the first time it is looked
+    at, so that checking for existing files and directories does not cost a system call (a network round
+    trip on NFS/SMB) per file.  Directories created with makedirs and files placed with execute_operation
+    are added to it.  On case insensitive file systems (macOS and windows usually) names are compared
+    case-folded.  Files in leaving (about to be moved away, see relayout) are seen as absent.
+    It can be used from several threads (e.g. the workers of a TransferExecutor).
+    """
+
+    def __init__(self, leaving=None):
+        self.listings = {}  # directory -> set of the names in it, None if it does not exist
+        self.folded = set()  # directories whose names are case insensitive (and kept lower case)
+        self.insensitive = {}  # st_dev -> whether the file system is case insensitive
+        self.devices = {}  # directory -> st_dev
+        self.scans = 0
+        self.lock = threading.RLock()  # held while a directory is listed, so that it is only listed once
+        self.leaving = leaving or set()
+        self.leaving_keys = None  # keys of leaving, once the directories are listed
+
+    def _case_insensitive(self, dirpath):
+        """
+        whether names are case insensitive in the existing directory dirpath: the first directory of its path
+        whose name has letters is looked up under another case (without crossing file systems)
+        """
+
+        device = self.device(dirpath)
+        if device not in self.insensitive:
+            insensitive = sys.platform in ('darwin', 'win32')  # when nothing tells
+            path = os.path.abspath(dirpath)
+            parent, name = os.path.split(path)
+            while name and os.stat(parent).st_dev == device:
+                if name != name.swapcase():
+                    try:
+                        insensitive = os.path.samefile(path, os.path.join(parent, name.swapcase()))
+                    except OSError:
+                        insensitive = False
+                    break
+                path = parent
+                parent, name = os.path.split(path)
+            self.insensitive[device] = insensitive
+        return self.insensitive[device]
+
+    def _folds(self, dirpath):
+        """whether names are case insensitive in dirpath (in its nearest existing parent if it does not exist)"""
+
+        while self._listing(dirpath or '.') is None and os.path.dirname(dirpath) != dirpath:
+            dirpath = os.path.dirname(dirpath)
+        return (dirpath or '.') in self.folded
+
+    def _name(self, dirpath, name):
+        """name as kept in the listing of dirpath"""
+
+        return name.lower() if self._folds(dirpath) else name
+
+    def key(self, path):
+        """path, with its name case-folded if names are case insensitive where it is"""
+
+        dirpath, name = os.path.split(path)
+        return os.path.join(dirpath, self._name(dirpath, name))
+
+    def _listing(self, dirpath):
+        with self.lock:
+            listing = self.listings.get(dirpath, False)
+            if listing is False:
+                parent, name = os.path.split(dirpath)
+                if name and self.listings.get(parent, False) is None:
+                    listing = None  # the parent does not exist either
+                elif name and self.listings.get(parent) and self._name(parent, name) not in self.listings[parent]:
+                    listing = None
+                else:
+                    self.scans += 1
+                    try:
+                        listing = set(entry.name for entry in scandir(dirpath))
+                        if self._case_insensitive(dirpath):
+                            self.folded.add(dirpath)
+                            listing = set(name.lower() for name in listing)
+                    except OSError:
+                        listing = None
+                self.listings[dirpath] = listing
+            return listing
+
+    def exists(self, path):
+        """whether something named path exists (a file, or anything else that would be in its way)"""
+
+        with self.lock:
+            dirpath, name = os.path.split(path)
+            listing = self._listing(dirpath)
+            if listing is None or self._name(dirpath, name) not in listing:
+                return False
+            if self.leaving_keys is None:
+                self.leaving_keys = set(self.key(leaving) for leaving in self.leaving)
+            return self.key(path) not in self.leaving_keys
+
+    def isdir(self, dirpath):
+        return self._listing(dirpath) is not None
+
+    def device(self, dirpath):
+        """st_dev of the existing directory dirpath"""
+
+        with self.lock:
+            if dirpath not in self.devices:
+                self.devices[dirpath] = os.stat(dirpath).st_dev
+            return self.devices[dirpath]
+
+    def add(self, path):
+        """record that a file is (or is about to be) at path"""
+
+        with self.lock:
+            dirpath, name = os.path.split(path)
+            listing = self._listing(dirpath)
+            if listing is not None:
+                listing.add(self._name(dirpath, name))
+
+    def makedirs(self, dirpath):
+        """create dirpath and its missing parents, returns the number of directories created"""
+
+        with self.lock:
+            missing = []
+            while dirpath and not self.isdir(dirpath):
+                missing.append(dirpath)
+                dirpath = os.path.dirname(dirpath)
+            if not missing:
+                return 0
+
+            try:
+                os.makedirs(missing[0])
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            folded = self._folds(dirpath)
+            for created in reversed(missing):
+                self.listings[created] = set()
+                if folded:
+                    self.folded.add(created)
+                parent, name = os.path.split(created)
+                if self.listings.get(parent) is not None:
+                    self.listings[parent].add(self._name(parent, name))
+            return len(missing)
+
+
+class MovePlanner(object):
+    """
+    decides where each file goes (date folders, renaming, name collisions and duplicates) without
+    changing anything on disk.  Each decision is an operation dictionary (action, src, dest, date, tags, and
+    identical when a move replaces an identical file) that can be saved as a line of JSON and applied later
+    with execute_operation.  Name collisions are
+    resolved against the files already in the destination and the files planned so far in this run, so
+    a test run plans exactly what a real run does.
+    """
+
+    def __init__(self, dest_dir, sort_format, rename_format, copy_files=False, remove_duplicates=True,
+                 day_begins=0, duplicate_index=None, verbose=True, transfers=None, stats=None,
+                 destinations=None):
+        self.dest_dir = dest_dir
+        self.sort_format = sort_format
+        self.rename_format = rename_format
+        self.copy_files = copy_files
+        self.remove_duplicates = remove_duplicates
+        self.day_begins = day_begins
+        self.duplicate_index = duplicate_index
+        self.verbose = verbose
+        self.transfers = transfers  # TransferExecutor applying the operations, if any
+        self.claimed = {}  # destination (see DestinationCache.key) -> (destination, source) of the files planned
+        self.stats = stats if stats is not None else RunStats()
+        self.destinations = destinations if destinations is not None else DestinationCache()
+
+    def _same_file(self, src_file, dest_file):
+        """compare src_file with whatever is (or will be) at dest_file"""
+
+        dest_file, other = self.claimed.get(self.destinations.key(dest_file), (dest_file, dest_file))
+        if self.transfers is not None:
+            self.transfers.wait(dest_file)
+        if not os.path.exists(other):
+            other = dest_file  # planned file already moved
+        self.stats.add('duplicate_comparisons')
+        throttle = self.transfers.throttle if self.transfers is not None else None
+        with self.stats.timer('duplicate_comparison'):
+            start = time.time()
+            try:
+                same = filecmp.cmp(src_file, other)
+            except OSError:
+                return False  # e.g. under another case (seen by the DestinationCache only): kept apart
+            if throttle is not None:
+                size = os.path.getsize(src_file)
+                throttle.pace('bytes', 2*size if size == os.path.getsize(other) else 0, time.time() - start)
+            return same
+
+    def plan(self, src_file, date, keys, name=None):
+        """
+        operation for src_file, whose oldest date is date (found in tags keys).  name is the file name
+        kept when not renaming (that of src_file by default)
+        """
+
+        verbose = self.verbose
+        copy_files = self.copy_files
+        operation = {'action': 'copy' if copy_files else 'move', 'src': src_file, 'dest': None,
+                     'date': date.strftime('%Y:%m:%d %H:%M:%S'), 'tags': keys}
+
+        # look for an identical file anywhere in the library
+        if self.duplicate_index is not None and self.remove_duplicates:
+            duplicate = self.duplicate_index.find_duplicate(src_file)
+            if duplicate is not None:
+                if verbose:
+                    print('Identical file already exists: ' + duplicate)
+                    if copy_files:
+                        print('Duplicate will be ignored.')
+                    else:
+                        print('Duplicate will be removed.')
+                operation['action'] = 'skip' if copy_files else 'remove'
+                operation['dest'] = duplicate
+                return operation
+
+        # early morning photos can be grouped with previous day (depending on user setting)
+        date = check_for_early_morning_photos(date, self.day_begins, verbose)
+
+        # folder structure
+        dest_file = self.dest_dir
+        for thedir in date.strftime(self.sort_format).split('/'):
+            dest_file = os.path.join(dest_file, thedir)
+
+        # rename file if necessary
+        filename = name or os.path.basename(src_file)
+
+        # patch to support foreign characters under python 2.x
+        if sys.version_info.major < 3:
+            dest_file = dest_file.decode('utf-8')
+
+        if self.rename_format is not None:
+            _, ext = os.path.splitext(filename)
+            filename = date.strftime(self.rename_format) + ext
+
+        # setup destination file
+        dest_file = os.path.join(dest_file, filename)
+        root, ext = os.path.splitext(dest_file)
+
+        if verbose:
+            name = 'Destination '
+            if copy_files:
+                name += '(copy): '
+            else:
+                name += '(move): '
+            print(name + dest_file)
+
+        # check for collisions
+        append = 1
+        # check for existing name
+        while self.destinations.key(dest_file) in self.claimed or self.destinations.exists(dest_file):
+
+            if self.remove_duplicates and self._same_file(src_file, dest_file):  # check for identical files
+                if copy_files:
+                    operation['action'] = 'skip'  # if file is same, we just ignore it (for copy option)
+                else:
+                    operation['identical'] = True  # the only case where an existing file is replaced
+                if verbose:
+                    if copy_files:
+                        print('Identical file already exists.  Duplicate will be ignored.')
+                    else:
+                        print('Identical file already exists.  Duplicate will be overwritten.')
+                break
+
+            else:  # name is same, but file is different
+                self.stats.add('collisions')
+                dest_file = root + '_' + str(append) + ext
+                append += 1
+                if verbose:
+                    print('Same name already exists...renaming to: ' + dest_file)
+
+        operation['dest'] = dest_file
+        if operation['action'] != 'skip':
+            self.claimed[self.destinations.key(dest_file)] = (dest_file, src_file)
+            if self.duplicate_index is not None:
+                self.duplicate_index.plan(dest_file, src_file)
+
+        return operation
+
+
+class Throttle(object):
+    """
+    paces the work of a background run so that it shares the disks with other programs: at most
+    rates['bytes'] bytes copied/compared and rates['files'] files read by ExifTool per second (None for no
+    limit).  When adaptive, the latency of the work (seconds per MiB copied, per file read) is watched too:
+    when it goes up to twice what it was (another program is using the disks) the share of the time spent
+    working is halved (down to 1/20), and it slowly comes back once the latency goes down again.
+    Can be used from several threads.
+    """
+
+    units = {'bytes': 1 << 20, 'files': 1}  # latency is measured per unit of work
+
+    def __init__(self, bytes_per_sec=None, files_per_sec=None, adaptive=True):
+        self.rates = {'bytes': bytes_per_sec, 'files': files_per_sec}
+        self.adaptive = adaptive
+        self.duty = 1.0  # share of the time spent working
+        self.available = {}  # kind -> time when the rate allows more work
+        self.latency = {}  # kind -> moving average of the latency
+        self.baseline = {}  # kind -> latency when the disks are not busy
+        self.last_decrease = 0
+        self.waited = 0.0  # seconds spent waiting
+        self.lock = threading.Lock()
+
+    def delay(self, kind, amount, seconds):
+        """seconds to wait after amount of work of kind ('bytes' or 'files') that took seconds"""
+
+        with self.lock:
+            now = time.time()
+            if self.adaptive and amount > 0:
+                latency = seconds / max(amount, self.units[kind])
+                average = self.latency.get(kind, latency)
+                average = self.latency[kind] = 0.8*average + 0.2*latency
+                # the baseline follows slow changes, so that only other programs coming up slow us down
+                baseline = self.baseline[kind] = min(self.baseline.get(kind, average)*1.01, average)
+                if average > 2*baseline:
+                    if now - self.last_decrease > 1:
+                        self.duty = max(0.05, self.duty/2)
+                        self.last_decrease = now
+                else:
+                    self.duty = min(1.0, self.duty + 0.02)
+
+            pause = seconds*(1/self.duty - 1)
+            rate = self.rates[kind]
+            if rate:
+                start = max(now, self.available.get(kind, now))
+                self.available[kind] = start + float(amount)/(rate*self.duty)
+                pause = max(pause, self.available[kind] - now)
+            self.waited += pause
+            return pause
+
+    def pace(self, kind, amount, seconds):
+        """wait as long as needed after amount of work of kind that took seconds"""
+
+        pause = self.delay(kind, amount, seconds)
+        if pause > 0:
+            time.sleep(pause)
+
+
+def lower_priority(niceness=19):
+    """
+    run this process at the lowest CPU and I/O priority (best effort class, level 7, on linux).  The ExifTool
+    processes and threads started afterwards get the same priority
+    """
+
+    if hasattr(os, 'nice'):
+        os.nice(niceness)
+    if sys.platform.startswith('linux'):
+        try:
+            subprocess.call(['ionice', '-c', '2', '-n', '7', '-p', str(os.getpid())])
+        except OSError:
+            print('ionice not found, the I/O priority is left unchanged')
+
+
+def _copy_data(src_file, dest_file, throttle=None, chunk_size=1 << 20):
+    """copy src_file to dest_file like shutil.copy2, chunk by chunk at the pace set by throttle if any"""
+
+    if throttle is None:
+        shutil.copy2(src_file, dest_file)
+        return
+    with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+        while True:
+            start = time.time()
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            dest.write(chunk)
+            throttle.pace('bytes', len(chunk), time.time() - start)
+    shutil.copystat(src_file, dest_file)
+
+
+FICLONE = 0x40049409  # linux ioctl used to clone (reflink) a file on copy-on-write file systems
+
+def _reflink(src_file, dest_file):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are only made on linux', dest_file)
+    with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+
+
+def _kernel_copy(src_file, dest_file, throttle=None):
+    """copy the data inside the kernel (copy_file_range, or sendfile), at the pace set by throttle if any"""
+
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None)
+    if copy_file_range is None and sendfile is None:
+        raise OSError('no kernel copy available')
+
+    with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+        size = os.fstat(src.fileno()).st_size
+        offset = 0
+        step = size if throttle is None else 1 << 20
+        while offset < size:
+            start = time.time()
+            try:
+                if copy_file_range is None:
+                    raise OSError
+                copied = copy_file_range(src.fileno(), dest.fileno(), min(step, size - offset), offset, offset)
+            except OSError:
+                if sendfile is None:
+                    raise
+                copy_file_range = None
+                copied = sendfile(dest.fileno(), src.fileno(), offset, min(step, size - offset))
+            if copied == 0:
+                break
+            offset += copied
+            if throttle is not None:
+                throttle.pace('bytes', copied, time.time() - start)
+
+
+def copy_file(src_file, dest_file, link_mode='copy', throttle=None):
+    """
+    copy src_file to dest_file.  link_mode is one of
+    'copy': regular copy (shutil.copy2)
+    'hardlink': hard link to the same data (fails if not possible)
+    'reflink': copy-on-write clone of the data (fails if not possible)
+    'auto': try reflink, then hardlink, then a copy inside the kernel, then a regular copy
+    Returns the strategy used ('reflink', 'hardlink', 'kernel' or 'copy') and the number of bytes
+    that did not need to be written (shared with src_file).  Copies of the data are paced by throttle
+    (a Throttle) if given.
+    """
+
+    if link_mode == 'copy':
+        _copy_data(src_file, dest_file, throttle)
+        return 'copy', 0
+
+    size = os.path.getsize(src_file)
+    strategies = {'hardlink': ['hardlink'], 'reflink': ['reflink'],
+                  'auto': ['reflink', 'hardlink', 'kernel', 'copy']}[link_mode]
+    for strategy in strategies:
+        try:
+            if strategy == 'reflink':
+                _reflink(src_file, dest_file)
+                shutil.copystat(src_file, dest_file)
+                return strategy, size
+            elif strategy == 'hardlink':
+                os.link(src_file, dest_file)
+                return strategy, size
+            elif strategy == 'kernel':
+                _kernel_copy(src_file, dest_file, throttle)
+                shutil.copystat(src_file, dest_file)
+                return strategy, 0
+            else:
+                _copy_data(src_file, dest_file, throttle)
+                return strategy, 0
+        except (IOError, OSError):
+            # don't leave a partial file behind
+            if strategy != 'hardlink' and os.path.exists(dest_file):
+                os.remove(dest_file)
+            if strategy == strategies[-1]:
+                raise
+
+
+replace_file = getattr(os, 'replace', os.rename)  # os.rename does not replace existing files on windows
+
+
+def temporary_name(dest_file):
+    """hidden name next to dest_file, used while it is being written"""
+
+    dirpath, name = os.path.split(dest_file)
+    return os.path.join(dirpath, '.' + name + '.sortphotos-tmp')
+
+
+def execute_operation(operation, duplicate_index=None, link_mode='copy', stats=None, destinations=None,
+                      throttle=None):
+    """
+    apply an operation planned by MovePlanner (copies are made with copy_file and link_mode).
+    Returns the copy strategy and bytes shared for copies (None and 0 otherwise).
+    The time spent and bytes read/written are added to stats if given, directories are created
+    through the DestinationCache destinations if given, and copies are paced by the Throttle throttle if given.
+    An existing destination is only replaced when the operation says it is identical, otherwise OSError
+    (EEXIST) is raised (looked up in destinations if given, which knows the files placed through it).
+    """
+
+    action = operation['action']
+    src_file = operation['src']
+    dest_file = operation['dest']
+    result = None, 0
+    if stats is None:
+        stats = RunStats()
+    exists = os.path.lexists
+    if destinations is None:
+        destinations = DestinationCache()
+    else:
+        exists = destinations.exists
+
+    if action == 'remove':
+        with stats.timer('remove'):
+            os.remove(src_file)
+
+    elif action in ('move', 'copy'):
+        if not operation.get('identical') and exists(dest_file):
+            raise OSError(errno.EEXIST, 'Destination already exists, not replaced', dest_file)
+        dest_dir = os.path.dirname(dest_file)
+        with stats.timer('makedirs'):
+            stats.add('directories_created', destinations.makedirs(dest_dir))
+
+        src_stat = os.stat(src_file)
+        if action == 'move' and src_stat.st_dev == destinations.device(dest_dir or '.'):
+            with stats.timer('move'):
+                replace_file(src_file, dest_file)
+        else:
+            # the data goes to a temporary file that is renamed once complete, so that an interrupted
+            # transfer never leaves a partial file under the final name
+            tmp_file = temporary_name(dest_file)
+            with stats.timer(action):
+                try:
+                    if action == 'copy':
+                        result = copy_file(src_file, tmp_file, link_mode, throttle)
+                    else:
+                        _copy_data(src_file, tmp_file, throttle)
+                    replace_file(tmp_file, dest_file)
+                except:
+                    if os.path.lexists(tmp_file):
+                        os.remove(tmp_file)
+                    raise
+                if action == 'move':
+                    os.remove(src_file)
+            stats.add('bytes_read', src_stat.st_size - result[1])
+            stats.add('bytes_written', src_stat.st_size - result[1])
+        destinations.add(dest_file)
+
+        if duplicate_index is not None:
+            duplicate_index.add(dest_file, src_file)
+
+    return result
+
+
+class TransferExecutor(object):
+    """
+    applies planned operations with a pool of threads.  At most device_limits[device] operations run at
+    once on each destination device (st_dev), jobs for devices without a limit: the others wait in a queue
+    of their device, without holding a thread, so a slow device does not hold up the others.  Operations on
+    the same destination are applied in the order they were planned, and the library index is updated from
+    the calling thread.  With jobs=1 operations are simply applied one after the other.
+    """
+
+    def __init__(self, jobs=1, device_limits=None, duplicate_index=None, link_mode='copy', verbose=False,
+                 stats=None, destinations=None, journal=None, catalog=None, throttle=None):
+        self.jobs = max(1, jobs)
+        self.duplicate_index = duplicate_index
+        self.link_mode = link_mode
+        self.verbose = verbose
+        self.stats = stats if stats is not None else RunStats()
+        self.destinations = destinations if destinations is not None else DestinationCache()
+        self.journal = journal  # Journal recording each operation before and after it is applied, if any
+        self.catalog = catalog  # Catalog of the library the files are placed in, if any
+        self.throttle = throttle  # Throttle pacing the copies (and comparisons), if any
+        self.strategies = {}  # copy strategy -> number of files copied with it
+        self.bytes_shared = 0  # bytes not written thanks to reflinks/hardlinks
+        self.limits = {}  # st_dev -> maximum number of concurrent operations
+        for path, limit in (device_limits or {}).items():
+            self.limits[os.stat(path).st_dev] = limit
+        self.devices = {}  # directory -> st_dev
+        self.running = {}  # st_dev -> number of operations submitted to the pool
+        self.queued = {}  # st_dev -> operations waiting for the device, oldest first
+        self.queued_dests = {}  # destination -> number of its operations waiting
+        self.pending = {}  # future -> operation
+        self.by_dest = {}  # destination -> future of the last operation on it
+
+    def __enter__(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.pool is not None:
+            try:
+                if exc_type is None:
+                    self._collect(wait_all=True)
+            finally:
+                self.pool.shutdown()
+
+    def _device(self, path):
+        """st_dev of the nearest existing directory containing path"""
+
+        directory = os.path.dirname(path)
+        if directory not in self.devices:
+            existing = directory
+            while existing and not os.path.exists(existing):
+                existing = os.path.dirname(existing)
+            self.devices[directory] = os.stat(existing or '.').st_dev
+        return self.devices[directory]
+
+    def _operation_device(self, operation):
+        return self._device(operation['dest'] or operation['src'])
+
+    def _run(self, operation):
+        return execute_operation(operation, link_mode=self.link_mode, stats=self.stats,
+                                 destinations=self.destinations, throttle=self.throttle)
+
+    def _start(self, operation, device):
+        self.running[device] = self.running.get(device, 0) + 1
+        future = self.pool.submit(self._run, operation)
+        self.pending[future] = operation
+        if operation['dest'] is not None:
+            self.by_dest[operation['dest']] = future
+
+    def _start_queued(self, device):
+        """start the operations waiting for device, as long as it has free slots"""
+
+        queued = self.queued.get(device)
+        while queued and self.running.get(device, 0) < self.limits.get(device, self.jobs):
+            operation = queued.popleft()
+            dest_file = operation['dest']
+            if dest_file is not None:
+                self.queued_dests[dest_file] -= 1
+                if not self.queued_dests[dest_file]:
+                    del self.queued_dests[dest_file]
+            self._start(operation, device)
+
+    def _done(self, operation, result):
+        if self.journal is not None:
+            self.journal.done(operation)
+        if self.catalog is not None and operation['action'] in ('move', 'copy') and 'date' in operation:
+            self.catalog.add(operation)
+        strategy, shared = result
+        if strategy is not None:
+            self.strategies[strategy] = self.strategies.get(strategy, 0) + 1
+            self.bytes_shared += shared
+            if self.verbose and self.link_mode != 'copy':
+                print('Copied (%s): %s' % (strategy, operation['dest']))
+
+    def submit(self, operation):
+        if self.journal is not None:
+            self.journal.planned(operation)
+        if self.catalog is not None and operation['action'] in ('move', 'copy') and 'date' in operation:
+            self.catalog.planned(operation)
+        if operation['action'] == 'skip':
+            if self.journal is not None:
+                self.journal.done(operation)
+            return
+        if self.pool is None:
+            self._done(operation, execute_operation(operation, self.duplicate_index, self.link_mode, self.stats,
+                                                    self.destinations, self.throttle))
+            return
+
+        dest_file = operation['dest']
+        if dest_file is not None:
+            self.wait(dest_file)
+        device = self._operation_device(operation)
+        if self.running.get(device, 0) < self.limits.get(device, self.jobs):
+            self._start(operation, device)
+        else:
+            self.queued.setdefault(device, deque()).append(operation)
+            if dest_file is not None:
+                self.queued_dests[dest_file] = self.queued_dests.get(dest_file, 0) + 1
+
+        # keep a bounded number of operations queued
+        if len(self.pending) + sum(len(queued) for queued in self.queued.values()) >= 4*self.jobs:
+            self._collect(wait_one=True)
+
+    def flush(self):
+        """wait until the operations submitted so far are applied"""
+
+        if self.pool is not None:
+            self._collect(wait_all=True)
+
+    def report(self):
+        """one line summary of the copy strategies used"""
+
+        counts = ', '.join('%d %s' % (count, strategy) for strategy, count in sorted(self.strategies.items()))
+        return 'Copies: %s (%d bytes shared instead of copied)' % (counts or 'none', self.bytes_shared)
+
+    def wait(self, dest_file):
+        """wait until the operations planned so far on dest_file are applied"""
+
+        while dest_file in self.queued_dests:
+            self._collect(wait_one=True)  # until they are started
+        future = self.by_dest.get(dest_file)
+        if future is not None:
+            future.result()
+            self._collect()
+
+    def _collect(self, wait_one=False, wait_all=False):
+        """handle the operations that are done (errors are raised here)"""
+
+        while True:
+            if wait_all:
+                done = wait(list(self.pending)).done
+            elif wait_one:
+                done = wait(list(self.pending), return_when=FIRST_COMPLETED).done
+            else:
+                done = [future for future in self.pending if future.done()]
+
+            for future in done:
+                operation = self.pending.pop(future)
+                device = self._operation_device(operation)
+                self.running[device] -= 1
+                self._start_queued(device)
+                self._done(operation, future.result())
+                if self.by_dest.get(operation['dest']) is future:
+                    del self.by_dest[operation['dest']]
+                if self.duplicate_index is not None and operation['action'] in ('move', 'copy'):
+                    self.duplicate_index.add(operation['dest'], operation['src'])
+
+            if not (wait_all and self.pending):
+                return  # wait_all also waits for the queued operations started meanwhile
+
+
+def plan_record(operation):
+    """line of a plan file for operation, with absolute paths (plans may be applied from another directory)"""
+
+    operation = dict(operation, src=os.path.abspath(operation['src']))
+    if operation['dest'] is not None:
+        operation['dest'] = os.path.abspath(operation['dest'])
+    return json.dumps(operation) + '\n'
+
+
+def read_plan(plan_file):
+    """generator over the operations saved in a plan file (one JSON object per line)"""
+
+    with open(plan_file) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _replan(operation, planned, verbose=True):
+    """
+    check again an operation of a plan whose destination was taken after the plan was saved: an identical
+    file is skipped (copy) or replaced (move), otherwise the file gets the next free name, as when planning.
+    planned holds the destinations of the plan, which are not free
+    """
+
+    src_file, dest_file = operation['src'], operation['dest']
+    if filecmp.cmp(src_file, dest_file, shallow=False):
+        if operation['action'] == 'copy':
+            operation['action'] = 'skip'
+        else:
+            operation['identical'] = True
+        if verbose:
+            print('Identical file appeared since planning: ' + dest_file)
+        return
+
+    root, ext = os.path.splitext(dest_file)
+    append = 1
+    while dest_file in planned or os.path.lexists(dest_file):
+        dest_file = root + '_' + str(append) + ext
+        append += 1
+    planned.add(dest_file)
+    if verbose:
+        print('%s appeared since planning, renaming to: %s' % (operation['dest'], dest_file))
+    operation['dest'] = dest_file
+
+
+def apply_plan(plan_file, dest_dir=None, library_index=False, verbose=True, transfer_jobs=1, device_limits=None,
+               link_mode='copy', catalog=True, throttle=None):
+    """
+    apply the operations saved by sortPhotos(..., plan_file=...), without scanning or reading metadata again.
+    dest_dir is only needed to lock the destination and update the library index (library_index=True) and
+    catalog, transfer_jobs, device_limits, link_mode, catalog and throttle are the same as for sortPhotos.
+    Returns the number of operations applied.
+    """
+
+    duplicate_index = None
+    if library_index:
+        duplicate_index = DuplicateIndex(dest_dir)
+    if catalog and dest_dir is not None:
+        catalog = Catalog(dest_dir)
+    else:
+        catalog = None
+
+    count = 0
+    with DestinationLock(dest_dir):
+        operations = list(read_plan(plan_file))
+        planned = set(operation['dest'] for operation in operations if operation['dest'] is not None)
+        with TransferExecutor(transfer_jobs, device_limits, duplicate_index, link_mode, verbose,
+                              catalog=catalog, throttle=throttle) as transfers:
+            for operation in operations:
+                if operation['action'] in ('move', 'copy') and not operation.get('identical') \
+                        and os.path.lexists(operation['dest']):
+                    _replan(operation, planned, verbose)
+                if verbose and operation['action'] != 'skip':
+                    print('%s: %s -> %s' % (operation['action'], operation['src'], operation['dest']))
+                transfers.submit(operation)
+                count += 1
+        if catalog is not None:
+            catalog.close()  # before the next run into dest_dir can add to it
+    if link_mode != 'copy' and transfers.strategies:
+        print(transfers.report())
+
+    if duplicate_index is not None:
+        duplicate_index.close()
+
+    return count
+
+
+# ---------------------------------------
+
+
+
+class Journal(object):
+    """
+    write-ahead journal of the operations applied (one JSON object per line): each operation is
+    recorded, and synced to disk, before it is applied, then marked as done once it is, so that an
+    interrupted run can be resumed or undone.  Runs using the same journal file append to it.
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.operations = []  # in the order they were planned
+        self.status = {}  # id -> 'planned', 'done' or 'undone'
+
+        if os.path.exists(journal_file):
+            with open(journal_file) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # last line cut short by the interruption
+                    if 'operation' in record:
+                        self.operations.append(record['operation'])
+                    self.status[record['id']] = record['status']
+        self.next_id = max([operation['id'] for operation in self.operations] + [0]) + 1
+        self.f = open(journal_file, 'a')
+        if self.f.tell() > 0:
+            self.f.write('\n')  # in case the last line was cut short
+
+    def _write(self, record, sync=False):
+        self.f.write(json.dumps(record) + '\n')
+        self.f.flush()
+        if sync:
+            os.fsync(self.f.fileno())
+
+    def planned(self, operation):
+        """record operation (unless it already is, e.g. when resuming) before it is applied"""
+
+        if 'id' in operation:
+            return
+        operation['id'] = self.next_id
+        self.next_id += 1
+        self.operations.append(operation)
+        self.status[operation['id']] = 'planned'
+        self._write({'id': operation['id'], 'status': 'planned', 'operation': operation}, sync=True)
+
+    def done(self, operation):
+        self.status[operation['id']] = 'done'
+        self._write({'id': operation['id'], 'status': 'done'})
+
+    def undone(self, operation):
+        self.status[operation['id']] = 'undone'
+        self._write({'id': operation['id'], 'status': 'undone'})
+
+    def unfinished(self):
+        """operations recorded but not marked as done (they may or may not have been applied)"""
+
+        return [operation for operation in self.operations if self.status[operation['id']] == 'planned']
+
+    def sources(self):
+        """source files of the operations recorded and not undone"""
+
+        return set(os.path.abspath(operation['src']) for operation in self.operations
+                   if self.status[operation['id']] != 'undone')
+
+    def close(self):
+        self.f.close()
+
+
+def resume_journal(journal, transfers):
+    """
+    finish the operations of an interrupted run: those that were applied are marked as done, the others
+    (and partial temporary files) are applied again through transfers.  Returns once they are all applied,
+    with their destinations in transfers.destinations, so that the files planned afterwards avoid them
+    """
+
+    resumed = []
+    for operation in journal.unfinished():
+        action = operation['action']
+        if action in ('move', 'remove') and not os.path.exists(operation['src']):
+            journal.done(operation)
+            continue
+        if action in ('move', 'copy') and os.path.exists(temporary_name(operation['dest'])):
+            os.remove(temporary_name(operation['dest']))
+        if action in ('move', 'copy') and os.path.lexists(operation['dest']) \
+                and filecmp.cmp(operation['src'], operation['dest'], shallow=False):
+            # applied, but not marked as done (or the source was not removed yet after a copy across devices)
+            if action == 'copy':
+                journal.done(operation)
+                continue
+            operation['identical'] = True
+        transfers.submit(operation)
+        if action in ('move', 'copy'):
+            resumed.append(operation['dest'])
+    transfers.flush()
+    for dest_file in resumed:
+        transfers.destinations.add(dest_file)
+
+
+def undo_journal(journal_file, verbose=True):
+    """
+    revert the operations recorded in journal_file, most recent first: moved files are moved back and
+    copies are deleted.  Removed files cannot be brought back.  Only the operations marked as done are
+    reverted (the others may not have happened, their destination can be another file), and a copy is
+    only deleted while it is still the same as its source.  Returns the number of operations undone.
+    """
+
+    journal = Journal(journal_file)
+    operations = [operation for operation in journal.operations if journal.status[operation['id']] != 'undone']
+
+    # identical files moved to the same destination (the later ones replaced it): all but the first get a copy
+    moves_to = {}
+    for operation in operations:
+        if operation['action'] == 'move' and journal.status[operation['id']] == 'done':
+            moves_to[operation['dest']] = moves_to.get(operation['dest'], 0) + 1
+
+    count = 0
+    for operation in reversed(operations):
+        action = operation['action']
+        src_file = operation['src']
+        dest_file = operation['dest']
+        done = journal.status[operation['id']] == 'done'
+
+        if action == 'move' and done and os.path.exists(dest_file) and not os.path.exists(src_file):
+            moves_to[dest_file] -= 1
+            if verbose:
+                print('Moving back: %s -> %s' % (dest_file, src_file))
+            execute_operation({'action': 'copy' if moves_to[dest_file] else 'move', 'src': dest_file,
+                               'dest': src_file})
+        elif action == 'copy' and done and os.path.exists(dest_file):
+            if os.path.isfile(src_file) and filecmp.cmp(src_file, dest_file, shallow=False):
                 if verbose:
-                    print("No activity detected.")
-                if len(file_present) > 0:
-                    print("Sorting files...")
-                    run_sortphotos(args)
-                    print("Done!")
+                    print('Removing copy: %s' % dest_file)
+                os.remove(dest_file)
+            else:
+                print('Not removing %s, it is no longer a copy of %s' % (dest_file, src_file))
+        elif action == 'remove' and done:
+            print('Cannot undo the removal of %s' % src_file)
+        journal.undone(operation)
+        count += 1
+
+    journal.close()
+    return count
+
+
+def shard_of(src_file, src_dir, count):
+    """shard (1 to count) of src_file, from a hash of its path relative to src_dir (the same on every host)"""
+
+    relative = os.path.relpath(src_file, src_dir).replace(os.sep, '/')
+    if not isinstance(relative, bytes):
+        relative = relative.encode('utf-8', 'surrogateescape')  # the bytes python 2 paths already are
+    digest = hashlib.md5(relative).hexdigest()
+    return int(digest[:8], 16) % count + 1
+
+
+def merge_plans(plan_files, dest_dir, sort_format, rename_format, copy_files=False, test=False,
+                remove_duplicates=True, day_begins=0, verbose=True, plan_file=None, library_index=False,
+                transfer_jobs=1, device_limits=None, link_mode='copy', catalog=True, throttle=None):
+    """
+    combine the plans saved by sharded runs (sortPhotos(..., shard=(i, n), plan_file=...)): the files
+    are planned again in the order a single run would have found them, so name collisions and duplicates
+    between shards are resolved as one run would.  The merged plan is applied, or saved to plan_file.
+    The other parameters are those of sortPhotos and must be the same as for the sharded runs.
+    Returns the number of operations.
+    """
+
+    operations = []
+    for shard_plan in plan_files:
+        operations.extend(read_plan(shard_plan))
+    operations.sort(key=lambda operation: operation.get('seq', -1))  # removals of ignored files first
+
+    duplicate_index = None
+    if library_index:
+        duplicate_index = DuplicateIndex(dest_dir)
+
+    execute = not test and plan_file is None
+    plan_out = None
+    if plan_file is not None:
+        plan_out = open(plan_file, 'w')
+
+    catalog = Catalog(dest_dir) if catalog and execute else None
+
+    destinations = DestinationCache()
+    with DestinationLock(dest_dir if execute else None):
+        with TransferExecutor(transfer_jobs, device_limits, duplicate_index, link_mode, verbose,
+                              destinations=destinations, catalog=catalog, throttle=throttle) as transfers:
+            planner = MovePlanner(dest_dir, sort_format, rename_format, copy_files, remove_duplicates, day_begins,
+                                  duplicate_index, verbose, transfers, destinations=destinations)
+            for operation in operations:
+                if 'date' in operation:
+                    if verbose:
+                        print('Source: ' + operation['src'])
+                    date = datetime.strptime(operation['date'], '%Y:%m:%d %H:%M:%S')
+                    operation = planner.plan(operation['src'], date, operation['tags'])
+                if plan_out is not None:
+                    plan_out.write(plan_record(operation))
+                if execute:
+                    transfers.submit(operation)
+        if catalog is not None:
+            catalog.close()  # before the next run into dest_dir can add to it
+
+    if plan_out is not None:
+        plan_out.close()
+    if duplicate_index is not None:
+        duplicate_index.close()
+
+    return len(operations)
+
+
+def relayout(dest_dir, sort_format, rename_format, day_begins=0, test=False, verbose=True):
+    """
+    move the files recorded in the Catalog of dest_dir to where sort_format and rename_format put them,
+    from the dates recorded when they were sorted (no metadata is read).  Name collisions are resolved as
+    when sorting, in the order the files were placed, but identical files are all kept.  Files are renamed
+    in place (the library should be on one file system) and the directories left empty are removed.
+    Returns the number of files moved.
+    """
+
+    if not os.path.exists(os.path.join(dest_dir, Catalog.filename)):
+        raise Exception('No catalog in ' + dest_dir + ' (files are recorded in it when they are sorted there)')
+
+    with DestinationLock(None if test else dest_dir):
+        catalog = Catalog(dest_dir)
+        entries = []
+        for path, name, date, tags in catalog.entries():
+            if os.path.isfile(path):
+                entries.append((path, name, date, tags))
+            else:
+                catalog.remove(path)  # deleted or moved away since
+
+        # plan as if the catalogued files were not in the library yet
+        destinations = DestinationCache(leaving=set(path for path, name, date, tags in entries))
+        planner = MovePlanner(dest_dir, sort_format, rename_format, remove_duplicates=False, day_begins=day_begins,
+                              verbose=False, destinations=destinations)
+        moves = []
+        for path, name, date, tags in entries:
+            operation = planner.plan(path, datetime.strptime(date, '%Y:%m:%d %H:%M:%S'), tags, name)
+            if operation['dest'] != path:
+                moves.append(operation)
+                if verbose:
+                    print('%s -> %s' % (path, operation['dest']))
+
+        duplicate_index = None
+        if not test and os.path.exists(os.path.join(dest_dir, DuplicateIndex.filename)):
+            duplicate_index = DuplicateIndex(dest_dir)
+
+        def move(operation):
+            execute_operation(operation, destinations=destinations)
+            catalog.move(operation['src'], operation['dest'])
+            if duplicate_index is not None:
+                duplicate_index.rename(operation['src'], operation['dest'])
+
+        # a file whose new place is still taken by one that has not moved yet waits under a temporary name
+        waiting = []
+        for operation in moves if not test else []:
+            if os.path.lexists(operation['dest']):
+                tmp_file = temporary_name(operation['dest'])
+                move(dict(operation, dest=tmp_file))
+                waiting.append(dict(operation, src=tmp_file))
+            else:
+                move(operation)
+        for operation in waiting:
+            move(operation)
+
+        # remove the directories left empty (deepest first)
+        top = os.path.abspath(dest_dir)
+        dirpaths = set()
+        for operation in moves if not test else []:
+            dirpath = os.path.dirname(os.path.abspath(operation['src']))
+            while dirpath.startswith(top + os.sep):
+                dirpaths.add(dirpath)
+                dirpath = os.path.dirname(dirpath)
+        for dirpath in sorted(dirpaths, key=len, reverse=True):
+            if os.path.isdir(dirpath) and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
+        catalog.close()
+        if duplicate_index is not None:
+            duplicate_index.close()
+
+    return len(moves)
+
+
+def exiftool_args(additional_groups_to_ignore, additional_tags_to_ignore, use_only_groups=None, use_only_tags=None):
+    """ExifTool arguments reading the date tags, and the groups and tags to ignore with them (see sortPhotos)"""
+
+    args = ['-j', '-a', '-G']
+
+    if use_only_tags is not None:
+        additional_groups_to_ignore = []
+        additional_tags_to_ignore = []
+        for t in use_only_tags:
+            args += ['-' + t]
+
+    elif use_only_groups is not None:
+        additional_groups_to_ignore = []
+        for g in use_only_groups:
+            args += ['-' + g + ':Time:All']
+
+    else:
+        args += ['-time:all']
+
+    return args, additional_groups_to_ignore, additional_tags_to_ignore
+
+
+def sortPhotos(src_dir, dest_dir, sort_format, rename_format, recursive=False,
+        copy_files=False, test=False, remove_duplicates=True, day_begins=0,
+        additional_groups_to_ignore=['File'], additional_tags_to_ignore=[],
+        use_only_groups=None, use_only_tags=None, verbose=True,
+        ignore_list=[], remove_ignored_files=False, remove_empty_dirs=False, jobs=1,
+        cache_file=None, library_index=False, dedupe_library=False, fast_dates=False,
+        plan_file=None, transfer_jobs=1, device_limits=None, link_mode='copy',
+        file_list=None, exiftool=None, journal_file=None, resume=False, exiftool_timeout=120, shard=None,
+        priority_tags=None, catalog=True, throttle=None, stats=None):
+    """
+    This function is a convenience wrapper around ExifTool based on common usage scenarios for sortphotos.py
+
+    Parameters
+    ---------------
+    src_dir : str or list(str)
+        directory containing files you want to process, or several of them (e.g. camera cards) sorted
+        into dest_dir in the same run, as if their files were in one directory (in the order given)
+    dest_dir : str
+        directory where you want to move/copy the files to
+    sort_format : str
+        date format code for how you want your photos sorted
+        (https://docs.python.org/2/library/datetime.html#strftime-and-strptime-behavior)
+    rename_format : str
+        date format code for how you want your files renamed
+        (https://docs.python.org/2/library/datetime.html#strftime-and-strptime-behavior)
+        None to not rename file
+    recursive : bool
+        True if you want src_dir to be searched recursively for files (False to search only in top-level of src_dir)
+    copy_files : bool
+        True if you want files to be copied over from src_dir to dest_dir rather than moved
+    test : bool
+        True if you just want to simulate how the files will be moved without actually doing any moving/copying
+    remove_duplicates : bool
+        True to remove files that are exactly the same in name and a file hash
+    day_begins : int
+        what hour of the day you want the day to begin (only for classification purposes).  Defaults at 0 as midnight.
+        Can be used to group early morning photos with the previous day.  must be a number between 0-23
+    additional_groups_to_ignore : list(str)
+        tag groups that will be ignored when searching for file data.  By default File is ignored
+    additional_tags_to_ignore : list(str)
+        specific tags that will be ignored when searching for file data.
+    use_only_groups : list(str)
+        a list of groups that will be exclusived searched across for date info
+    use_only_tags : list(str)
+        a list of tags that will be exclusived searched across for date info
+    verbose : bool
+        True if you want to see details of file processing
+    ignore : list(str)
+        a list of files to be ignored separated by ',' , example: --ignore '.*,*.db' (be aware to put the filter between bracket to avoid side effect with command line)
+    remove_ignored_files : bool
+        True to remove files that are ignored with ignore_list parameter
+    remove_empty_dirs : bool
+        True to empty dirs once processing is done
+    jobs : int
+        number of ExifTool processes used to extract metadata in parallel
+    cache_file : str
+        path of a metadata cache, files that did not change since they were cached are not read again.
+        None to not use a cache
+    library_index : bool
+        True to keep an index of the files in dest_dir, so that duplicates are found anywhere
+        in the library (not only when names collide)
+    dedupe_library : bool
+        True to first scan the files already in dest_dir into the index (implies library_index),
+        and list the duplicates already in the library
+    fast_dates : bool
+        True to read the dates of JPEG, TIFF and MP4/MOV files directly from their headers
+        instead of with ExifTool (maker notes are not read)
+    plan_file : str
+        path where the planned operations are saved (one JSON object per line) instead of being
+        applied, see apply_plan.  None to apply them directly
+    transfer_jobs : int
+        number of files moved/copied at the same time
+    device_limits : dict
+        maximum number of files moved/copied at the same time to a device, keyed by any path on that
+        device (e.g. {'/mnt/disk': 1}).  Devices not listed use transfer_jobs
+    link_mode : str
+        how files are copied: 'copy' (regular copy), 'hardlink', 'reflink' (copy-on-write clone),
+        or 'auto' (reflink, hardlink, copy in the kernel or regular copy, whichever works first)
+    file_list : list(str)
+        only process these files (e.g. the files that just arrived in src_dir) instead of scanning src_dir.
+        Files outside src_dir (or in its subdirectories when not recursive) are left alone
+    exiftool : ExifToolPool
+        an ExifToolPool to reuse (it is left open), instead of starting new ExifTool processes
+    journal_file : str
+        record each operation in this journal before and after applying it (see Journal), so that the run
+        can be resumed if interrupted, or undone with undo_journal
+    resume : bool
+        True to first finish the operations the journal has not recorded as done, and skip the files
+        already in the journal without reading them again
+    exiftool_timeout : float
+        seconds ExifTool may take on a batch of files before it is restarted and the files that make it
+        hang (or crash) are skipped
+    shard : tuple(int, int)
+        (i, n) to only handle the i-th of n shards of the files (1 <= i <= n, files are assigned to shards
+        by a hash of their path relative to src_dir).  The plan must be saved (plan_file) or tested, and
+        the plans of all the shards are then combined with merge_plans
+    priority_tags : dict(str, list(str))
+        all the date tags of some file types, by upper case file extension ('*' for the other types, see
+        parse_priority_tags).  Files of these types are read with only these tags (and the file system
+        dates) first, and only read again with all their date tags when none of them has a date (see
+        TieredReader).  None to read all the date tags of every file (not used with use_only_groups or
+        use_only_tags)
+    catalog : bool
+        True to record the files placed in dest_dir, with their date and tags, in its Catalog, so that the
+        library can be laid out again later with relayout
+    throttle : Throttle
+        paces the copies, duplicate comparisons and ExifTool reads (e.g. for a run in the background that
+        shares the disks with other programs).  None to run at full speed
+    stats : RunStats
+        gets the timers (seconds spent discovering files, extracting metadata, planning, copying...) and
+        counters (files read, moved, copied, without date, collisions, directories created, bytes written...)
+        of the run
+
+    Returns
+    ---------------
+    num_files : int
+        number of files read
+    """
+
+    # some error checking
+    src_dirs = list(src_dir) if isinstance(src_dir, (list, tuple)) else [src_dir]
+    for src_dir in src_dirs:
+        if not os.path.exists(src_dir):
+            raise Exception('Source directory does not exist: ' + src_dir)
+    if shard is not None and plan_file is None and not test:
+        raise Exception('The plan of a shard must be saved to be merged with the others')
+
+    stats = stats if stats is not None else RunStats()
+    start_time = time.time()
+
+    # setup arguments to exiftool, and tags to ignore
+    args, additional_groups_to_ignore, additional_tags_to_ignore = exiftool_args(
+        additional_groups_to_ignore, additional_tags_to_ignore, use_only_groups, use_only_tags)
+
+    if use_only_tags is not None or use_only_groups is not None:
+        priority_tags = None
+
+    if ignore_list is not None:
+        ignore_list = ignore_list.split(',')
+
+    # what is opened (and the lock) is closed even if the run fails, e.g. before the next runs in watch mode
+    with ExitStack() as resources:
+        duplicate_index = None
+        if library_index or dedupe_library:
+            duplicate_index = resources.enter_context(contextlib.closing(DuplicateIndex(dest_dir)))
+        if dedupe_library:
+            print('Indexing files already in ' + dest_dir)
+            duplicate_index.scan()
+            for group in duplicate_index.duplicates():
+                print('Identical files in the library: ' + ', '.join(group))
+
+        # operations are written to the plan file and/or applied as soon as they are planned
+        execute = not test and plan_file is None
+        plan_out = None
+        if plan_file is not None:
+            plan_out = resources.enter_context(open(plan_file, 'w'))
+
+        journal = None
+        skipped_files = set()
+        if journal_file is not None and execute:
+            journal = resources.enter_context(contextlib.closing(Journal(journal_file)))
+
+        # other runs into dest_dir wait for this one (and the other way around) before planning.  Once the
+        # transfers are done, the catalog is closed before the lock is released (before the next run can add to it)
+        destination = resources.enter_context(ExitStack())
+        lock = DestinationLock(dest_dir if execute else None)
+        destination.callback(lock.release)
+        catalog = Catalog(dest_dir) if catalog and execute else None
+        if catalog is not None:
+            destination.enter_context(contextlib.closing(catalog))
+
+        destinations = DestinationCache()
+        transfers = TransferExecutor(transfer_jobs, device_limits, duplicate_index, link_mode, verbose,
+                                     stats, destinations, journal, catalog, throttle)
+        destination.enter_context(transfers)
+        waited = throttle.waited if throttle is not None else 0
+
+        if journal is not None and resume:
+            lock.__enter__()
+            print('Resuming from ' + journal_file)
+            resume_journal(journal, transfers)
+            skipped_files = journal.sources()
+
+        def apply(operation):
+            stats.add({'move': 'files_moved', 'copy': 'files_copied', 'skip': 'files_skipped',
+                       'remove': 'files_removed'}[operation['action']])
+            if plan_out is not None:
+                plan_out.write(plan_record(operation))
+            if execute:
+                transfers.submit(operation)
+
+        print("Scanning for files matching:%s"%(ignore_list))
+        ignore = compile_ignore_list(ignore_list)
+        ignored = []
+
+        # get all metadata
+        if exiftool is None:
+            exiftool = ExifToolPool(jobs, verbose=verbose, timeout=exiftool_timeout, throttle=throttle)
+        with exiftool as e:
+            quarantined = len(e.quarantine)
+            restarts = e.restarts
+
+            # find the files to read first: ignored, hidden and unsupported files never reach ExifTool
+            extensions = e.get_supported_extensions()
+
+            def discover(src_dir):
+                src_ignored = []
+                if file_list is None:
+                    return list_files(src_dir, extensions, recursive, ignore, src_ignored), src_ignored
+                return select_files(file_list, src_dir, extensions, recursive, ignore, src_ignored), src_ignored
+
+            with stats.timer('discovery'):
+                with ThreadPoolExecutor(len(src_dirs)) as pool:  # e.g. several cards being read at once
+                    found = list(pool.map(discover, src_dirs))
+
+            # one list for all the sources, in the order given (a file in nested sources only once)
+            files = []
+            source_of = {}
+            for src_dir, (src_files, src_ignored) in zip(src_dirs, found):
+                for src_file in src_files:
+                    if src_file not in source_of:
+                        source_of[src_file] = src_dir
+                        files.append(src_file)
+                for src_file, i in src_ignored:
+                    if src_file not in source_of:
+                        source_of[src_file] = src_dir
+                        ignored.append((src_file, i))
+            if shard is not None:
+                # keep this shard's files, remembering where they are in the whole list for merge_plans
+                order = dict((src_file, i) for i, src_file in enumerate(files))
+                files = [src_file for src_file in files
+                         if shard_of(src_file, source_of[src_file], shard[1]) == shard[0]]
+                ignored = [(src_file, i) for src_file, i in ignored
+                           if shard_of(src_file, source_of[src_file], shard[1]) == shard[0]]
+            stats.add('files_ignored', len(ignored))
+            if skipped_files:
+                files = [src_file for src_file in files if os.path.abspath(src_file) not in skipped_files]
+
+            # filter ignored files and remove them if requested
+            for src_file, i in ignored:
+                if os.path.abspath(src_file) in skipped_files:
+                    continue
+                if remove_ignored_files:
+                    print("file [%s] match filter [%s]: deleting." % (src_file, ignore_list[i]))
+                    apply({'action': 'remove', 'src': src_file, 'dest': None})
+                else:
+                    print("file [%s] match filter [%s]: ignoring." % (src_file, ignore_list[i]))
+
+            print('Preprocessing with ExifTool.  May take a while for a large number of files.')
+            sys.stdout.flush()
+            reader = tiers = e
+            if priority_tags is not None:
+                reader = tiers = TieredReader(e, priority_tags, additional_groups_to_ignore, additional_tags_to_ignore)
+            if fast_dates:
+                reader = FastDateReader(reader)
+            if cache_file is None:
+                metadata = reader.iter_metadata(files, args)
+            else:
+                cache = resources.enter_context(contextlib.closing(MetadataCache(cache_file)))
+                args_key = None
+                if priority_tags is not None:
+                    args_key = '\n'.join(args + ['-fast2', json.dumps(priority_tags, sort_keys=True)])
+                metadata = cache.iter_metadata(files, args, reader, args_key=args_key)
+            metadata = stats.timed(metadata, 'extraction')
+
+            if not lock.acquire(blocking=False):
+                # read everything while the other run finishes, then plan against what it left in dest_dir
+                print('Waiting for another sortphotos run into ' + dest_dir)
+                metadata = list(metadata)
+                with stats.timer('lock_wait'):
+                    lock.acquire()
+
+            # setup output to screen
+            num_files = len(files)
+            stats.add('files', num_files)
+            print()
+
+            planner = MovePlanner(dest_dir, sort_format, rename_format, copy_files, remove_duplicates,
+                                  day_begins, duplicate_index, verbose, transfers, stats, destinations)
+
+            # parse output extracting oldest relevant date
+            for idx, data in enumerate(metadata):
+
+                # extract timestamp date for photo
+                with stats.timer('date_resolution'):
+                    src_file, date, keys = get_oldest_timestamp(data, additional_groups_to_ignore,
+                                                                additional_tags_to_ignore)
+
+                if verbose:
+                # write out which photo we are at
+                    ending = ']'
+                    if test:
+                        ending = '] (TEST - no files are being moved/copied)'
+                    print('[' + str(idx+1) + '/' + str(num_files) + ending)
+                    print('Source: ' + src_file)
+                else:
+                    # progress bar
+                    numdots = int(20.0*(idx+1)/num_files)
+                    sys.stdout.write('\r')
+                    sys.stdout.write('[%-20s] %d of %d ' % ('='*numdots, idx+1, num_files))
+                    sys.stdout.flush()
+
+                # check if no valid date found
+                if not date:
+                    stats.add('files_without_date')
+                    if verbose:
+                        print('No valid dates were found using the specified tags.  File will remain where it is.')
+                        print()
+                        # sys.stdout.flush()
+                    continue
+
+                if verbose:
+                    print('Date/Time: ' + str(date))
+                    print('Corresponding Tags: ' + ', '.join(keys))
+
+                # decide where the file goes, then move or copy it
+                with stats.timer('planning'):
+                    operation = planner.plan(src_file, date, keys)
+                if shard is not None:
+                    operation['seq'] = order[src_file]
+                apply(operation)
+
+                if verbose:
+                    print()
+                    # sys.stdout.flush()
+
+            stats.add('files_quarantined', len(e.quarantine) - quarantined)
+            stats.add('exiftool_restarts', e.restarts - restarts)
+
+        # wait for the last transfers
+        with stats.timer('transfer_wait'):
+            destination.close()
+
+        if not verbose:
+            print()
+
+        if link_mode != 'copy' and transfers.strategies:
+            print(transfers.report())
+
+        if remove_empty_dirs and file_list is None:
+            # use topdown false to scan from bottom to top to avoid trying to delete top directory while child haven't
+            # been processed
+            for src_dir in src_dirs:
+                for dirpath, dirnames, files in os.walk(src_dir, topdown=False):
+                    if not files and dirpath != src_dir:
+                        print("[Cleaning] Removing empty directory: %s" % dirpath)
+                        if not test:
+                            os.rmdir(dirpath)
+
+        elif remove_empty_dirs:
+            # only look at the directories the processed files were in (deepest first)
+            tops = [os.path.abspath(src_dir) for src_dir in src_dirs]
+            dirpaths = set()
+            for path in file_list:
+                dirpath = os.path.dirname(os.path.abspath(path))
+                while any(dirpath.startswith(top + os.sep) for top in tops):
+                    dirpaths.add(dirpath)
+                    dirpath = os.path.dirname(dirpath)
+            for dirpath in sorted(dirpaths, key=len, reverse=True):
+                if os.path.isdir(dirpath) and not os.listdir(dirpath):
+                    print("[Cleaning] Removing empty directory: %s" % dirpath)
+                    if not test:
+                        os.rmdir(dirpath)
+
+        if cache_file is not None:
+            evicted = cache.evict_missing(file_list)
+            print('Metadata cache: %d hits, %d misses, %d stale entries removed' % (cache.hits, cache.misses, evicted))
+            stats.add('cache_hits', cache.hits)
+            stats.add('cache_misses', cache.misses)
+
+        if fast_dates:
+            stats.add('fast_dates_hits', reader.hits)
+        if priority_tags is not None:
+            stats.add('priority_tags_hits', tiers.hits)
+            stats.add('priority_tags_misses', tiers.misses)
+        if throttle is not None:
+            stats.add_time('throttle_wait', throttle.waited - waited)
+        stats.add('directories_scanned', destinations.scans)
+        stats.add_time('run', time.time() - start_time)
+
+    return stats.counters.get('files', 0)
+
+class InotifyWatcher(object):
+    """
+    watch a directory (and its subdirectories when recursive) with inotify, linux only.
+    read() returns the files that have been completely written (closed after writing) or moved in
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0x00080000
+
+    def __init__(self, src_dir, recursive=False):
+        self.src_dir = os.path.abspath(src_dir)
+        self.recursive = recursive
+
+    def __enter__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available on this system')
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.watches = {}
+        self._watch(self.src_dir)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.close(self.fd)
+
+    def _watch(self, dirpath):
+        """watch dirpath (and its subdirectories when recursive), returns the files already in there"""
+
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        if self.recursive:
+            mask |= self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, fsencode(dirpath), mask)
+        if wd < 0:
+            if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                return []  # already gone
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), dirpath)
+        self.watches[wd] = dirpath
+
+        files = []
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            if not os.path.isdir(path):
+                files.append(path)
+            elif self.recursive and not name.startswith('.'):
+                files.extend(self._watch(path))
+        return files
+
+    def read(self, timeout=None):
+        """wait up to timeout seconds (forever if None) for events, returns the files ready to be sorted"""
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        buf = os.read(self.fd, 65536)
+        files = []
+        pos = 0
+        while pos + 16 <= len(buf):
+            wd, mask, cookie, length = struct.unpack_from('iIII', buf, pos)
+            name = fsdecode(buf[pos + 16:pos + 16 + length].rstrip(b'\0'))
+            pos += 16 + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # events were lost: look at everything
+                files.extend(list_files(self.src_dir, recursive=self.recursive))
+                continue
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+
+            path = os.path.join(self.watches[wd], name)
+            if mask & self.IN_ISDIR:
+                if self.recursive and not name.startswith('.') and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # files moved in with the directory (or written before the watch was added) have no events
+                    files.extend(self._watch(path))
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                files.append(path)
+
+        return files
+
+
+def run_inotify_watcher(args):
+    """
+    watch mode without fswatch: src_dir is watched with inotify and each file is queued once it has been
+    completely written, then sorted by a worker thread after args.debounce seconds without new files
+    """
+
+    verbose = not args.silent
+    debounce = 0.5 if args.debounce is None else args.debounce
+    batches = queue.Queue()
+    totals = RunStats()
+
+    def worker():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            try:
+                run_sortphotos(args, batch, exiftool, totals)
+            except Exception:
+                import traceback
+                print("Exception detected:", sys.exc_info()[0])
+                print('-'*60)
+                traceback.print_exc(file=sys.stdout)
+                print('-'*60)
+
+    with ExifToolPool(args.jobs, verbose=verbose, timeout=args.exiftool_timeout, throttle=args.throttle) as exiftool:
+        with InotifyWatcher(args.src_dir, args.recursive) as watcher:
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            if verbose:
+                print("Watching %s" % args.src_dir)
+
+            pending = []
+            last_event = 0
+            try:
+                while True:
+                    timeout = max(0, last_event + debounce - time.time()) if pending else None
+                    new_files = watcher.read(timeout)
+                    for new_file in new_files:
+                        if new_file not in pending:
+                            if verbose:
+                                print("New file present:", new_file)
+                            pending.append(new_file)
+                    if new_files:
+                        last_event = time.time()
+                    elif pending and time.time() >= last_event + debounce:
+                        batches.put(pending)
+                        pending = []
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if pending:
+                    batches.put(pending)  # without waiting for the end of the debounce delay
+                batches.put(None)
+                thread.join()
+
+
+def run_stdin_watcher(args):
+    """
+    watch mode: paths of new files are read from stdin (one per line, e.g. from fswatch), and once there has
+    been no activity for a few seconds exactly those files are sorted, with ExifTool kept running in between
+    """
+
+    import traceback
+    verbose = not args.silent
+    file_present = []
+    retry = []  # files of a run that failed, tried again one at a time
+    totals = RunStats()
+    fd = sys.stdin.fileno()
+    partial = b''  # last line, not complete yet
+
+    def sort_retries():
+        """
+        the files to try again, each alone, so that a file that fails every time neither fails the other
+        runs nor is tried forever (it is given up)
+        """
+
+        while retry:
+            try:
+                run_sortphotos(args, retry[:1], exiftool, totals)
+            except Exception:
+                print("Giving up on:", retry[0])
+                print('-'*60)
+                traceback.print_exc(file=sys.stdout)
+                print('-'*60)
+            del retry[0]
+
+    with ExifToolPool(args.jobs, verbose=verbose, timeout=args.exiftool_timeout, throttle=args.throttle) as exiftool:
+        try:
+            while True:
+                try:
+                    i, o, e = select.select([fd], [], [], 5 if args.debounce is None else args.debounce)
+
+                    if(i):
+                        # everything available, not a line at a time: lines left in a buffer would not wake select
+                        data = os.read(fd, 65536)
+                        lines = (partial + data).split(b'\n')
+                        partial = lines.pop() if data else b''
+                        for new_file in lines:
+                            new_file = fsdecode(new_file)  # python 3 paths are text
+                            if os.path.exists(new_file) and new_file not in file_present and new_file not in retry:
+                                if verbose:
+                                    print("New file present:", new_file)
+                                file_present.append(new_file)
+                        if not data:
+                            break  # end of input: sort what is left and stop
+                    else:
+                        if verbose:
+                            print("No activity detected.")
+                        sort_retries()
+                        if len(file_present) > 0:
+                            print("Sorting files...")
+                            run_sortphotos(args, file_present, exiftool, totals)
+                            print("Done!")
+                            file_present = []
+                except KeyboardInterrupt:
+                    break
+                except:
+                    e = sys.exc_info()[0]
+                    print("Exception detected:",e)
+                    print('-'*60)
+                    traceback.print_exc(file=sys.stdout)
+                    print('-'*60)
+                    # tried again with the next run (the files moved before the failure have left src_dir)
+                    retry += [new_file for new_file in file_present if os.path.exists(new_file)]
                     file_present = []
-        except KeyboardInterrupt:
-            sys.exit(0)
-        except:
-            import traceback
-            e = sys.exc_info()[0]
-            print("Exception detected:",e)
-            print('-'*60)
-            traceback.print_exc(file=sys.stdout)
-            print('-'*60)
-
-def run_sortphotos(args):
+        finally:
+            sort_retries()
+            if len(file_present) > 0:
+                run_sortphotos(args, file_present, exiftool, totals)
+
+def parse_shard(shard):
+    """'I/N' -> (I, N)"""
+
+    index, count = [int(part) for part in shard.split('/')]
+    if not 1 <= index <= count:
+        raise ValueError('shard %s is not between 1/%d and %d/%d' % (shard, count, count, count))
+    return index, count
+
+
+def parse_device_limits(device_limits):
+    """{path: limit} from a list of 'PATH=N' strings"""
+
+    limits = {}
+    for device_limit in device_limits or []:
+        path, limit = device_limit.rsplit('=', 1)
+        limits[path] = int(limit)
+    return limits
+
+def parse_size(size):
+    """number of bytes from e.g. '500K', '20M' or '1G' (powers of 1024)"""
+
+    multiplier = 1
+    if size[-1:].upper() in ('K', 'M', 'G'):
+        multiplier = 1024**(' KMG'.index(size[-1].upper()))
+        size = size[:-1]
+    return int(float(size)*multiplier)
+
+def parse_priority_tags(entries):
+    """
+    date tags of file types from EXT[,EXT...]=TAG[,TAG...] entries (EXT can be *), TAG being every date tag
+    these files can have besides the file system dates
+    """
+
+    priority_tags = {}
+    for entry in entries or []:
+        extensions, _, tags = entry.partition('=')
+        if not tags:
+            raise ValueError('Priority tags must be given as EXT=TAG[,TAG...]: ' + entry)
+        for extension in extensions.split(','):
+            priority_tags[extension.strip().lstrip('.').upper()] = [tag.strip() for tag in tags.split(',')]
+    return priority_tags
+
+def run_sortphotos(args, file_list=None, exiftool=None, totals=None):
+    """
+    run sortPhotos with the command line arguments and write the stats requested.
+    In watch mode totals accumulates the stats of all the batches
+    """
+
+    stats = RunStats()
     sorted = sortPhotos(args.src_dir, args.dest_dir, args.sort, args.rename, args.recursive,
                         args.copy, args.test, not args.keep_duplicates, args.day_begins,
                         args.ignore_groups, args.ignore_tags, args.use_only_groups,
-                        args.use_only_tags, not args.silent, args.ignore, args.remove_ignored_files, args.remove_empty_dirs)
+                        args.use_only_tags, not args.silent, args.ignore, args.remove_ignored_files, args.remove_empty_dirs,
+                        jobs=args.jobs, cache_file=args.cache, library_index=args.library_index,
+                        dedupe_library=args.dedupe_library, fast_dates=args.fast_dates,
+                        plan_file=args.save_plan, transfer_jobs=args.transfer_jobs,
+                        device_limits=parse_device_limits(args.device_limits), link_mode=args.link_mode,
+                        file_list=file_list, exiftool=exiftool, journal_file=args.journal, resume=args.resume,
+                        exiftool_timeout=args.exiftool_timeout,
+                        shard=parse_shard(args.shard) if args.shard else None,
+                        priority_tags=parse_priority_tags(args.priority_tags) if args.priority_tags else None,
+                        catalog=not args.no_catalog, throttle=args.throttle, stats=stats)
+
+    if args.stats_json:
+        stats.write_json(args.stats_json)
+    if totals is not None:
+        totals.merge(stats)
+    if args.prometheus_textfile:
+        (totals or stats).write_prometheus(args.prometheus_textfile)
 
     if sys.platform == 'darwin' and args.notify and sorted > 0:
         terminal_app_cmd = TERMINAL_APP + " -title 'Sortphoto' -message '"+str(sorted)+" photos sorted.' -sound 'default' -execute 'open "+args.dest_dir+"'"
         os.system(terminal_app_cmd)
 
 def main():
+    global daemon_socket
     import argparse
 
     # setup command line parsing
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
                                      description='Sort files (primarily photos and videos) into folders by date\nusing EXIF and other metadata')
-    parser.add_argument('src_dir', type=str, help='source directory')
-    parser.add_argument('dest_dir', type=str, help='destination directory')
+    parser.add_argument('src_dir', type=str, nargs='*',
+                        help='source directory (or several, sorted together into dest_dir),\n\
+    not needed with --undo, --apply-plan, --merge-plans and --relayout')
+    parser.add_argument('dest_dir', type=str, nargs='?', help='destination directory (not needed with --undo)')
     parser.add_argument('-r', '--recursive', action='store_true', help='search src_dir recursively')
     parser.add_argument('-c', '--copy', action='store_true', help='copy files instead of move')
     parser.add_argument('-s', '--silent', action='store_true', help='don\'t display parsing details.')
@@ -572,8 +3491,99 @@ def main():
     (be aware to put the filter between bracket to avoid side effect with command line)")
     parser.add_argument('--remove-ignored-files', action='store_true', help='remove ignored files')
     parser.add_argument('--remove-empty-dirs', action='store_true', help='remove empty dirs')
+    parser.add_argument('--jobs', type=int, default=1,
+                    help='number of ExifTool processes used to read metadata in parallel.\n\
+    Results are the same as with a single process, only faster on multi-core machines.')
+    parser.add_argument('--exiftool-timeout', type=float, default=120,
+                    help='seconds ExifTool may spend on a batch of files before it is restarted\n\
+    and the files it hangs or crashes on are skipped (default 120).')
+    parser.add_argument('--daemon', action='store_true',
+                    help='run an ExifTool daemon that keeps --jobs ExifTool processes ready (no source\n\
+    or destination needed).  Later runs use it instead of starting perl.')
+    parser.add_argument('--daemon-socket', type=str, default=None,
+                    help='unix socket of the daemon (default %s,\n\
+    or $SORTPHOTOS_SOCKET).' % daemon_socket)
+    parser.add_argument('--cache', type=str, default=None,
+                    help='path of a metadata cache file (created if needed).\n\
+    Files that did not change since a previous run are not read again by ExifTool.')
+    parser.add_argument('--library-index', action='store_true',
+                    help='keep an index of the files in dest_dir so duplicates are found anywhere\n\
+    in the library, not only when file names collide.')
+    parser.add_argument('--dedupe-library', action='store_true',
+                    help='scan the files already in dest_dir into the library index (implies --library-index)\n\
+    and list the duplicates already in the library.')
+    parser.add_argument('--fast-dates', action='store_true',
+                    help='read the dates of JPEG, TIFF and MP4/MOV files directly from their headers\n\
+    (much faster than ExifTool, but maker notes are not read).  Other files still use ExifTool.')
+    parser.add_argument('--priority-tags', type=str, nargs='+', default=None,
+                    help='EXT[,EXT...]=TAG[,TAG...] every date tag files of a type can have, besides the file\n\
+    system dates (* for the other types), e.g. \'JPG=EXIF:DateTimeOriginal\'.  These files are\n\
+    read with a fast ExifTool scan of only these tags first, and only read again with all\n\
+    their date tags when none is found.')
+    parser.add_argument('--no-catalog', action='store_true',
+                    help='do not record the files placed in dest_dir (with their date and tags) in its\n\
+    catalog, used by --relayout.')
+    parser.add_argument('--relayout', action='store_true',
+                    help='move the files of the library dest_dir (the only directory given) to the places\n\
+    given by --sort and --rename, from the dates recorded in its catalog (no\n\
+    metadata is read).')
+    parser.add_argument('--save-plan', type=str, default=None,
+                    help='plan the moves/copies and save them to this file (one JSON object per line)\n\
+    instead of applying them.  Use --apply-plan later to apply the plan.')
+    parser.add_argument('--apply-plan', type=str, default=None,
+                    help='apply a plan saved with --save-plan (the only directory given is dest_dir, used to\n\
+    lock it and update its catalog and index), without scanning the source directory\n\
+    or reading metadata again.')
+    parser.add_argument('--journal', type=str, default=None,
+                    help='record every move/copy/removal in this file before and after it is done,\n\
+    so that an interrupted run can be resumed (--resume) or undone (--undo).')
+    parser.add_argument('--resume', action='store_true',
+                    help='with --journal, finish an interrupted run: complete the operations it had\n\
+    started and skip the files it already handled, without reading them again.')
+    parser.add_argument('--undo', action='store_true',
+                    help='with --journal, revert the operations in the journal, most recent first\n\
+    (files moved back, copies deleted; removed files cannot be restored).')
+    parser.add_argument('--shard', type=str, default=None,
+                    help='I/N: only read and plan the I-th of N shards of the source files (split by a\n\
+    hash of their path), e.g. on one of N machines.  Needs --save-plan; combine the\n\
+    plans of all the shards with --merge-plans.')
+    parser.add_argument('--merge-plans', type=str, nargs='+', default=None,
+                    help='combine the plans saved by --shard runs (with the same options, the only directory\n\
+    given is dest_dir), resolving name collisions between shards, then apply the result\n\
+    or save it with --save-plan.')
+    parser.add_argument('--transfer-jobs', type=int, default=1,
+                    help='number of files moved/copied at the same time (default 1).')
+    parser.add_argument('--device-limits', type=str, nargs='+', default=None,
+                    help='maximum number of files moved/copied at the same time per destination device,\n\
+    given as PATH=N with any path on the device, e.g. --device-limits /mnt/hdd=1 /mnt/nas=8.\n\
+    Devices not listed use --transfer-jobs.')
+    parser.add_argument('--link-mode', type=str, default='copy', choices=['copy', 'hardlink', 'reflink', 'auto'],
+                    help='how files are copied with -c:  copy (regular copy, the default),\n\
+    hardlink, reflink (copy-on-write clone, e.g. btrfs/XFS), or auto which tries\n\
+    reflink, then hardlink, then a copy inside the kernel, then a regular copy.')
+    parser.add_argument('--background', action='store_true',
+                    help='run at the lowest CPU and I/O priority (nice, ionice on linux), and slow down\n\
+    the copies and ExifTool reads whenever the disk latency goes up (other programs\n\
+    are using the disks).  With --daemon, its ExifTool processes get the low priority.')
+    parser.add_argument('--bwlimit', type=str, default=None,
+                    help='maximum bytes copied (or compared) per second, with an optional K, M or G\n\
+    suffix, e.g. --bwlimit 20M.')
+    parser.add_argument('--files-per-sec', type=float, default=None,
+                    help='maximum number of files read by ExifTool per second.')
     parser.add_argument('-w','--watch', action='store_true', help='long running mode whare the source dir is constantly watched')
+    parser.add_argument('--inotify', action='store_true',
+                    help='with --watch, watch the source dir with inotify (linux) instead of reading\n\
+    new file paths from stdin (e.g. from fswatch)')
+    parser.add_argument('--debounce', type=float, default=None,
+                    help='with --watch, seconds without new files before they are sorted\n\
+    (default 0.5 with --inotify, 5 otherwise)')
     parser.add_argument('--notify', action='store_true', help='notify once sorting is done')
+    parser.add_argument('--stats-json', type=str, default=None,
+                    help='write the timers and counters of the run (of the last batch in watch mode)\n\
+    to this JSON file')
+    parser.add_argument('--prometheus-textfile', type=str, default=None,
+                    help='write the timers and counters (totals since the start in watch mode) to this\n\
+    file in the Prometheus text format, e.g. for the node exporter textfile collector')
     parser.add_argument('--set-locale', type=str,
                     default=None,
                     help='specify a locale like fr_FR fro french, useful to get month directory name in your own locale')
@@ -585,7 +3595,55 @@ def main():
     if args.set_locale:
         locale.setlocale(locale.LC_TIME, args.set_locale)
 
-    if args.watch:
+    if args.daemon_socket:
+        daemon_socket = args.daemon_socket
+
+    if args.background:
+        lower_priority()
+    args.throttle = None
+    if args.background or args.bwlimit or args.files_per_sec:
+        args.throttle = Throttle(parse_size(args.bwlimit) if args.bwlimit else None, args.files_per_sec,
+                                 adaptive=args.background)
+
+    if args.daemon:
+        ExifToolDaemon(daemon_socket, args.jobs, verbose=not args.silent).serve_forever()
+        return
+    if args.dest_dir is None and (len(args.src_dir) > 1 or args.relayout or args.apply_plan or args.merge_plans):
+        args.dest_dir = args.src_dir.pop() if args.src_dir else None  # the last directory given
+    # --undo and --apply-plan find the paths in their journal or plan, the plans of --merge-plans hold the sources
+    if not (args.undo or args.apply_plan) and \
+            ((not args.src_dir and not (args.relayout or args.merge_plans)) or args.dest_dir is None):
+        parser.error('the source and destination directories are required')
+    if args.apply_plan and args.dest_dir is None and (args.library_index or args.dedupe_library):
+        parser.error('the library index needs dest_dir')
+    if len(args.src_dir) <= 1:
+        args.src_dir = args.src_dir[0] if args.src_dir else None
+    elif args.watch:
+        parser.error('watch mode needs a single source directory')
+
+    if (args.resume or args.undo) and not args.journal:
+        parser.error('--resume and --undo need --journal')
+
+    if args.shard and not (args.save_plan or args.test):
+        parser.error('--shard needs --save-plan')
+
+    if args.undo:
+        undo_journal(args.journal, not args.silent)
+    elif args.merge_plans:
+        merge_plans(args.merge_plans, args.dest_dir, args.sort, args.rename, args.copy, args.test,
+                    not args.keep_duplicates, args.day_begins, not args.silent, args.save_plan,
+                    args.library_index or args.dedupe_library, args.transfer_jobs,
+                    parse_device_limits(args.device_limits), args.link_mode, not args.no_catalog, args.throttle)
+    elif args.apply_plan:
+        apply_plan(args.apply_plan, args.dest_dir, args.library_index or args.dedupe_library, not args.silent,
+                   args.transfer_jobs, parse_device_limits(args.device_limits), args.link_mode, not args.no_catalog,
+                   args.throttle)
+    elif args.relayout:
+        moved = relayout(args.dest_dir, args.sort, args.rename, args.day_begins, args.test, not args.silent)
+        print('%d files %s' % (moved, 'would be moved' if args.test else 'moved'))
+    elif args.watch and args.inotify:
+        run_inotify_watcher(args)
+    elif args.watch:
         run_stdin_watcher(args)
     else:
         run_sortphotos(args)
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+sortphotos_async.py
+
+asyncio interface of sortphotos, for programs that sort files as they arrive (e.g. an upload service):
+
+    config = SortConfig('/photos', copy_files=True)
+    async for result in sort_photos_async(files, config):
+        print(result.source, result.date, result.destination, result.action)
+
+ExifTool is driven through asyncio pipes (or the ExifTool daemon, when it is running), while the planning
+and the transfers run in a worker thread with the same code as sortphotos.py, so that the files end up
+where the command line would have put them.  Nothing is printed.  Needs python 3.7 or later.
+"""
+
+import asyncio
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from asyncio import FIRST_COMPLETED
+
+try:
+    from . import sortphotos
+except ImportError:
+    import sortphotos
+
+
+# what happened to a file: action is 'move', 'copy', 'skip' (identical file already there, when copying) or
+# 'remove' (identical file already in the library, when moving), or None when the file has no date
+FileResult = namedtuple('FileResult', ['source', 'date', 'tags', 'destination', 'action'])
+
+
+class SortConfig(object):
+    """
+    options of sort_photos_async, with the same meaning as the parameters of sortphotos.sortPhotos.
+    jobs is the number of ExifTool processes, batch_size the number of files read by ExifTool at once,
+    batch_delay the seconds a batch waits for more files from an async iterable before being read anyway, and
+    throttle a sortphotos.Throttle pacing the reads and copies (None to run at full speed).
+    Files are transferred one at a time, so there is no transfer_jobs
+    """
+
+    def __init__(self, dest_dir, sort_format='%Y/%m-%b', rename_format=None, copy_files=False, test=False,
+                 remove_duplicates=True, day_begins=0, additional_groups_to_ignore=['File'],
+                 additional_tags_to_ignore=[], use_only_groups=None, use_only_tags=None, priority_tags=None,
+                 library_index=False, jobs=1, link_mode='copy',
+                 journal_file=None, catalog=True, throttle=None, batch_size=50, batch_delay=0.5):
+        self.dest_dir = dest_dir
+        self.sort_format = sort_format
+        self.rename_format = rename_format
+        self.copy_files = copy_files
+        self.test = test
+        self.remove_duplicates = remove_duplicates
+        self.day_begins = day_begins
+        self.additional_groups_to_ignore = additional_groups_to_ignore
+        self.additional_tags_to_ignore = additional_tags_to_ignore
+        self.use_only_groups = use_only_groups
+        self.use_only_tags = use_only_tags
+        self.priority_tags = priority_tags
+        self.library_index = library_index
+        self.jobs = jobs
+        self.link_mode = link_mode
+        self.journal_file = journal_file
+        self.catalog = catalog
+        self.throttle = throttle
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+
+
+class AsyncExifTool(object):
+    """ExifTool in -stay_open mode, driven through asyncio pipes (or a connection to the ExifTool daemon)"""
+
+    sentinel = b'{ready%d}'
+
+    def __init__(self, executable=sortphotos.exiftool_location):
+        self.executable = executable
+        self.process = None
+        self.number = 0
+        self.buffer = bytearray()
+        self.broken = False  # a request was interrupted (cancelled), its answer is still to come
+
+    async def __aenter__(self):
+        self.lock = asyncio.Lock()
+        self.reader = None
+        if self.executable == sortphotos.exiftool_location and hasattr(asyncio, 'open_unix_connection') \
+                and sortphotos.DaemonConnection.owned(sortphotos.daemon_socket):
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(sortphotos.daemon_socket)
+            except OSError:
+                pass  # not running
+            else:
+                if not sortphotos.DaemonConnection.peer_owned(self.writer.get_extra_info('socket')):
+                    self.writer.close()  # not our daemon
+                    self.reader = None
+        if self.reader is None:
+            self.process = await asyncio.create_subprocess_exec(
+                'perl', self.executable, '-stay_open', 'True', '-@', '-',
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            self.reader, self.writer = self.process.stdout, self.process.stdin
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if not self.broken:
+            try:
+                self.writer.write(b'-stay_open\nFalse\n')
+                await self.writer.drain()
+            except (IOError, OSError):
+                self.broken = True  # already exited
+        if self.process is None:
+            self.writer.close()  # the daemon drains the process if needed
+            return
+        if self.broken:
+            self.process.kill()
+        try:
+            await asyncio.wait_for(self.process.wait(), 10)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+    def kill(self):
+        """stop right away, e.g. when the event loop is stopping"""
+
+        if self.process is None:
+            self.writer.close()
+        elif self.process.returncode is None:
+            self.process.kill()
+
+    async def execute(self, *args):
+        """(text) output of exiftool for args, one request at a time"""
+
+        async with self.lock:
+            if self.broken:
+                raise RuntimeError('ExifTool is still busy with a cancelled request')
+            self.number += 1
+            sentinel = self.sentinel % self.number
+            self.broken = True  # until the whole answer is read
+            request = '\n'.join(args).encode('utf-8', 'surrogateescape')  # file names as their bytes
+            self.writer.write(request + b'\n-execute%d\n' % self.number)
+            await self.writer.drain()
+
+            output = self.buffer
+            start = 0
+            while True:
+                pos = output.find(sentinel, start)
+                if pos >= 0:
+                    break
+                start = max(0, len(output) - len(sentinel))
+                increment = await self.reader.read(65536)
+                if not increment:
+                    raise RuntimeError('ExifTool exited')
+                output += increment
+            self.buffer = output[pos + len(sentinel):]
+            self.broken = False
+            return bytes(output[:pos]).decode('utf-8', 'replace').strip(' \t\n\r')
+
+    async def get_metadata(self, files, args):
+        """ExifTool records of files (files it could not read have none)"""
+
+        if not files:
+            return []
+        output = await self.execute(*(args + files))
+        return sortphotos.ExifTool.parse_metadata(output, verbose=False) if output else []
+
+
+async def _read_batch(exiftool, batch, args, tiers=None, throttle=None):
+    """
+    one record per file of batch (only its SourceFile if ExifTool could not read it, or if its name is not
+    UTF-8, see sortphotos.utf8_path), with the passes of tiers (a TieredReader) if any.
+    Returns once throttle (if any) allows the next batch to be read
+    """
+
+    start = time.time()
+    found = {}
+    files = [src_file for src_file in batch if sortphotos.utf8_path(src_file)]
+    missing = files
+    if tiers is not None:
+        passes, missing = tiers.first_passes(files, args)
+        for group, first_args in passes:
+            for data in await exiftool.get_metadata(group, first_args):
+                if tiers.accept(data):
+                    found[data['SourceFile']] = data
+            missing += [src_file for src_file in group if src_file not in found]
+
+    for data in await exiftool.get_metadata(missing, args):
+        found[data['SourceFile']] = data
+    if throttle is not None:
+        await asyncio.sleep(throttle.delay('files', len(batch), time.time() - start))
+    return [found.get(src_file, {'SourceFile': src_file}) for src_file in batch]
+
+
+async def _batches(files, batch_size, batch_delay):
+    """lists of at most batch_size files, from an iterable or an async iterable (that may pause)"""
+
+    if not hasattr(files, '__aiter__'):
+        batch = []
+        for src_file in files:
+            batch.append(src_file)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    iterator = files.__aiter__()
+    batch = []
+    pending = None
+    while True:
+        if pending is None:
+            pending = asyncio.ensure_future(iterator.__anext__())
+        if batch:
+            # a partial batch is read when no file comes for batch_delay
+            done, _ = await asyncio.wait([pending], timeout=batch_delay)
+            if not done:
+                yield batch
+                batch = []
+                continue
+        try:
+            batch.append(await pending)
+        except StopAsyncIteration:
+            break
+        finally:
+            if pending.done():
+                pending = None
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Sorter(object):
+    """planning and transfers of sort_photos_async, everything here runs in its worker thread"""
+
+    def __init__(self, config, groups, tags, stats):
+        self.config = config
+        self.groups = groups
+        self.tags = tags
+        self.stats = stats
+        self.execute = not config.test
+
+    def start(self):
+        config = self.config
+        self.lock = sortphotos.DestinationLock(config.dest_dir if self.execute else None)
+        self.lock.acquire()  # waits without printing, unlike its with block
+        self.duplicate_index = sortphotos.DuplicateIndex(config.dest_dir) if config.library_index else None
+        self.journal = None
+        if config.journal_file is not None and self.execute:
+            self.journal = sortphotos.Journal(config.journal_file)
+        self.catalog = sortphotos.Catalog(config.dest_dir) if config.catalog and self.execute else None
+        destinations = sortphotos.DestinationCache()
+        self.transfers = sortphotos.TransferExecutor(1, None, self.duplicate_index, config.link_mode, False,
+                                                     self.stats, destinations, self.journal, self.catalog,
+                                                     config.throttle).__enter__()
+        self.planner = sortphotos.MovePlanner(config.dest_dir, config.sort_format, config.rename_format,
+                                              config.copy_files, config.remove_duplicates, config.day_begins,
+                                              self.duplicate_index, False, self.transfers, self.stats, destinations)
+
+    def sort(self, data):
+        """plan and apply the file of the ExifTool record data, returns its FileResult"""
+
+        self.stats.add('files')
+        src_file, date, keys = sortphotos.get_oldest_timestamp(data, self.groups, self.tags)
+        if not date:
+            self.stats.add('files_without_date')
+            return FileResult(src_file, None, [], None, None)
+
+        operation = self.planner.plan(src_file, date, keys)
+        self.stats.add({'move': 'files_moved', 'copy': 'files_copied', 'skip': 'files_skipped',
+                        'remove': 'files_removed'}[operation['action']])
+        if self.execute:
+            self.transfers.submit(operation)
+            self.transfers.flush()
+        return FileResult(src_file, date, keys, operation['dest'], operation['action'])
+
+    def finish(self):
+        try:
+            self.transfers.__exit__(None, None, None)
+        finally:
+            if self.catalog is not None:
+                self.catalog.close()
+            self.lock.release()
+            if self.journal is not None:
+                self.journal.close()
+            if self.duplicate_index is not None:
+                self.duplicate_index.close()
+
+
+async def sort_photos_async(files, config, stats=None):
+    """
+    async generator sorting files (paths, from an iterable or an async iterable) into config.dest_dir, that
+    yields a FileResult per file once it has been moved/copied, in the order of files.
+
+    Files are read by ExifTool in batches, at most config.jobs batches ahead of the batch being transferred,
+    and a file is only transferred once the result of the previous one has been consumed, so every file moved
+    has been yielded.  Cancelling the task (or leaving the loop early) lets the transfer under way finish and
+    starts no other one, so that no file is left half moved (close the generator, e.g. with
+    contextlib.aclosing, when leaving the loop early).
+    stats (a RunStats) gets the counters of the run.
+    """
+
+    loop = asyncio.get_running_loop()
+    stats = stats if stats is not None else sortphotos.RunStats()
+    args, groups, tags = sortphotos.exiftool_args(config.additional_groups_to_ignore,
+                                                  config.additional_tags_to_ignore,
+                                                  config.use_only_groups, config.use_only_tags)
+    tiers = None
+    if config.priority_tags is not None and config.use_only_groups is None and config.use_only_tags is None:
+        tiers = sortphotos.TieredReader(None, config.priority_tags, groups, tags)  # only its passes are used
+
+    sorter = _Sorter(config, groups, tags, stats)
+    worker = ThreadPoolExecutor(max_workers=1)  # runs one thing at a time, in order
+    exiftools = []
+    reading = deque()  # tasks reading the next batches
+    next_batch = None  # task getting the next batch of files
+    started = False
+    try:
+        await loop.run_in_executor(worker, sorter.start)
+        started = True
+        for i in range(max(1, config.jobs)):
+            exiftools.append(AsyncExifTool())
+            await exiftools[-1].__aenter__()
+
+        count = 0
+        batches = _batches(files, config.batch_size, config.batch_delay)
+        while True:
+            if batches is not None and next_batch is None and len(reading) < len(exiftools):
+                next_batch = asyncio.ensure_future(batches.__anext__())
+            if next_batch is not None:
+                # start reading the next batch as soon as there is one, unless a batch read is ready to sort
+                await asyncio.wait([next_batch] + list(reading)[:1], return_when=FIRST_COMPLETED)
+                if next_batch.done():
+                    try:
+                        batch = next_batch.result()
+                    except StopAsyncIteration:
+                        batches = None
+                    else:
+                        reading.append(asyncio.ensure_future(_read_batch(
+                            exiftools[count % len(exiftools)], batch, args, tiers, config.throttle)))
+                        count += 1
+                    next_batch = None
+                    continue
+            if not reading:
+                break
+
+            records = await reading.popleft()
+            for data in records:
+                # each file is transferred only once the result of the previous one was consumed
+                yield await loop.run_in_executor(worker, sorter.sort, data)
+
+    finally:
+        if next_batch is not None:
+            reading.append(next_batch)
+        for task in reading:
+            task.cancel()
+        finishing = worker.submit(sorter.finish) if started else None  # after the batch being sorted, if any
+        try:
+            if reading:
+                await asyncio.gather(*reading, return_exceptions=True)
+            for exiftool in exiftools:
+                await exiftool.__aexit__(None, None, None)
+            if finishing is not None:
+                await asyncio.shield(asyncio.wrap_future(finishing))
+        except asyncio.CancelledError:
+            # cancelled again while cleaning up (e.g. the generator was not closed before the loop stopped)
+            for exiftool in exiftools:
+                exiftool.kill()
+            if finishing is not None:
+                finishing.result()  # the transfers under way must still finish
+            raise
+        finally:
+            worker.shutdown(wait=False)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+helpers.py
+
+What the tests share: sortphotos and the corpus generator of the benchmarks on the path, a JPEG with
+two EXIF dates, and test cases working in a temporary directory.
+
+"""
+
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(root, 'src'))
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import sortphotos
+from corpus import jpeg, make_corpus
+
+script = os.path.join(root, 'src', 'sortphotos.py')
+
+
+def jpeg_with_modify_date(date, modify_date):
+    """a minimal JPEG with DateTimeOriginal and ModifyDate (in IFD0) in its EXIF"""
+
+    # TIFF header, IFD0 holding ModifyDate and the ExifIFD pointer, ExifIFD holding DateTimeOriginal, the values
+    tiff = b'II*\0' + struct.pack('<I', 8)
+    tiff += struct.pack('<H', 2) + struct.pack('<HHII', 0x0132, 2, 20, 56) + struct.pack('<HHII', 0x8769, 4, 1, 38)
+    tiff += struct.pack('<I', 0)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', 0x9003, 2, 20, 76) + struct.pack('<I', 0)
+    tiff += modify_date.encode('ascii') + b'\0' + date.encode('ascii') + b'\0'
+    app1 = b'Exif\0\0' + tiff
+    return b'\xff\xd8\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + b'\xff\xd9'
+
+
+class WorkDirTest(unittest.TestCase):
+    """test case with a new temporary directory, work_dir, removed after each test"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='sortphotos-test-')
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+    def write_jpeg(self, path, date='2020:05:01 10:00:00', padding=b''):
+        """a JPEG with date as DateTimeOriginal at path (padding makes it differ from the others)"""
+
+        with open(path, 'wb') as f:
+            f.write(jpeg(date, padding))
+        return path
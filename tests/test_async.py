@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_async.py
+
+Leaving the loop of sort_photos_async early, file names that are not UTF-8 and tiered reads.
+
+"""
+
+import os
+import io
+import sys
+import asyncio
+import unittest
+from contextlib import aclosing, redirect_stdout
+
+from helpers import WorkDirTest
+from sortphotos_async import SortConfig, sort_photos_async
+
+
+class EarlyExitTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        os.mkdir(self.src_dir)
+        self.files = []
+        for i in range(30):
+            self.files.append(self.write_jpeg(os.path.join(self.src_dir, 'IMG_%04d.jpg' % i),
+                                              '2020:01:01 12:00:%02d' % i, str(i).encode()))
+
+    async def sort(self, count, day_begins=0):
+        config = SortConfig(self.dest_dir, rename_format='%Y%m%d_%H%M%S', batch_size=10, day_begins=day_begins)
+        results = []
+        async with aclosing(sort_photos_async(self.files, config)) as sorting:
+            async for result in sorting:
+                results.append(result)
+                if len(results) == count:
+                    break
+        return results
+
+    def test_only_yielded_files_are_moved(self):
+        results = asyncio.run(self.sort(15))
+        self.assertEqual(len(results), 15)
+        for result in results:
+            self.assertEqual(result.action, 'move')
+            self.assertTrue(os.path.exists(result.destination))
+        left = sorted(os.listdir(self.src_dir))
+        self.assertEqual(left, sorted(os.path.basename(f) for f in self.files[15:]))
+
+
+    def test_nothing_is_printed(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            results = asyncio.run(self.sort(len(self.files), day_begins=13))  # all grouped with the day before
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(set(os.path.dirname(result.destination) for result in results),
+                         set([os.path.join(self.dest_dir, '2019', '12-Dec')]))
+
+
+class ReadTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        os.mkdir(self.src_dir)
+
+    async def sort(self, files, **options):
+        config = SortConfig(self.dest_dir, test=True, **options)
+        return [result async for result in sort_photos_async(files, config)]
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'needs file names that are not UTF-8')
+    def test_names_that_are_not_utf8_get_no_date(self):
+        for name in [b'caf\xe9.JPG', b'cafe.JPG']:
+            self.write_jpeg(os.path.join(os.fsencode(self.src_dir), name), '2020:01:01 12:00:00', name)
+        files = sorted(os.path.join(self.src_dir, name) for name in os.listdir(self.src_dir))
+        results = asyncio.run(self.sort(files))
+        self.assertEqual([result.source for result in results], files)
+        self.assertEqual([result.date is None for result in results], [False, True])
+
+    def test_tiered_reads_give_the_same_dates(self):
+        files = [self.write_jpeg(os.path.join(self.src_dir, 'IMG_%d.jpg' % i), '2020:01:0%d 12:00:00' % i)
+                 for i in range(1, 4)]
+        files.append(os.path.join(self.src_dir, 'nodate.jpg'))
+        with open(files[-1], 'wb') as f:
+            f.write(b'\xff\xd8\xff\xd9')
+        expected = asyncio.run(self.sort(files))
+        self.assertEqual(asyncio.run(self.sort(files, priority_tags={'JPG': ['EXIF:DateTimeOriginal']})),
+                         expected)
+        self.assertEqual([result.date is None for result in expected], [False, False, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_catalog.py
+
+Order of the files recorded in the catalog by runs into the same destination.
+
+"""
+
+import os
+import sqlite3
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+
+class SequenceTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.dest_dir = self.work_dir
+
+    def operation(self, name):
+        return {'action': 'move', 'src': os.path.join('/src', name), 'dest': os.path.join(self.dest_dir, name),
+                'date': '2020-01-01 12:00:00', 'tags': ['EXIF:DateTimeOriginal']}
+
+    def test_runs_waiting_for_the_lock(self):
+        # both runs open the catalog before the first one takes the lock, the second waits for it
+        first = sortphotos.Catalog(self.dest_dir)
+        second = sortphotos.Catalog(self.dest_dir)
+        with sortphotos.DestinationLock(self.dest_dir):
+            for name in ['a.jpg', 'b.jpg']:
+                first.planned(self.operation(name))
+                first.add(self.operation(name))
+            first.close()
+        with sortphotos.DestinationLock(self.dest_dir):
+            for name in ['c.jpg', 'd.jpg']:
+                second.planned(self.operation(name))
+                second.add(self.operation(name))
+            second.close()
+
+        connection = sqlite3.connect(os.path.join(self.dest_dir, sortphotos.Catalog.filename))
+        rows = connection.execute('SELECT path, seq FROM files ORDER BY path').fetchall()
+        connection.close()
+        self.assertEqual(rows, [('a.jpg', 1), ('b.jpg', 2), ('c.jpg', 3), ('d.jpg', 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_daemon.py
+
+The ExifTool daemon (--daemon) and the checks of its clients.
+
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import unittest
+import subprocess
+from concurrent.futures import Future
+
+from helpers import sortphotos, script, WorkDirTest
+
+
+class ClientTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.socket_path = os.path.join(self.work_dir, 'daemon.sock')
+
+    def listen(self):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(1)
+        self.addCleanup(server.close)
+
+    def test_connects_to_own_socket(self):
+        self.listen()
+        connection = sortphotos.DaemonConnection.connect(self.socket_path)
+        self.assertIsNotNone(connection)
+        connection.kill()
+
+    def test_not_a_socket(self):
+        open(self.socket_path, 'w').close()
+        self.assertIsNone(sortphotos.DaemonConnection.connect(self.socket_path))
+        self.assertIsNone(sortphotos.DaemonConnection.connect(os.path.join(self.work_dir, 'missing.sock')))
+
+    @unittest.skipUnless(hasattr(os, 'getuid') and os.getuid() == 0, 'needs root to give the socket away')
+    def test_socket_of_another_user(self):
+        self.listen()
+        os.chown(self.socket_path, 65534, 65534)
+        self.assertIsNone(sortphotos.DaemonConnection.connect(self.socket_path))
+
+    def test_records_not_requested_are_dropped(self):
+        future = Future()
+        future.set_result(json.dumps([{'SourceFile': 'a.jpg', 'EXIF:DateTimeOriginal': '2020:01:01 00:00:00'},
+                                      {'SourceFile': '/elsewhere/b.jpg', 'EXIF:DateTimeOriginal': '2020:01:01'}]))
+        pool = sortphotos.ExifToolPool()
+        records = pool._batch_metadata([], future, ['a.jpg'], 0)
+        self.assertEqual([data['SourceFile'] for data in records], ['a.jpg'])
+
+
+class DaemonPoolTest(unittest.TestCase):
+
+    def test_idle_processes_are_capped(self):
+        daemon = sortphotos.ExifToolDaemon(jobs=1)
+        processes = [daemon._acquire() for i in range(3)]  # three clients at once
+        for process in processes:
+            daemon._release(process)
+        self.assertEqual(len(daemon.idle), 1)
+        self.assertEqual(sum(process.poll() is None for process in processes), 1)
+        for process in daemon.idle:
+            daemon._stop_process(process)
+
+
+class DaemonRoundTripTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.socket_path = os.path.join(self.work_dir, 'daemon.sock')
+        self.daemon = subprocess.Popen([sys.executable, script, '--daemon', '--silent',
+                                        '--daemon-socket', self.socket_path])
+        deadline = time.time() + 30
+        while not sortphotos.DaemonConnection.owned(self.socket_path):
+            if time.time() > deadline or self.daemon.poll() is not None:
+                self.fail('the daemon did not start')
+            time.sleep(0.05)
+        self.default_socket = sortphotos.daemon_socket
+        sortphotos.daemon_socket = self.socket_path
+
+    def tearDown(self):
+        sortphotos.daemon_socket = self.default_socket
+        self.daemon.terminate()
+        self.daemon.wait()
+
+    def test_clients_exit(self):
+        for i in range(2):  # the second client gets the process the first one left
+            start = time.time()
+            with sortphotos.ExifTool() as exiftool:
+                self.assertIsInstance(exiftool.process, sortphotos.DaemonConnection)
+                self.assertTrue(exiftool.execute('-ver'))
+            self.assertIsNotNone(exiftool.process.poll())
+            self.assertLess(time.time() - start, 10)  # not killed after waiting for it
+
+
+if __name__ == '__main__':
+    unittest.main()
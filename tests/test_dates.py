@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_dates.py
+
+parse_date_fast gives the same dates as parse_date_exif.
+
+"""
+
+import unittest
+
+from helpers import sortphotos
+
+DATE_STRINGS = [
+    '2020:05:01 10:00:00', '2020:05:01 10:00', '2020:05:01', '2020:05:01 10:00:00.123', '2020:05:01 10:00:00.',
+    # time zones
+    '2020:05:01 10:00:00Z', '2020:05:01 10:00:00+02:00', '2020:05:01 10:00:00-05:30',
+    '2020:05:01 10:00:00.5+02:00', '2020:05:01 10:00:00.25-08:00', '2020:05:01 10:00+01:00',
+    '2020:12:31 23:30:00+01:00', '2020:01:01 00:30:00-01:00', '2020:05:01 10:00:00+0200',
+    # no date, or not a valid one
+    '0000:00:00 00:00:00', '0000:00:00', '2020:00:00 00:00:00', '2020:02:30 10:00:00', '2020:05:01 24:00:00',
+    '2020:05:01 10:60:00', '10:00:00', '10:00:00.5', '', ' ', 'unknown',
+    # years out of the usual range
+    '1899:12:31 23:00:00', '1900:01:01 00:00:00-01:00', '0001:01:01 00:00:00', '9998:12:31 23:00:00',
+    # other spellings
+    ' 2020:05:01 10:00:00 ', '2020:05:01  10:00:00', '2020:5:1 10:0:0', '2020:05:01 10:00:00 DST',
+    u'２０２０:05:01 10:00:00',
+    2020,
+]
+
+
+class ParseDateTest(unittest.TestCase):
+
+    def setUp(self):
+        sortphotos.date_memo.clear()
+
+    def test_same_dates_as_parse_date_exif(self):
+        for date_string in DATE_STRINGS:
+            expected = sortphotos.parse_date_exif(date_string)
+            self.assertEqual(sortphotos.parse_date_fast(date_string), expected, repr(date_string))
+            self.assertEqual(sortphotos.parse_date_fast(date_string), expected, repr(date_string))  # remembered
+
+    def test_memo_is_bounded(self):
+        for second in range(sortphotos.DATE_MEMO_SIZE + 10):
+            date_string = '2020:05:01 10:%02d:%02d' % (second // 60 % 60, second % 60)
+            sortphotos.parse_date_fast(date_string + '+%02d:00' % (second // 3600))
+        self.assertLessEqual(len(sortphotos.date_memo), sortphotos.DATE_MEMO_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_discovery.py
+
+Files found in the source directory by list_files, as ExifTool would scan them.
+
+"""
+
+import os
+import sys
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+
+@unittest.skipUnless(hasattr(os, 'symlink'), 'needs symbolic links')
+class SymlinkTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        os.makedirs(os.path.join(self.src_dir, 'sub'))
+        os.makedirs(os.path.join(self.work_dir, 'other'))
+        for path in [('src', 'a.jpg'), ('src', 'sub', 'b.jpg'), ('other', 'c.jpg')]:
+            open(os.path.join(self.work_dir, *path), 'w').close()
+
+    def test_directory_links_are_followed_once(self):
+        os.symlink(os.pardir, os.path.join(self.src_dir, 'sub', 'up'))  # a loop
+        os.symlink(os.path.join(self.work_dir, 'other'), os.path.join(self.src_dir, 'other'))
+        os.symlink(os.path.join(self.work_dir, 'other'), os.path.join(self.src_dir, 'sub', 'again'))
+        files = sortphotos.list_files(self.src_dir, set(['JPG']), recursive=True)
+        relative = [os.path.relpath(path, self.src_dir) for path in files]
+        self.assertEqual(len(relative), 3)
+        self.assertEqual(sorted(path for path in relative if os.path.basename(path) != 'c.jpg'),
+                         ['a.jpg', os.path.join('sub', 'b.jpg')])
+
+    def test_directory_links_are_not_listed(self):
+        os.symlink(os.path.join(self.work_dir, 'other'), os.path.join(self.src_dir, 'other'))
+        files = sortphotos.list_files(self.src_dir, set(['JPG']))
+        self.assertEqual([os.path.basename(path) for path in files], ['a.jpg'])
+
+    def test_file_links_are_kept(self):
+        os.symlink(os.path.join(self.work_dir, 'other', 'c.jpg'), os.path.join(self.src_dir, 'c.jpg'))
+        files = sortphotos.list_files(self.src_dir, set(['JPG']))
+        self.assertEqual(sorted(os.path.basename(path) for path in files), ['a.jpg', 'c.jpg'])
+
+
+class ExtensionTest(WorkDirTest):
+
+    def test_names_without_extension_are_left_out(self):
+        for name in ['a.jpg', 'JPG', 'jpg', 'b.', 'c.tar.JPG']:
+            open(os.path.join(self.work_dir, name), 'w').close()
+        files = sortphotos.list_files(self.work_dir, set(['JPG']))
+        self.assertEqual(sorted(os.path.basename(path) for path in files), ['a.jpg', 'c.tar.JPG'])
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs file names that are not UTF-8')
+class NonUtf8Test(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        for name in [b'caf\xe9.JPG', b'cafe.JPG']:
+            self.write_jpeg(os.path.join(os.fsencode(self.work_dir), name), '2020:01:01 12:00:00', name)
+
+    def test_other_files_are_read(self):
+        files = sortphotos.list_files(self.work_dir, set(['JPG']))
+        with sortphotos.ExifToolPool() as exiftool:
+            for i in range(2):  # the process still answers
+                records = exiftool.get_metadata(files, ['-j', '-a', '-G', '-EXIF:DateTimeOriginal'])
+                self.assertEqual([os.path.basename(data['SourceFile']) for data in records], ['cafe.JPG'])
+            self.assertEqual([len(tool.pending) for tool in exiftool.tools], [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
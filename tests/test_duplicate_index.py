@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_duplicate_index.py
+
+Duplicates found anywhere in the library with the library index (--library-index).
+
+"""
+
+import os
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+
+class DuplicateIndexTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.addCleanup(os.chdir, os.getcwd())
+        # the same photo, under another name in src2
+        for src_dir, name in [('src', 'a.jpg'), ('src2', 'b.jpg')]:
+            os.mkdir(os.path.join(self.work_dir, src_dir))
+            self.write_jpeg(os.path.join(self.work_dir, src_dir, name))
+
+    def sort(self, src_dir, dest_dir):
+        sortphotos.sortPhotos(src_dir, dest_dir, '%Y/%m-%b', None, verbose=False, ignore_list=None,
+                              library_index=True)
+
+    def test_index_does_not_depend_on_current_directory(self):
+        os.chdir(self.work_dir)
+        self.sort('src', 'dst')
+        os.chdir(os.path.dirname(self.work_dir))
+        name = os.path.basename(self.work_dir)
+        self.sort(os.path.join(name, 'src2'), os.path.join(name, 'dst'))
+
+        # b.jpg is the same photo as a.jpg, already in the library: it was removed instead of moved
+        dest_dir = os.path.join(self.work_dir, 'dst', '2020', '05-May')
+        self.assertEqual(os.listdir(dest_dir), ['a.jpg'])
+        self.assertEqual(os.listdir(os.path.join(self.work_dir, 'src2')), [])
+
+        index = sortphotos.DuplicateIndex(os.path.join(self.work_dir, 'dst'))
+        try:
+            paths = [row[0] for row in index.connection.execute('SELECT path FROM files')]
+            self.assertEqual(paths, ['2020/05-May/a.jpg'])
+        finally:
+            index.close()
+
+
+class IndexLookupTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        self.index = sortphotos.DuplicateIndex(self.dest_dir)
+        self.addCleanup(self.index.close)
+        self.hashed = []
+        hash_file = sortphotos.DuplicateIndex._hash
+
+        def counted_hash(path, size, partial):
+            self.hashed.append(os.path.basename(path))
+            return hash_file(path, size, partial)
+
+        self.index._hash = counted_hash
+
+    def photo(self, directory, name, padding):
+        """a photo of the same size for every padding of the same length"""
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return self.write_jpeg(os.path.join(directory, name), padding=padding)
+
+    def test_only_files_with_the_same_partial_hash_are_compared(self):
+        for i in range(5):
+            self.index.add(self.photo(self.dest_dir, 'lib%d.jpg' % i, b'photo %d' % i))
+        src_file = self.photo(os.path.join(self.work_dir, 'src'), 'new.jpg', b'photo 3')
+        self.hashed = []
+        self.assertEqual(self.index.find_duplicate(src_file), os.path.join(self.dest_dir, 'lib3.jpg'))
+        # the other library files of the same size are not read
+        self.assertEqual(sorted(set(self.hashed)), ['lib3.jpg', 'new.jpg'])
+
+    def test_changed_file_stays_in_the_index(self):
+        library_file = self.photo(self.dest_dir, 'lib.jpg', b'photo A')
+        self.index.add(library_file)
+        old_src = self.photo(os.path.join(self.work_dir, 'src'), 'a.jpg', b'photo A')
+        new_src = self.photo(os.path.join(self.work_dir, 'src'), 'b.jpg', b'photo B')
+        self.photo(self.dest_dir, 'lib.jpg', b'photo B')  # edited in place
+        os.utime(library_file, (0, 0))
+
+        self.assertIsNone(self.index.find_duplicate(old_src))
+        self.assertEqual(self.index.find_duplicate(new_src), library_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_exiftool.py
+
+Answers of ExifTool read back in pieces: UTF-8 characters and sentinels split between reads, and
+requests in flight at the same time.
+
+"""
+
+import os
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+# answers each request with its arguments, one byte at a time
+ECHO = r'''
+my @args;
+while (defined(my $line = <STDIN>)) {
+    chomp $line;
+    if ($line =~ /^-execute(\d+)$/) {
+        for my $byte (split //, join(' ', @args) . "\n{ready$1}\n") {
+            syswrite(STDOUT, $byte);
+            select(undef, undef, undef, 0.0005);
+        }
+        @args = ();
+    } elsif ($line eq 'False') {
+        last;
+    } else {
+        push @args, $line;
+    }
+}
+'''
+
+
+class ReaderTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.executable = os.path.join(self.work_dir, 'echo.pl')
+        with open(self.executable, 'w') as f:
+            f.write(ECHO)
+
+    def test_characters_split_between_reads(self):
+        with sortphotos.ExifTool(self.executable) as exiftool:
+            self.assertEqual(exiftool.execute(u'caf\xe9', u'☃', u'\U0001f4f7'), u'caf\xe9 ☃ \U0001f4f7')
+            self.assertEqual(exiftool.execute(u'\xe9t\xe9'), u'\xe9t\xe9')
+
+    def test_answers_go_to_their_request(self):
+        with sortphotos.ExifTool(self.executable) as exiftool:
+            # the answer of the second request holds the sentinel of the first one
+            futures = [exiftool.submit('first'), exiftool.submit('{ready1}', '{ready}'), exiftool.submit('third')]
+            self.assertEqual([future.result(10) for future in futures], ['first', '{ready1} {ready}', 'third'])
+            self.assertEqual(len(exiftool.pending), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
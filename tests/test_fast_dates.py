@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_fast_dates.py
+
+Dates read from the file headers (--fast-dates) are the ones ExifTool reads.
+
+"""
+
+import os
+import unittest
+
+from helpers import sortphotos, make_corpus, jpeg_with_modify_date, WorkDirTest
+
+ARGS = ['-j', '-a', '-G', '-time:all']
+
+
+def without_access_date(data):
+    """reading a file can change its access date"""
+
+    return dict((key, value) for key, value in data.items() if key != 'File:FileAccessDate')
+
+
+class FastDatesTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.counts = make_corpus(self.src_dir, 60)
+        with open(os.path.join(self.src_dir, 'modified.JPG'), 'wb') as f:
+            f.write(jpeg_with_modify_date('2015:06:01 12:00:00', '2010:01:01 00:00:00'))
+        self.files = sortphotos.list_files(self.src_dir, recursive=True)
+
+    def test_same_records_as_exiftool(self):
+        with sortphotos.ExifToolPool() as exiftool:
+            expected = [without_access_date(data) for data in exiftool.iter_metadata(self.files, ARGS)]
+            reader = sortphotos.FastDateReader(exiftool)
+            records = [without_access_date(data) for data in reader.iter_metadata(self.files, ARGS)]
+        self.assertEqual(records, expected)
+        self.assertEqual(len(records), len(self.files))
+        self.assertGreaterEqual(reader.hits, len(self.files) - self.counts['nodate'])
+
+    def test_same_plan_as_exiftool(self):
+        plans = []
+        for fast_dates in [False, True]:
+            plans.append(os.path.join(self.work_dir, 'plan%d.jsonl' % len(plans)))
+            sortphotos.sortPhotos(self.src_dir, os.path.join(self.work_dir, 'dst'), '%Y/%m-%b', '%Y%m%d_%H%M%S',
+                                  recursive=True, verbose=False, ignore_list=None, plan_file=plans[-1],
+                                  fast_dates=fast_dates)
+        expected = list(sortphotos.read_plan(plans[0]))
+        self.assertEqual(len(expected), len(self.files) - self.counts['nodate'])
+        self.assertEqual(list(sortphotos.read_plan(plans[1])), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
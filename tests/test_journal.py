@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_journal.py
+
+Resuming and undoing runs recorded in a journal.
+
+"""
+
+import os
+import shutil
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+
+class ResumeTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        self.journal_file = os.path.join(self.work_dir, 'journal.jsonl')
+        os.mkdir(self.src_dir)
+        # two different photos taken the same second, so renamed to the same name
+        for name, padding in [('A.jpg', b'a'), ('B.jpg', b'b')]:
+            self.write_jpeg(os.path.join(self.src_dir, name), '2020:01:01 12:00:00', padding)
+
+    def interrupted_run(self):
+        """journal of a run interrupted before it moved A.jpg (and before it read B.jpg)"""
+
+        journal = sortphotos.Journal(self.journal_file)
+        journal.planned({'action': 'move', 'src': os.path.join(self.src_dir, 'A.jpg'),
+                         'dest': os.path.join(self.dest_dir, '2020', '01-Jan', '20200101_120000.jpg'),
+                         'date': '2020:01:01 12:00:00', 'tags': ['EXIF:DateTimeOriginal']})
+        journal.close()
+
+    def resume(self, transfer_jobs):
+        self.interrupted_run()
+        sortphotos.sortPhotos(self.src_dir, self.dest_dir, '%Y/%m-%b', '%Y%m%d_%H%M%S', verbose=False,
+                              ignore_list=None, journal_file=self.journal_file, resume=True,
+                              transfer_jobs=transfer_jobs)
+
+        dest_dir = os.path.join(self.dest_dir, '2020', '01-Jan')
+        contents = set()
+        for name in os.listdir(dest_dir):
+            with open(os.path.join(dest_dir, name), 'rb') as f:
+                contents.add(f.read())
+        self.assertEqual(sorted(os.listdir(dest_dir)), ['20200101_120000.jpg', '20200101_120000_1.jpg'])
+        self.assertEqual(len(contents), 2)
+        self.assertEqual(os.listdir(self.src_dir), [])
+
+    def test_resumed_move_is_not_overwritten(self):
+        self.resume(transfer_jobs=1)
+
+    def test_resumed_move_is_not_overwritten_by_parallel_transfers(self):
+        self.resume(transfer_jobs=4)
+
+
+class UndoTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_file = self.write_jpeg(os.path.join(self.work_dir, 'A.jpg'), '2020:01:01 12:00:00', b'a')
+        self.dest_file = os.path.join(self.work_dir, 'B.jpg')
+        self.journal_file = os.path.join(self.work_dir, 'journal.jsonl')
+
+    def copy(self, done):
+        journal = sortphotos.Journal(self.journal_file)
+        operation = {'action': 'copy', 'src': self.src_file, 'dest': self.dest_file}
+        journal.planned(operation)
+        if done:
+            shutil.copy2(self.src_file, self.dest_file)
+            journal.done(operation)
+        journal.close()
+
+    def test_copy_is_removed(self):
+        self.copy(done=True)
+        sortphotos.undo_journal(self.journal_file, verbose=False)
+        self.assertFalse(os.path.exists(self.dest_file))
+        self.assertTrue(os.path.exists(self.src_file))
+
+    def test_copy_not_done_keeps_destination(self):
+        self.copy(done=False)  # e.g. failed because B.jpg, another photo, was there already
+        self.write_jpeg(self.dest_file, '2020:01:01 12:00:00', b'b')
+        sortphotos.undo_journal(self.journal_file, verbose=False)
+        self.assertTrue(os.path.exists(self.dest_file))
+
+    def test_changed_copy_is_kept(self):
+        self.copy(done=True)
+        with open(self.dest_file, 'ab') as f:
+            f.write(b'edited')
+        sortphotos.undo_journal(self.journal_file, verbose=False)
+        self.assertTrue(os.path.exists(self.dest_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_link_mode.py
+
+Copies made with the link modes of copy_file (--link-mode), and their fallbacks.
+
+"""
+
+import os
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+
+class LinkModeTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_file = self.write_jpeg(os.path.join(self.work_dir, 'a.jpg'), padding=b'photo' * 1000)
+        self.dest_file = os.path.join(self.work_dir, 'b.jpg')
+        self.tried = []
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def break_strategy(self, name, partial=False):
+        """make the strategy of sortphotos.name fail (after writing part of the file if partial)"""
+
+        def failing(src_file, dest_file, *args):
+            self.tried.append(name)
+            if partial:
+                with open(dest_file, 'wb') as f:
+                    f.write(b'partial')
+            raise OSError('%s failed' % name)
+
+        self.addCleanup(setattr, sortphotos, name, getattr(sortphotos, name))
+        setattr(sortphotos, name, failing)
+
+    def break_hardlink(self):
+        def link(src_file, dest_file):
+            self.tried.append('link')
+            raise OSError('cross-device link')
+
+        self.addCleanup(setattr, sortphotos.os, 'link', os.link)
+        sortphotos.os.link = link
+
+    def test_hardlink_shares_the_inode(self):
+        self.assertEqual(sortphotos.copy_file(self.src_file, self.dest_file, 'hardlink'),
+                         ('hardlink', os.path.getsize(self.src_file)))
+        self.assertTrue(os.path.samefile(self.src_file, self.dest_file))
+        self.assertEqual(os.stat(self.src_file).st_nlink, 2)
+
+    def test_auto_falls_back_in_order(self):
+        self.break_strategy('_reflink')
+        self.assertEqual(sortphotos.copy_file(self.src_file, self.dest_file, 'auto')[0], 'hardlink')
+        os.remove(self.dest_file)
+
+        self.break_hardlink()
+        self.break_strategy('_kernel_copy')
+        self.assertEqual(sortphotos.copy_file(self.src_file, self.dest_file, 'auto'), ('copy', 0))
+        self.assertEqual(self.tried, ['_reflink', '_reflink', 'link', '_kernel_copy'])
+        self.assertEqual(self.read(self.dest_file), self.read(self.src_file))
+        self.assertFalse(os.path.samefile(self.src_file, self.dest_file))
+
+    def test_auto_without_fcntl(self):
+        # e.g. on windows: no reflink, a hard link instead
+        self.addCleanup(setattr, sortphotos, 'fcntl', sortphotos.fcntl)
+        sortphotos.fcntl = None
+        self.assertEqual(sortphotos.copy_file(self.src_file, self.dest_file, 'auto')[0], 'hardlink')
+        self.assertRaises(OSError, sortphotos.copy_file, self.src_file, self.dest_file + '2', 'reflink')
+
+    def test_no_partial_file_is_left(self):
+        self.break_strategy('_reflink', partial=True)
+        self.break_hardlink()
+        self.assertIn(sortphotos.copy_file(self.src_file, self.dest_file, 'auto')[0], ['kernel', 'copy'])
+        self.assertEqual(self.read(self.dest_file), self.read(self.src_file))
+
+        os.remove(self.dest_file)
+        self.break_strategy('_kernel_copy', partial=True)
+        self.break_strategy('_copy_data', partial=True)
+        self.assertRaises(OSError, sortphotos.copy_file, self.src_file, self.dest_file, 'auto')
+        self.assertFalse(os.path.exists(self.dest_file))
+
+    def test_failed_copy_leaves_no_file_at_the_destination(self):
+        self.break_strategy('_reflink', partial=True)
+        operation = {'action': 'copy', 'src': self.src_file, 'dest': os.path.join(self.work_dir, 'dst', 'a.jpg')}
+        self.assertRaises(OSError, sortphotos.execute_operation, operation, link_mode='reflink')
+        self.assertEqual(os.listdir(os.path.join(self.work_dir, 'dst')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_plan.py
+
+Plans saved with --save-plan and applied later, when the destination changed in between.
+
+"""
+
+import os
+import shutil
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+
+class ApplyPlanTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        self.plan_file = os.path.join(self.work_dir, 'plan.jsonl')
+        self.month_dir = os.path.join(self.dest_dir, '2020', '05-May')
+        os.mkdir(self.src_dir)
+        self.write_jpeg(os.path.join(self.src_dir, 'a.jpg'), padding=b'photo')
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def save_plan(self, src_dir, dest_dir, copy_files=False):
+        sortphotos.sortPhotos(src_dir, dest_dir, '%Y/%m-%b', None, copy_files=copy_files, verbose=False,
+                              ignore_list=None, plan_file=self.plan_file)
+
+    def test_different_file_appeared_is_kept(self):
+        self.save_plan(self.src_dir, self.dest_dir)
+        os.makedirs(self.month_dir)
+        self.write_jpeg(os.path.join(self.month_dir, 'a.jpg'), padding=b'another photo')
+        other = self.read(os.path.join(self.month_dir, 'a.jpg'))
+        photo = self.read(os.path.join(self.src_dir, 'a.jpg'))
+
+        sortphotos.apply_plan(self.plan_file, self.dest_dir, verbose=False)
+        self.assertEqual(self.read(os.path.join(self.month_dir, 'a.jpg')), other)
+        self.assertEqual(self.read(os.path.join(self.month_dir, 'a_1.jpg')), photo)
+        self.assertEqual(os.listdir(self.src_dir), [])
+
+    def test_identical_file_appeared_is_skipped(self):
+        self.save_plan(self.src_dir, self.dest_dir, copy_files=True)
+        os.makedirs(self.month_dir)
+        shutil.copy2(os.path.join(self.src_dir, 'a.jpg'), self.month_dir)
+
+        sortphotos.apply_plan(self.plan_file, self.dest_dir, verbose=False)
+        self.assertEqual(os.listdir(self.month_dir), ['a.jpg'])
+        self.assertEqual(os.listdir(self.src_dir), ['a.jpg'])
+
+    def test_paths_are_absolute(self):
+        cwd = os.getcwd()
+        os.chdir(self.work_dir)
+        try:
+            self.save_plan('src', 'dst')
+        finally:
+            os.chdir(cwd)
+        operation, = sortphotos.read_plan(self.plan_file)
+        self.assertEqual(operation['src'], os.path.join(os.path.realpath(self.src_dir), 'a.jpg'))
+        self.assertEqual(operation['dest'], os.path.join(os.path.realpath(self.month_dir), 'a.jpg'))
+
+        sortphotos.apply_plan(self.plan_file, self.dest_dir, verbose=False)  # from another directory
+        self.assertEqual(os.listdir(self.month_dir), ['a.jpg'])
+
+    def test_existing_file_is_not_replaced(self):
+        os.makedirs(self.month_dir)
+        self.write_jpeg(os.path.join(self.month_dir, 'a.jpg'), padding=b'another photo')
+        operation = {'action': 'move', 'src': os.path.join(self.src_dir, 'a.jpg'),
+                     'dest': os.path.join(self.month_dir, 'a.jpg')}
+        self.assertRaises(OSError, sortphotos.execute_operation, operation)
+        self.assertTrue(os.path.exists(operation['src']))
+
+    def test_identical_file_is_replaced_when_moving(self):
+        os.makedirs(self.month_dir)
+        shutil.copy2(os.path.join(self.src_dir, 'a.jpg'), self.month_dir)
+        sortphotos.sortPhotos(self.src_dir, self.dest_dir, '%Y/%m-%b', None, verbose=False, ignore_list=None)
+        self.assertEqual(os.listdir(self.month_dir), ['a.jpg'])
+        self.assertEqual(os.listdir(self.src_dir), [])
+
+
+class FailedRunTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        os.mkdir(self.src_dir)
+        self.write_jpeg(os.path.join(self.src_dir, 'a.jpg'), padding=b'photo')
+
+    def failing_plan(self, *args):
+        raise RuntimeError('planning failed')
+
+    def test_destination_is_released(self):
+        plan = sortphotos.MovePlanner.plan
+        sortphotos.MovePlanner.plan = self.failing_plan
+        try:
+            sortphotos.sortPhotos(self.src_dir, self.dest_dir, '%Y/%m-%b', None, verbose=False, ignore_list=None,
+                                  transfer_jobs=2, journal_file=os.path.join(self.work_dir, 'journal.jsonl'))
+        except RuntimeError:
+            # released while the run is still referenced (by the traceback, as when watch mode reports it)
+            lock = sortphotos.DestinationLock(self.dest_dir)
+            self.assertTrue(lock.acquire(blocking=False))
+            lock.release()
+        else:
+            self.fail('the run did not fail')
+        finally:
+            sortphotos.MovePlanner.plan = plan
+
+        sortphotos.sortPhotos(self.src_dir, self.dest_dir, '%Y/%m-%b', None, verbose=False, ignore_list=None)
+        self.assertEqual(os.listdir(self.src_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
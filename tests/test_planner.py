@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_planner.py
+
+Name collisions found by MovePlanner through the DestinationCache.
+
+"""
+
+import os
+import time
+import threading
+import unittest
+from datetime import datetime
+
+from helpers import sortphotos, WorkDirTest
+
+date = datetime(2020, 5, 1, 10, 0, 0)
+
+
+class CollisionTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        self.month_dir = os.path.join(self.dest_dir, '2020', '05-May')
+        os.mkdir(self.src_dir)
+        os.makedirs(self.month_dir)
+
+    def planner(self, case_insensitive=False):
+        destinations = sortphotos.DestinationCache()
+        if case_insensitive:
+            # as on macOS or windows (the file system the tests run on may be case sensitive)
+            destinations.insensitive[os.stat(self.dest_dir).st_dev] = True
+        return sortphotos.MovePlanner(self.dest_dir, '%Y/%m-%b', None, verbose=False, destinations=destinations)
+
+    def test_names_differing_in_case_collide(self):
+        self.write_jpeg(os.path.join(self.month_dir, 'img_0001.jpg'), padding=b'existing')
+        src_file = self.write_jpeg(os.path.join(self.src_dir, 'IMG_0001.JPG'), padding=b'new')
+
+        operation = self.planner(case_insensitive=True).plan(src_file, date, [])
+        self.assertEqual(operation['dest'], os.path.join(self.month_dir, 'IMG_0001_1.JPG'))
+
+        operation = self.planner().plan(src_file, date, [])
+        self.assertEqual(operation['dest'], os.path.join(self.month_dir, 'IMG_0001.JPG'))
+
+    def test_planned_names_differing_in_case_collide(self):
+        first = self.write_jpeg(os.path.join(self.src_dir, 'img_0001.jpg'), padding=b'first')
+        second = self.write_jpeg(os.path.join(self.src_dir, 'IMG_0001.JPG'), padding=b'second')
+        planner = self.planner(case_insensitive=True)
+        planner.dest_dir = os.path.join(self.dest_dir, 'new')  # directories not created yet
+
+        dests = [planner.plan(src_file, date, [])['dest'] for src_file in (first, second)]
+        self.assertEqual(dests, [os.path.join(self.dest_dir, 'new', '2020', '05-May', 'img_0001.jpg'),
+                                 os.path.join(self.dest_dir, 'new', '2020', '05-May', 'IMG_0001_1.JPG')])
+
+    def test_placed_files_are_listed(self):
+        destinations = sortphotos.DestinationCache()
+        dest_file = os.path.join(self.month_dir, 'a.jpg')
+        self.assertFalse(destinations.exists(dest_file))  # the directory is listed (empty)
+
+        src_file = self.write_jpeg(os.path.join(self.src_dir, 'a.jpg'), padding=b'photo')
+        sortphotos.execute_operation({'action': 'copy', 'src': src_file, 'dest': dest_file},
+                                     destinations=destinations)
+        self.assertTrue(destinations.exists(dest_file))
+
+    def test_existing_files_are_found_in_the_listing(self):
+        destinations = sortphotos.DestinationCache()
+        self.write_jpeg(os.path.join(self.month_dir, 'a.jpg'), padding=b'existing')
+        self.assertTrue(destinations.exists(os.path.join(self.month_dir, 'a.jpg')))
+        scans = destinations.scans
+
+        operations = []
+        for name in ['a.jpg', 'b.jpg']:
+            src_file = self.write_jpeg(os.path.join(self.src_dir, name), padding=b'photo ' + name.encode())
+            operations.append({'action': 'move', 'src': src_file, 'dest': os.path.join(self.month_dir, name)})
+        self.assertRaises(OSError, sortphotos.execute_operation, operations[0], destinations=destinations)
+        sortphotos.execute_operation(operations[1], destinations=destinations)
+        self.assertEqual(os.listdir(self.src_dir), ['a.jpg'])
+        self.assertEqual(destinations.scans, scans)  # no directory listed again
+
+
+class ThreadedCacheTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        for i in range(3):
+            open(os.path.join(self.work_dir, 'a%d.jpg' % i), 'w').close()
+        scandir = sortphotos.scandir
+
+        def slow_scandir(path):
+            time.sleep(0.1)  # e.g. on a network share
+            return scandir(path)
+
+        self.addCleanup(setattr, sortphotos, 'scandir', scandir)
+        sortphotos.scandir = slow_scandir
+
+    def test_directory_is_listed_once(self):
+        destinations = sortphotos.DestinationCache(leaving=set([os.path.join(self.work_dir, 'a0.jpg')]))
+        found = []
+        threads = [threading.Thread(target=lambda i=i: found.append(
+            destinations.exists(os.path.join(self.work_dir, 'a%d.jpg' % (i % 3))))) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(destinations.scans, 1)
+        self.assertEqual(sorted(found), [False] * 3 + [True] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
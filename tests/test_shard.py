@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_shard.py
+
+Sorting a corpus in shards, each in its own process, then merging their plans gives the same plan
+as a single run over the whole corpus.
+
+"""
+
+import os
+import sys
+import unittest
+import subprocess
+
+from helpers import sortphotos, make_corpus, script, WorkDirTest
+
+
+def read_operations(plan_file):
+    """operations of a plan, without the position of the files in the scan (only in shard plans)"""
+
+    operations = []
+    for operation in sortphotos.read_plan(plan_file):
+        operation.pop('seq', None)
+        operations.append(operation)
+    return operations
+
+
+class ShardTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        self.counts = make_corpus(self.src_dir, 200)
+
+    def test_merged_shards_match_single_run(self):
+        # file system dates (e.g. the access date) change as the files are read: only the EXIF/QuickTime ones
+        options = ['-r', '-s', '--rename', '%Y%m%d_%H%M', '--ignore-groups', 'File']
+        single = os.path.join(self.work_dir, 'single.jsonl')
+        subprocess.check_call([sys.executable, script, self.src_dir, self.dest_dir, '--save-plan', single]
+                              + options, stdout=subprocess.PIPE)
+
+        # one process per shard, all at the same time against the same directory
+        shards = [os.path.join(self.work_dir, 'shard%d.jsonl' % i) for i in range(1, 4)]
+        processes = [subprocess.Popen([sys.executable, script, self.src_dir, self.dest_dir,
+                                       '--shard', '%d/3' % i, '--save-plan', shard] + options,
+                                      stdout=subprocess.PIPE)
+                     for i, shard in enumerate(shards, 1)]
+        for process in processes:
+            process.communicate()
+            self.assertEqual(process.returncode, 0)
+        for shard in shards:
+            self.assertTrue(read_operations(shard))  # 200 files are spread over every shard
+
+        merged = os.path.join(self.work_dir, 'merged.jsonl')
+        # the plans hold the source files, dest_dir is the only directory needed
+        subprocess.check_call([sys.executable, script, self.dest_dir, '--save-plan', merged]
+                              + options + ['--merge-plans'] + shards, stdout=subprocess.PIPE)
+
+        expected = read_operations(single)
+        self.assertEqual(len(expected), 200 - self.counts['nodate'])
+        self.assertEqual(read_operations(merged), expected)
+        self.assertFalse(os.path.exists(self.dest_dir))  # nothing applied yet
+
+        sortphotos.apply_plan(merged, self.dest_dir, verbose=False)
+        moved = [operation['dest'] for operation in expected if operation['action'] == 'move']
+        self.assertTrue(moved)
+        self.assertTrue(all(os.path.isfile(dest_file) for dest_file in moved))
+
+
+if __name__ == '__main__':
+    unittest.main()
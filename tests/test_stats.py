@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_stats.py
+
+Counters and timers of a run: in the RunStats given to sortPhotos, --stats-json and --prometheus-textfile.
+
+"""
+
+import os
+import re
+import sys
+import json
+import unittest
+import subprocess
+
+from helpers import sortphotos, script, WorkDirTest
+
+
+class StatsTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        os.mkdir(self.src_dir)
+        for i in range(3):
+            self.write_jpeg(os.path.join(self.src_dir, 'IMG_%d.jpg' % i), '2020:05:01 10:00:0%d' % i, b'%d' % i)
+        with open(os.path.join(self.src_dir, 'nodate.jpg'), 'wb') as f:
+            f.write(b'\xff\xd8\xff\xd9')
+
+    def test_files_read_are_returned(self):
+        stats = sortphotos.RunStats()
+        num_files = sortphotos.sortPhotos(self.src_dir, self.dest_dir, '%Y/%m-%b', None, verbose=False,
+                                          ignore_list=None, stats=stats)
+        self.assertEqual(num_files, 4)
+        self.assertEqual(stats.counters['files'], 4)
+        self.assertEqual(stats.counters['files_moved'], 3)
+        self.assertEqual(sortphotos.sortPhotos(self.src_dir, self.dest_dir, '%Y/%m-%b', None, verbose=False,
+                                               ignore_list=None), 1)
+
+    def test_json_and_prometheus_files(self):
+        stats_json = os.path.join(self.work_dir, 'stats.json')
+        textfile = os.path.join(self.work_dir, 'sortphotos.prom')
+        subprocess.check_call([sys.executable, script, self.src_dir, self.dest_dir, '--stats-json', stats_json,
+                               '--prometheus-textfile', textfile], stdout=subprocess.PIPE)
+
+        with open(stats_json) as f:
+            stats = json.load(f)
+        self.assertEqual(sorted(stats), ['counters', 'seconds'])
+        self.assertEqual(stats['counters']['files'], 4)
+        self.assertEqual(stats['counters']['files_moved'], 4)  # the command line also takes file system dates
+        self.assertGreater(stats['seconds']['run'], 0)
+        self.assertGreaterEqual(stats['seconds']['run'], stats['seconds']['extraction'])
+
+        with open(textfile) as f:
+            lines = f.read().splitlines()
+        self.assertFalse(os.path.exists(textfile + '.tmp'))
+        samples = {}
+        for comment, sample in zip(lines[::2], lines[1::2]):
+            name, value = sample.split(' ')
+            self.assertRegex(name, r'^sortphotos_\w+$')
+            self.assertEqual(comment, '# TYPE %s %s' % (name, 'gauge' if name.endswith('_timestamp_seconds')
+                                                        else 'counter'))
+            samples[name] = float(value)
+        for name, value in stats['counters'].items():
+            self.assertEqual(samples['sortphotos_%s_total' % name], value)
+        for name, seconds in stats['seconds'].items():
+            self.assertAlmostEqual(samples['sortphotos_%s_seconds_total' % name], seconds, places=5)
+        self.assertEqual(len(samples), len(stats['counters']) + len(stats['seconds']) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
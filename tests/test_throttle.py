@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_throttle.py
+
+Pacing of background runs by Throttle: rates, and the share of the time spent working when the disks
+get slower.
+
+"""
+
+import os
+import time
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+
+class ThrottleTest(unittest.TestCase):
+
+    def steady(self, throttle, count, seconds=0.01):
+        """count reads of a file taking seconds each, returns the pauses"""
+
+        return [throttle.delay('files', 1, seconds) for i in range(count)]
+
+    def test_no_limit_and_steady_disks_do_not_wait(self):
+        throttle = sortphotos.Throttle()
+        self.assertEqual(self.steady(throttle, 50), [0.0] * 50)
+        self.assertEqual(throttle.duty, 1.0)
+        self.assertEqual(throttle.waited, 0.0)
+
+    def test_rates(self):
+        throttle = sortphotos.Throttle(bytes_per_sec=1 << 20, files_per_sec=10, adaptive=False)
+        pauses = [throttle.delay('files', 5, 0) for i in range(3)]
+        for pause, expected in zip(pauses, [0.5, 1.0, 1.5]):  # the work is queued after the previous one
+            self.assertAlmostEqual(pause, expected, places=2)
+        self.assertAlmostEqual(throttle.delay('bytes', 1 << 19, 0), 0.5, places=2)  # each kind has its own rate
+        self.assertAlmostEqual(throttle.waited, 3.5, places=2)
+
+    def test_duty_cycle_follows_latency(self):
+        throttle = sortphotos.Throttle()
+        self.steady(throttle, 20)
+
+        # another program comes up: the duty is halved, at most once a second
+        pauses = self.steady(throttle, 10, 0.1)
+        self.assertEqual(throttle.duty, 0.5)
+        self.assertAlmostEqual(pauses[-1], 0.1)  # as long as the work
+        for i in range(6):
+            throttle.last_decrease -= 2
+            self.steady(throttle, 1, 0.1)
+        self.assertEqual(throttle.duty, 0.05)  # no lower
+        self.assertAlmostEqual(self.steady(throttle, 1, 0.1)[0], 0.1 * 19)
+
+        # the work only takes 1/20 of the time
+        work = 0.1 * 10
+        waited = sum(self.steady(throttle, 10, 0.1))
+        self.assertAlmostEqual(work / (work + waited), 0.05)
+
+        # and slowly comes back up once the disks are free again
+        self.steady(throttle, 10)
+        self.assertGreater(throttle.duty, 0.05)
+        self.assertLess(throttle.duty, 1.0)
+        self.steady(throttle, 100)
+        self.assertEqual(throttle.duty, 1.0)
+        self.assertEqual(self.steady(throttle, 1), [0.0])
+
+    def test_duty_cycle_slows_rates_down(self):
+        throttle = sortphotos.Throttle(files_per_sec=10)
+        throttle.duty = 0.5
+        throttle.adaptive = False
+        self.assertAlmostEqual(throttle.delay('files', 5, 0), 1.0, places=2)
+
+
+class PacedCopyTest(WorkDirTest):
+
+    def test_copy_is_paced(self):
+        src_file = os.path.join(self.work_dir, 'a.jpg')
+        with open(src_file, 'wb') as f:
+            f.write(b'\0' * (1 << 20))
+        throttle = sortphotos.Throttle(bytes_per_sec=4 << 20, adaptive=False)
+        start = time.time()
+        sortphotos._copy_data(src_file, os.path.join(self.work_dir, 'b.jpg'), throttle, chunk_size=1 << 18)
+        self.assertGreaterEqual(time.time() - start, 0.2)  # a pause of 1/16 s after each of the 4 chunks
+        self.assertAlmostEqual(throttle.waited, 0.25, places=1)
+        with open(os.path.join(self.work_dir, 'b.jpg'), 'rb') as f:
+            self.assertEqual(len(f.read()), 1 << 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_tiered.py
+
+Files read with only their date tags first (--priority-tags) get the same date and tags as in a full read.
+
+"""
+
+import os
+import unittest
+
+from helpers import sortphotos, make_corpus, jpeg_with_modify_date, WorkDirTest
+
+# every date tag of the corpus files and of old.JPG
+DATE_TAGS = {
+    'JPG': ['EXIF:DateTimeOriginal', 'EXIF:ModifyDate'],
+    'MP4': ['QuickTime:CreateDate', 'QuickTime:ModifyDate', 'QuickTime:TrackCreateDate',
+            'QuickTime:TrackModifyDate', 'QuickTime:MediaCreateDate', 'QuickTime:MediaModifyDate'],
+}
+
+
+class TieredTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.counts = make_corpus(self.src_dir, 60)
+        # the oldest date is not the one of DateTimeOriginal
+        self.old = os.path.join(self.src_dir, 'old.JPG')
+        with open(self.old, 'wb') as f:
+            f.write(jpeg_with_modify_date('2015:06:01 12:00:00', '2010:01:01 00:00:00'))
+        self.files = sortphotos.list_files(self.src_dir, recursive=True)
+
+    def dates(self, reader):
+        records = reader.iter_metadata(self.files, ['-j', '-a', '-G', '-time:all'])
+        return dict((data['SourceFile'], sortphotos.get_oldest_timestamp(data, ['File'], [])[1:])
+                    for data in records)
+
+    def test_same_dates_as_a_full_read(self):
+        with sortphotos.ExifToolPool() as exiftool:
+            expected = self.dates(exiftool)
+            tiers = sortphotos.TieredReader(exiftool, DATE_TAGS, ['File'])
+            self.assertEqual(self.dates(tiers), expected)
+        self.assertEqual(len(expected), len(self.files))
+        self.assertEqual(expected[self.old][1], ['EXIF:ModifyDate'])
+        # the JPEGs without any date are read again
+        self.assertEqual(tiers.misses, self.counts['nodate'])
+        self.assertEqual(tiers.hits, len(self.files) - self.counts['nodate'])
+
+    def test_types_without_date_tags_are_read_in_full(self):
+        with sortphotos.ExifToolPool() as exiftool:
+            expected = self.dates(exiftool)
+            tiers = sortphotos.TieredReader(exiftool, {'MP4': DATE_TAGS['MP4']}, ['File'])
+            self.assertEqual(self.dates(tiers), expected)
+        self.assertEqual(tiers.hits, self.counts['mp4'])
+        self.assertEqual(tiers.misses, len(self.files) - self.counts['mp4'])
+
+    def test_same_plan_as_a_full_read(self):
+        plans = []
+        for priority_tags in [None, DATE_TAGS]:
+            plans.append(os.path.join(self.work_dir, 'plan%d.jsonl' % len(plans)))
+            sortphotos.sortPhotos(self.src_dir, os.path.join(self.work_dir, 'dst'), '%Y/%m-%b', None,
+                                  recursive=True, verbose=False, ignore_list=None, plan_file=plans[-1],
+                                  priority_tags=priority_tags)
+        expected = list(sortphotos.read_plan(plans[0]))
+        self.assertEqual(len(expected), len(self.files) - self.counts['nodate'])
+        self.assertEqual(list(sortphotos.read_plan(plans[1])), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
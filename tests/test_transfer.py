@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_transfer.py
+
+Transfers limited per destination device by TransferExecutor.
+
+"""
+
+import os
+import threading
+import unittest
+
+from helpers import sortphotos, WorkDirTest
+
+
+class BlockedExecutor(sortphotos.TransferExecutor):
+    """transfers to slow_dir only go through once released is set"""
+
+    def __init__(self, slow_dir, *args, **kwargs):
+        sortphotos.TransferExecutor.__init__(self, *args, **kwargs)
+        self.slow_dir = slow_dir
+        self.released = threading.Event()
+
+    def _run(self, operation):
+        if os.path.dirname(operation['dest']) == self.slow_dir:
+            self.released.wait(30)
+        return sortphotos.TransferExecutor._run(self, operation)
+
+
+class DeviceLimitTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.slow_dir = os.path.join(self.work_dir, 'usb-disk')
+        self.fast_dir = os.path.join(self.work_dir, 'ssd')
+        for directory in [self.src_dir, self.slow_dir, self.fast_dir]:
+            os.mkdir(directory)
+
+    def operation(self, name, dest_dir):
+        src_file = os.path.join(self.src_dir, name)
+        with open(src_file, 'wb') as f:
+            f.write(name.encode())
+        return {'action': 'copy', 'src': src_file, 'dest': os.path.join(dest_dir, name)}
+
+    def test_saturated_device_does_not_hold_up_the_others(self):
+        transfers = BlockedExecutor(self.slow_dir, jobs=2)
+        # as if the two directories were on different devices
+        transfers.devices[self.slow_dir] = -1
+        transfers.devices[self.fast_dir] = -2
+        transfers.limits = {-1: 1}  # as given by device_limits
+        with transfers:
+            try:
+                for i in range(3):
+                    transfers.submit(self.operation('slow%d.jpg' % i, self.slow_dir))
+                transfers.submit(self.operation('fast.jpg', self.fast_dir))
+                transfers.wait(os.path.join(self.fast_dir, 'fast.jpg'))
+                self.assertEqual(os.listdir(self.fast_dir), ['fast.jpg'])
+                self.assertEqual(os.listdir(self.slow_dir), [])
+            finally:
+                transfers.released.set()
+        self.assertEqual(sorted(os.listdir(self.slow_dir)), ['slow0.jpg', 'slow1.jpg', 'slow2.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
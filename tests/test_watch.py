@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_watch.py
+
+Watch mode reading the paths of new files from stdin (e.g. from fswatch), or watching with inotify.
+
+"""
+
+import os
+import sys
+import time
+import signal
+import unittest
+import subprocess
+
+from helpers import sortphotos, script, WorkDirTest
+
+
+class StdinWatcherTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.src_dir = os.path.join(self.work_dir, 'src')
+        self.dest_dir = os.path.join(self.work_dir, 'dst')
+        os.mkdir(self.src_dir)
+        self.files = [self.write_jpeg(os.path.join(self.src_dir, 'a%d.jpg' % i), '2020:05:01 10:00:0%d' % i)
+                      for i in range(3)]
+
+    def test_paths_written_at_once_are_all_sorted(self):
+        process = subprocess.Popen([sys.executable, script, '-w', '-s', '--debounce', '0.5', self.src_dir,
+                                    self.dest_dir], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            process.stdin.write(('\n'.join(self.files) + '\n').encode('utf-8'))
+            process.stdin.flush()
+            deadline = time.time() + 30
+            while os.listdir(self.src_dir) and time.time() < deadline:
+                time.sleep(0.2)
+            self.assertEqual(os.listdir(self.src_dir), [])  # sorted without waiting for more input
+        finally:
+            process.stdin.close()
+            process.stdout.read()
+            process.wait()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.dest_dir, '2020', '05-May'))),
+                         ['a0.jpg', 'a1.jpg', 'a2.jpg'])
+
+    def test_pending_files_are_sorted_on_interrupt(self):
+        process = subprocess.Popen([sys.executable, script, '-w', '-s', '--debounce', '60', self.src_dir,
+                                    self.dest_dir], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            process.stdin.write(('\n'.join(self.files) + '\n').encode('utf-8'))
+            process.stdin.flush()
+            time.sleep(2)  # read, but still waiting for the debounce delay
+            self.assertEqual(len(os.listdir(self.src_dir)), 3)
+            process.send_signal(signal.SIGINT)
+            process.stdout.read()
+            self.assertEqual(process.wait(), 0)
+        finally:
+            process.stdin.close()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        self.assertEqual(os.listdir(self.src_dir), [])
+
+    def test_file_that_always_fails_is_given_up(self):
+        bad = self.write_jpeg(os.path.join(self.src_dir, 'bad.jpg'), '2019:05:01 10:00:00')
+        os.makedirs(self.dest_dir)
+        open(os.path.join(self.dest_dir, '2019'), 'w').close()  # its directory cannot be made
+        process = subprocess.Popen([sys.executable, script, '-w', '-s', '--debounce', '0.5', self.src_dir,
+                                    self.dest_dir], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            process.stdin.write((bad + '\n').encode('utf-8'))
+            process.stdin.flush()
+            time.sleep(2)  # its run failed
+            process.stdin.write(('\n'.join(self.files) + '\n').encode('utf-8'))
+            process.stdin.flush()
+            deadline = time.time() + 30
+            while len(os.listdir(self.src_dir)) > 1 and time.time() < deadline:
+                time.sleep(0.2)
+            self.assertEqual(os.listdir(self.src_dir), ['bad.jpg'])  # the others are not held up by it
+        finally:
+            process.stdin.close()
+            output = process.stdout.read()
+            process.wait()
+        self.assertIn(b'Giving up on: ' + bad.encode('utf-8'), output)
+        self.assertEqual(output.count(b'Exception detected'), 1)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+class InotifyWatcherTest(WorkDirTest):
+
+    def read_all(self, watcher):
+        """the files of the events that came, waiting a little for the first ones"""
+
+        files = watcher.read(5)
+        while True:
+            more = watcher.read(0.2)
+            if not more:
+                return sorted(files)
+            files += more
+
+    def test_new_files_are_read(self):
+        os.mkdir(os.path.join(self.work_dir, 'sub'))
+        with sortphotos.InotifyWatcher(self.work_dir, recursive=True) as watcher:
+            self.assertEqual(watcher.read(0), [])
+            written = self.write_jpeg(os.path.join(self.work_dir, 'a.jpg'))
+            self.assertEqual(self.read_all(watcher), [written])
+
+            # moved in, and written in a subdirectory
+            outside = os.path.join(os.path.dirname(self.work_dir), os.path.basename(self.work_dir) + '.jpg')
+            self.write_jpeg(outside)
+            moved = os.path.join(self.work_dir, 'b.jpg')
+            os.rename(outside, moved)
+            nested = self.write_jpeg(os.path.join(self.work_dir, 'sub', 'c.jpg'))
+            self.assertEqual(self.read_all(watcher), [moved, nested])
+
+    def test_files_of_new_directories_are_read(self):
+        with sortphotos.InotifyWatcher(self.work_dir, recursive=True) as watcher:
+            os.mkdir(os.path.join(self.work_dir, 'new'))
+            early = self.write_jpeg(os.path.join(self.work_dir, 'new', 'a.jpg'))  # maybe before its watch
+            files = self.read_all(watcher)
+            later = self.write_jpeg(os.path.join(self.work_dir, 'new', 'b.jpg'))
+            files += self.read_all(watcher)
+        self.assertEqual(sorted(set(files)), [early, later])
+
+    def test_files_are_sorted(self):
+        src_dir = os.path.join(self.work_dir, 'src')
+        dest_dir = os.path.join(self.work_dir, 'dst')
+        os.mkdir(src_dir)
+        process = subprocess.Popen([sys.executable, script, '-w', '--inotify', '-s', '--debounce', '0.5', src_dir,
+                                    dest_dir], stdout=subprocess.PIPE)
+        try:
+            time.sleep(2)  # watching
+            self.write_jpeg(os.path.join(src_dir, 'a.jpg'), '2020:05:01 10:00:00')
+            deadline = time.time() + 30
+            while os.listdir(src_dir) and time.time() < deadline:
+                time.sleep(0.2)
+            self.assertEqual(os.listdir(src_dir), [])
+        finally:
+            process.send_signal(signal.SIGINT)
+            process.stdout.read()
+            process.wait()
+        self.assertEqual(os.listdir(os.path.join(dest_dir, '2020', '05-May')), ['a.jpg'])
+
+
+class RemovedFileTest(WorkDirTest):
+
+    def setUp(self):
+        WorkDirTest.setUp(self)
+        self.files = [self.write_jpeg(os.path.join(self.work_dir, 'a%d.jpg' % i), '2020:05:01 10:00:0%d' % i)
+                      for i in range(2)]
+
+    def test_removed_file_is_skipped_by_the_cache(self):
+        os.remove(self.files[0])  # e.g. taken back from an upload folder after it was found
+        cache = sortphotos.MetadataCache(os.path.join(self.work_dir, 'cache.sqlite'))
+        with sortphotos.ExifToolPool() as exiftool:
+            records = list(cache.iter_metadata(self.files, ['-j', '-a', '-G', '-time:all'], exiftool))
+        cache.close()
+        self.assertEqual([data['SourceFile'] for data in records], self.files[1:])
+        self.assertEqual(cache.misses, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()